@@ -0,0 +1,180 @@
+import os
+import pickle
+import threading
+import pandas as pd
+from util import log, datetimeToEpochtime, checkAndCreateDir
+from getData import getData
+from esdrSources import ESDR_SOURCES, esdrSourceNames
+
+
+class DataWindow():
+    """
+    A rolling window of raw ESDR and smell data for the last window_hr hours
+
+    Each update only pulls the readings that are newer than the last pull (minus a small overlap,
+        ...because the servers may still add or revise the latest readings), merges them into the window,
+        ...and drops the readings that are older than the window
+    The window can be stored in a file, so that predictions in separate processes (e.g., crontab) also reuse it
+        ...(a plain pickle file, since importing joblib takes about as long as a prediction with a warm window)
+    The select() function returns any time range from the window, and only pulls the parts that it does not cover
+        ...(e.g., for the HTTP service in predictionServer.py), and the object is safe to use from threads
+    """
+
+    def __init__(self, window_hr, overlap_min=30, refresh_min=0, cache_p=None, sources=None, data_source=None,
+        logger=None):
+        """
+        Initialize the class
+
+        Input:
+            window_hr (int): the number of hours to keep (e.g., b_hr+1 for the prediction)
+            overlap_min (int): the number of minutes before the last pull to pull again
+            refresh_min (int): the select() function only pulls new data if the last pull is older than this number of
+                ...minutes before the end of the requested range (0 means always pulling the new readings)
+            cache_p (str): the path for storing the window (optional)
+            sources (list of dict): the ESDR sources to pull (see esdrSources.py), None means all sources
+            data_source: the object that provides the data instead of ESDR and SmellPGH (see the getData() function)
+            logger: the python logger created by the generateLogger() function
+        """
+        self.window_hr = window_hr
+        self.overlap_min = overlap_min
+        self.refresh_min = refresh_min
+        self.cache_p = cache_p
+        self.sources = ESDR_SOURCES if sources is None else sources
+        self.data_source = data_source
+        self.logger = logger
+        self.end_time = None # the end of the last pull in epoch time (seconds)
+        self.df_esdr_array_raw = None
+        self.df_smell_raw = None
+        self.lock = threading.RLock()
+        if cache_p is not None and os.path.isfile(cache_p):
+            try:
+                with open(cache_p, "rb") as f:
+                    names, self.end_time, self.df_esdr_array_raw, self.df_smell_raw = pickle.load(f)
+                if names != self.sourceNames():
+                    # The sources changed, so the stored readings do not match the list of sources
+                    log("The ESDR sources changed, pull all data again", logger)
+                    self.end_time, self.df_esdr_array_raw, self.df_smell_raw = None, None, None
+            except Exception as e:
+                log("WARNING: cannot load the data window, pull all data again (" + str(e) + ")", logger)
+
+    def update(self, end_dt):
+        """
+        Pull the new data and return the window that ends at end_dt
+
+        Input:
+            end_dt (datetime.datetime object): the end of the window (e.g., the current time)
+
+        Output:
+            df_esdr_array_raw (list of pandas.DataFrame): raw ESDR data (see the getData() function in getData.py)
+            df_smell_raw (pandas.DataFrame): raw smell data, None if there are no smell reports
+        """
+        with self.lock:
+            return self.pull(end_dt)
+
+    def pull(self, end_dt):
+        """See the update() function"""
+        end_time = datetimeToEpochtime(end_dt) / 1000
+        start_time = end_time - self.window_hr * 3600
+
+        # Pull all data again if the window is empty or does not overlap with the requested window
+        if self.end_time is None or not (start_time <= self.end_time <= end_time):
+            pull_time = start_time
+            self.df_esdr_array_raw, self.df_smell_raw = None, None
+        else:
+            pull_time = max(start_time, self.end_time - self.overlap_min * 60)
+        pull_dt = end_dt - pd.Timedelta(seconds=end_time - pull_time)
+        log("Get data from " + str(pull_dt) + " to " + str(end_dt), self.logger)
+        df_esdr_array_new, df_smell_new = getData(start_dt=pull_dt, end_dt=end_dt, sources=self.sources,
+            data_source=self.data_source, logger=self.logger)
+
+        # Replace the readings after the pull time with the new readings, and drop the old readings
+        if self.df_esdr_array_raw is None:
+            self.df_esdr_array_raw = [None] * len(df_esdr_array_new)
+        self.df_esdr_array_raw = [mergeWindow(df_old, df_new, pull_time, start_time)
+            for df_old, df_new in zip(self.df_esdr_array_raw, df_esdr_array_new)]
+        self.df_smell_raw = mergeWindow(self.df_smell_raw, df_smell_new, pull_time, start_time)
+        self.end_time = end_time
+
+        # Store the window
+        if self.cache_p is not None:
+            checkAndCreateDir(self.cache_p)
+            data = (self.sourceNames(), self.end_time, self.df_esdr_array_raw, self.df_smell_raw)
+            with open(self.cache_p + ".tmp", "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self.cache_p + ".tmp", self.cache_p)
+        # (return a new list, because the preprocessData() function consumes the list that it gets)
+        return list(self.df_esdr_array_raw), self.df_smell_raw
+
+    def select(self, start_dt, end_dt):
+        """
+        Return the raw data between two times, from the window when it covers them
+
+        The window is updated when end_dt is more than refresh_min minutes after the last pull,
+            ...and the part before the window is pulled by the getData() function (without changing the window)
+
+        Input:
+            start_dt (datetime.datetime object): the start of the range
+            end_dt (datetime.datetime object): the end of the range
+
+        Output:
+            see the update() function
+        """
+        start_time = datetimeToEpochtime(start_dt) / 1000
+        end_time = datetimeToEpochtime(end_dt) / 1000
+        with self.lock:
+            if self.end_time is None or end_time > self.end_time + self.refresh_min * 60:
+                self.pull(end_dt)
+            window_start = self.end_time - self.window_hr * 3600
+            df_esdr_array_raw = [sliceWindow(df, start_time, end_time) for df in self.df_esdr_array_raw]
+            df_smell_raw = sliceWindow(self.df_smell_raw, start_time, end_time)
+        if df_smell_raw is not None and len(df_smell_raw) == 0:
+            df_smell_raw = None # the same as the getData() function when there are no smell reports
+        if start_time < window_start:
+            # Pull the part before the window and put it in front of the readings from the window
+            head_end_dt = start_dt + pd.Timedelta(seconds=min(window_start, end_time) - start_time)
+            log("Get data from " + str(start_dt) + " to " + str(head_end_dt) + " (before the window)", self.logger)
+            df_esdr_array_head, df_smell_head = getData(start_dt=start_dt, end_dt=head_end_dt, sources=self.sources,
+                data_source=self.data_source, logger=self.logger)
+            df_esdr_array_raw = [mergeWindow(df_head, df, window_start, start_time)
+                for df_head, df in zip(df_esdr_array_head, df_esdr_array_raw)]
+            df_smell_raw = mergeWindow(df_smell_head, df_smell_raw, window_start, start_time)
+        return df_esdr_array_raw, df_smell_raw
+
+    def sourceNames(self):
+        """Return the names of the ESDR data in the window (stored with the window to detect changed sources)"""
+        if self.data_source is not None:
+            return self.data_source.sourceNames(self.sources)
+        return esdrSourceNames(self.sources)
+
+
+def sliceWindow(df, start_time, end_time):
+    """Return the readings between two epoch times in seconds (both included), None if df is None"""
+    if df is None: return None
+    return df[(df.index >= start_time) & (df.index <= end_time)]
+
+
+def mergeWindow(df_old, df_new, pull_time, start_time):
+    """
+    Merge the newly pulled readings into the window (both are indexed by EpochTime)
+
+    Input:
+        df_old (pandas.DataFrame): the readings in the window, None if the window is empty
+        df_new (pandas.DataFrame): the readings from pull_time, None if there are no readings
+        pull_time (float): the start of the new pull in epoch time (seconds)
+        start_time (float): the start of the window in epoch time (seconds)
+
+    Output:
+        df (pandas.DataFrame): the readings in the window, None if there are no readings
+    """
+    if df_old is not None:
+        # Keep the old readings that are in the window and not pulled again
+        df_old = df_old[(df_old.index >= start_time) & (df_old.index < pull_time)]
+    if df_old is None or len(df_old) == 0:
+        df = df_new
+    elif df_new is None or len(df_new) == 0:
+        df = df_old
+    else:
+        df = pd.concat([df_old, df_new])
+    if df is None or len(df) == 0:
+        return df
+    return df.sort_index(kind="stable")
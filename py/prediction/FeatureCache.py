@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import hashlib
+import joblib
+import pandas as pd
+from collections import OrderedDict
+from util import log, checkAndCreateDir
+from computeFeatures import computeFeatures
+from Pipeline import listFiles
+
+
+class FeatureCache():
+    """
+    A cache of the outputs of computeFeatures() and of the preprocessed csv files, for analyses that compute
+        ...features many times from the same files (e.g., the functions in analyzeData.py)
+
+    Entries are keyed by the fingerprint of the input files (path, size, and modification time) and the arguments,
+        ...so changing a file or an argument gives a new entry
+    The least recently used entries are removed when the total size exceeds max_bytes,
+        ...and they are written to spill_p (if it is set), so that they can be loaded instead of computed again
+    Spilled entries of old input files are never used again, so the spill directory is pruned: entries that were not
+        ...used for max_spill_days are removed when the cache is created, and the least recently used entries are
+        ...removed when the total size of the directory exceeds max_spill_bytes
+    The cache returns copies, so callers can modify the dataframes without changing the cached entries
+    """
+
+    def __init__(self, max_bytes=2*1024**3, spill_p=None, max_spill_bytes=8*1024**3, max_spill_days=30,
+        logger=None):
+        """
+        Initialize the class
+
+        Input:
+            max_bytes (int): the maximum total size of the entries in memory
+            spill_p (str): the directory for storing the entries that are removed from memory, None means no spilling
+            max_spill_bytes (int): the maximum total size of the files in the spill directory
+            max_spill_days (float): remove the spilled entries that were not used for this number of days
+            logger: the python logger created by the generateLogger() function
+        """
+        self.max_bytes = max_bytes
+        self.spill_p = spill_p
+        self.max_spill_bytes = max_spill_bytes
+        self.max_spill_days = max_spill_days
+        self.logger = logger
+        self.entries = OrderedDict() # key: (value, size in bytes), the last entry is the most recently used
+        self.n_bytes = 0
+        self.hits, self.misses = 0, 0
+        self.pruneSpilled()
+
+    def computeFeatures(self, in_p=None, logger=None, **kwargs):
+        """
+        Return the output of the computeFeatures() function in computeFeatures.py (computed only once)
+
+        The preprocessed esdr and smell files (in_p) are also read only once (see the readCsv() function)
+        For the input arguments, see the computeFeatures() function
+        """
+        if any(kwargs.get(k) is not None for k in ["out_p", "out_p_mean", "out_p_std"]):
+            # Writing files is a side effect that a cached result would skip
+            return computeFeatures(in_p=in_p, logger=logger, **kwargs)
+        key = self.makeKey("computeFeatures", {"in_p": [listFiles(p) + [p] for p in in_p], **kwargs})
+
+        def compute():
+            df_esdr, df_smell = self.readCsv(in_p[0]), self.readCsv(in_p[1])
+            return computeFeatures(df_esdr=df_esdr.reset_index(), df_smell=df_smell.reset_index(), logger=logger,
+                **kwargs)
+        return self.get(key, compute)
+
+    def readCsv(self, p):
+        """Read a preprocessed csv file with the DateTime index (see the preprocessData() function)"""
+        key = self.makeKey("readCsv", {"p": p, "files": listFiles(p)})
+        return self.get(key, lambda: pd.read_csv(p, parse_dates=True, index_col="DateTime"))
+
+    def get(self, key, compute):
+        """
+        Return the cached value of a key, or compute and cache it
+
+        Input:
+            key (str): the key (see the makeKey() function)
+            compute (function): the function that returns the value (without arguments)
+
+        Output:
+            value: a copy of the cached value
+        """
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return copyValue(self.entries[key][0])
+        value = self.loadSpilled(key)
+        if value is None:
+            self.misses += 1
+            value = compute()
+        else:
+            self.hits += 1
+        self.put(key, value)
+        return copyValue(value)
+
+    def put(self, key, value):
+        """Add an entry and remove the least recently used entries that exceed the memory bound"""
+        size = sizeOf(value)
+        self.entries[key] = (value, size)
+        self.n_bytes += size
+        while self.n_bytes > self.max_bytes and len(self.entries) > 0:
+            old_key, (old_value, old_size) = self.entries.popitem(last=False)
+            self.n_bytes -= old_size
+            self.spill(old_key, old_value)
+
+    def spill(self, key, value):
+        """Write an entry that is removed from memory to the spill directory"""
+        if self.spill_p is None: return
+        p = os.path.join(self.spill_p, key + ".pkl")
+        if os.path.isfile(p):
+            os.utime(p) # mark the entry as recently used
+            return
+        checkAndCreateDir(p)
+        joblib.dump(value, p + ".tmp")
+        os.replace(p + ".tmp", p)
+        log("Spilled a cache entry to " + p, self.logger)
+        self.pruneSpilled()
+
+    def loadSpilled(self, key):
+        """Load an entry from the spill directory, None if it does not exist"""
+        if self.spill_p is None: return None
+        p = os.path.join(self.spill_p, key + ".pkl")
+        if not os.path.isfile(p): return None
+        try:
+            value = joblib.load(p)
+        except Exception as e:
+            log("WARNING: cannot load the cache entry " + p + " (" + str(e) + ")", self.logger, level="warning")
+            return None
+        os.utime(p) # mark the entry as recently used (see the pruneSpilled() function)
+        return value
+
+    def pruneSpilled(self):
+        """
+        Remove the spilled entries that were not used for max_spill_days, and then the least recently used entries
+            ...until the total size of the spill directory is at most max_spill_bytes
+
+        The modification time of a file is the last time that its entry was spilled or loaded
+        """
+        if self.spill_p is None or not os.path.isdir(self.spill_p): return
+        files = []
+        for f in os.listdir(self.spill_p):
+            p = os.path.join(self.spill_p, f)
+            if not f.endswith(".pkl") or not os.path.isfile(p): continue
+            st = os.stat(p)
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort() # the least recently used file first
+        n_bytes = sum(size for _, size, _ in files)
+        min_time = time.time() - self.max_spill_days * 86400 if self.max_spill_days is not None else None
+        n_removed = 0
+        for mtime, size, p in files:
+            too_old = min_time is not None and mtime < min_time
+            too_big = self.max_spill_bytes is not None and n_bytes > self.max_spill_bytes
+            if not too_old and not too_big: break
+            try:
+                os.remove(p)
+            except OSError:
+                continue
+            n_bytes -= size
+            n_removed += 1
+        if n_removed > 0:
+            log("Removed " + str(n_removed) + " old entries from the cache directory " + self.spill_p, self.logger)
+
+    def makeKey(self, name, params):
+        """Hash the name and the parameters (json serializable, or converted by str)"""
+        content = json.dumps({"name": name, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def sizeOf(value):
+    """Estimate the memory size of a dataframe, a series, or a tuple of them (None counts as zero)"""
+    if isinstance(value, (tuple, list)):
+        return sum(sizeOf(v) for v in value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    return 0
+
+
+def copyValue(value):
+    """Copy a dataframe, a series, or a tuple of them"""
+    if isinstance(value, tuple):
+        return tuple(copyValue(v) for v in value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=True)
+    return value
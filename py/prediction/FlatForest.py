@@ -0,0 +1,219 @@
+import numpy as np
+import time
+from util import log
+
+
+class FlatForest():
+    """
+    A tree ensemble that predicts from the flattened node arrays of all trees (see modelArtifact.py)
+
+    All rows and all trees are traversed together, one tree level per step, with numpy operations,
+        ...so predicting one row does not pay the per-tree python and thread dispatching cost of scikit-learn
+    The node arrays are used as they are (no copies), so memory-mapped arrays stay shared between processes
+    For large batches (thousands of rows), the compiled traversal of scikit-learn is faster
+        ...(see the compareWithSklearn() function for validating and benchmarking both)
+    """
+
+    def __init__(self, nodes, values, offsets, max_depth, classes=None, n_features_in=None, feature_names=None,
+        batch_size=1000000, logger=None):
+        """
+        Initialize the class
+
+        Input:
+            nodes (numpy.ndarray): the nodes of all trees concatenated (the structured array in sklearn's Tree)
+            values (numpy.ndarray): the values of all nodes, shape (n_nodes, n_outputs, max_n_classes)
+            offsets (numpy.ndarray): node i of tree t is at offsets[t] + i, shape (n_trees + 1,)
+            max_depth (int): the maximum depth of all trees
+            classes (list of numpy.ndarray): the classes for each output, None means a regression model
+            n_features_in (int): the number of features
+            feature_names (list of str): the feature columns in the order that the model uses
+            batch_size (int): the maximum number of (row, tree) pairs to traverse at once (bounds the memory usage)
+            logger: the python logger created by the generateLogger() function
+        """
+        self.left = nodes["left_child"]
+        self.right = nodes["right_child"]
+        self.feature = nodes["feature"]
+        self.threshold = nodes["threshold"]
+        self.values = values
+        self.offsets = offsets
+        self.roots = np.asarray(offsets[:-1], dtype=np.int64)
+        self.max_depth = int(max_depth)
+        self.is_regr = classes is None
+        self.n_outputs_ = values.shape[1]
+        self.n_features_in_ = n_features_in
+        if not self.is_regr:
+            self.classes_ = classes[0] if self.n_outputs_ == 1 else classes
+            self.n_classes_ = [len(c) for c in classes]
+        if feature_names is not None:
+            self.feature_names_in_ = np.array(feature_names, dtype=object)
+        self.batch_size = batch_size
+        self.logger = logger
+
+    @classmethod
+    def fromEstimator(cls, estimator, **kwargs):
+        """Flatten a trained scikit-learn tree ensemble (or a single decision tree)"""
+        trees = estimator.estimators_ if hasattr(estimator, "estimators_") else [estimator]
+        nodes, values, offsets, max_depth = flattenTrees(trees)
+        classes = None
+        if hasattr(estimator, "classes_"):
+            classes = estimator.classes_ if estimator.n_outputs_ > 1 else [estimator.classes_]
+        if "feature_names" not in kwargs and hasattr(estimator, "feature_names_in_"):
+            kwargs["feature_names"] = estimator.feature_names_in_
+        return cls(nodes, values, offsets, max(max_depth), classes=classes, n_features_in=estimator.n_features_in_,
+            **kwargs)
+
+    def apply(self, X):
+        """
+        Find the leaf of each tree for each row
+
+        Input:
+            X (numpy.ndarray or pandas.DataFrame): the features, shape (n_rows, n_features)
+
+        Output:
+            leaves (numpy.ndarray): the global node index of the leaves, shape (n_rows, n_trees)
+        """
+        # Use the same precision as scikit-learn (features are float32 and thresholds are float64)
+        X = np.asarray(X, dtype=np.float32)
+        n_rows, n_trees = len(X), len(self.roots)
+        row = np.repeat(np.arange(n_rows), n_trees)
+        root = np.tile(self.roots, n_rows)
+        node = root.copy()
+
+        # Only keep the (row, tree) pairs that have not reached a leaf yet
+        active = np.arange(n_rows * n_trees)
+        for _ in range(self.max_depth):
+            n = node[active]
+            left = self.left[n]
+            is_split = left >= 0 # the children of leaves are -1
+            active, n, left = active[is_split], n[is_split], left[is_split]
+            if len(active) == 0: break
+            go_left = X[row[active], self.feature[n]] <= self.threshold[n]
+            node[active] = np.where(go_left, left, self.right[n]) + root[active]
+        return node.reshape(n_rows, n_trees)
+
+    def predictValues(self, X):
+        """Average the (normalized) leaf values over all trees, shape (n_rows, n_outputs, max_n_classes)"""
+        n_trees = len(self.roots)
+        step = max(1, self.batch_size // n_trees)
+        result = []
+        for i in range(0, len(X), step):
+            v = self.values[self.apply(X[i:i+step])]
+            if not self.is_regr:
+                # Convert the class counts in each leaf into probabilities
+                v = v / v.sum(axis=3, keepdims=True)
+            result.append(v.mean(axis=1))
+        if len(result) == 0:
+            return np.zeros((0,) + self.values.shape[1:])
+        return np.concatenate(result)
+
+    def checkInput(self, X):
+        """
+        Check the features and return them as a numpy array in the order that the model uses
+
+        Like scikit-learn, the number of features must match, and a pandas.DataFrame must have the feature names
+            ...that the model was trained with (the columns are reordered by name, so a different order is fine)
+        """
+        if hasattr(X, "columns") and hasattr(self, "feature_names_in_"):
+            columns = [str(c) for c in X.columns]
+            if columns != list(self.feature_names_in_):
+                missing = sorted(set(self.feature_names_in_) - set(columns))
+                unexpected = sorted(set(columns) - set(self.feature_names_in_))
+                if len(missing) > 0 or len(unexpected) > 0:
+                    raise ValueError("The feature names do not match the model, missing " + str(missing[:5]) +
+                        " (" + str(len(missing)) + " in total), unexpected " + str(unexpected[:5]) + " (" +
+                        str(len(unexpected)) + " in total)")
+                X = X.set_axis(columns, axis=1)[list(self.feature_names_in_)]
+        X = np.asarray(X)
+        if X.ndim != 2:
+            raise ValueError("Expected 2D features, got an array with shape " + str(X.shape))
+        if self.n_features_in_ is not None and X.shape[1] != self.n_features_in_:
+            raise ValueError("X has " + str(X.shape[1]) + " features, but the model is expecting " +
+                str(self.n_features_in_) + " features as input")
+        return X
+
+    def predict_proba(self, X):
+        """Compute the probability for each class (the same output as scikit-learn)"""
+        X = self.checkInput(X)
+        v = self.predictValues(X)
+        if self.n_outputs_ == 1:
+            return v[:, 0, :self.n_classes_[0]]
+        return [v[:, k, :n] for k, n in enumerate(self.n_classes_)]
+
+    def predict(self, X):
+        """Predict the class (or the regression value) for each row"""
+        X = self.checkInput(X)
+        if self.is_regr:
+            v = self.predictValues(X)[:, :, 0]
+            return v[:, 0] if self.n_outputs_ == 1 else v
+        proba = self.predict_proba(X)
+        if self.n_outputs_ == 1:
+            return self.classes_.take(np.argmax(proba, axis=1))
+        return np.stack([c.take(np.argmax(p, axis=1)) for c, p in zip(self.classes_, proba)], axis=1)
+
+
+def flattenTrees(trees):
+    """
+    Concatenate the node arrays of scikit-learn decision trees
+
+    Input:
+        trees (list): the trained decision trees (e.g., the estimators_ attribute of a random forest)
+
+    Output:
+        nodes (numpy.ndarray): the nodes of all trees (the structured array in sklearn's Tree)
+            ...the children indices are local to each tree
+        values (numpy.ndarray): the values of all nodes, shape (n_nodes, n_outputs, max_n_classes)
+        offsets (numpy.ndarray): node i of tree t is at offsets[t] + i, shape (n_trees + 1,)
+        max_depth (list of int): the maximum depth of each tree
+    """
+    states = [t.tree_.__getstate__() for t in trees]
+    offsets = np.cumsum([0] + [s["node_count"] for s in states]).astype(np.int64)
+    n_outputs = states[0]["values"].shape[1]
+    values = np.zeros((offsets[-1], n_outputs, max(s["values"].shape[2] for s in states)))
+    for s, start in zip(states, offsets):
+        values[start:start+s["node_count"], :, :s["values"].shape[2]] = s["values"]
+    nodes = np.concatenate([s["nodes"] for s in states])
+    return nodes, values, offsets, [int(s["max_depth"]) for s in states]
+
+
+def compareWithSklearn(estimator, flat, X, batch_sizes=[1, 10000], n_repeats=5, logger=None):
+    """
+    Validate the FlatForest against the scikit-learn estimator and compare the prediction time
+
+    Input:
+        estimator: the trained scikit-learn tree ensemble
+        flat (FlatForest): the flattened version of the estimator
+        X (numpy.ndarray or pandas.DataFrame): the features for testing (rows are repeated if there are not enough)
+        batch_sizes (list of int): the number of rows in each prediction call
+        n_repeats (int): the number of calls for measuring the time (the median is reported)
+        logger: the python logger created by the generateLogger() function
+
+    Output:
+        result (dict): for each batch size, the maximum absolute difference of the probabilities,
+            ...and the median time in seconds of scikit-learn and of the FlatForest
+    """
+    result = {}
+    for b in batch_sizes:
+        idx = np.arange(b) % len(X)
+        Xb = X.iloc[idx] if hasattr(X, "iloc") else X[idx]
+        t = {"sklearn": [], "flat": []}
+        for _ in range(n_repeats):
+            start = time.perf_counter()
+            p_sk = predictValues(estimator, Xb)
+            t["sklearn"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            p_flat = predictValues(flat, Xb)
+            t["flat"].append(time.perf_counter() - start)
+        result[b] = {"max_abs_diff": float(np.max(np.abs(p_sk - p_flat))),
+            "sklearn_time": float(np.median(t["sklearn"])), "flat_time": float(np.median(t["flat"]))}
+        log("Batch size " + str(b) + ": max abs diff = " + str(result[b]["max_abs_diff"]) + ", sklearn = " +
+            str(round(1000 * result[b]["sklearn_time"], 3)) + " ms, flat = " +
+            str(round(1000 * result[b]["flat_time"], 3)) + " ms", logger)
+    return result
+
+
+def predictValues(model, X):
+    """Return predict_proba for classifiers and predict for regressors as one numpy array"""
+    if hasattr(model, "classes_"):
+        p = model.predict_proba(X)
+        return np.concatenate(p, axis=1) if isinstance(p, list) else p
+    return model.predict(X)
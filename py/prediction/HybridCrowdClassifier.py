@@ -35,35 +35,75 @@ class HybridCrowdClassifier():
             1 means the event predictedd by the base estimator
             2 means the event noticed by the crowd
         """
-        # Use crowd to predict result
-        pred = np.squeeze(crowd>=self.crowd_thr) * 2
+        return self.predict_with_proba(X, crowd, X_thr=X_thr, proba=False)[0]
+
+    def predict_proba(self, X, crowd):
+        """Compute the probability for each class when predicting the result"""
+        return self.predict_with_proba(X, crowd, pred=False)[1]
+
+    def predict_with_proba(self, X, crowd, X_thr=0.5, pred=True, proba=True):
+        """
+        Compute the output of both predict() and predict_proba() with one evaluation of the base estimator
+
+        For a multi-output base estimator (e.g., several horizons or thresholds, see computeFeatures.py),
+            ...pred has one column for each output and prob is a list with one array for each output
+            ...if crowd has one column, the crowd-based event applies to all outputs,
+            ...otherwise the outputs are grouped in the order of the crowd columns (e.g., one group for each region),
+            ...and each group uses its own crowd column (see the getResponseNames() function in computeFeatures.py)
+
+        Output:
+            pred (numpy.ndarray): the output of predict(), None if pred is False
+            prob (numpy.ndarray): the output of predict_proba(), None if proba is False
+        """
+        prob_model = None
+        if self.base_estimator is not None:
+            prob_model = self.base_estimator.predict_proba(X)
+        multi_output = isinstance(prob_model, list)
+        if multi_output:
+            prob_model = [toBinaryProba(p, c) for p, c in zip(prob_model, self.base_estimator.classes_)]
+        elif prob_model is not None:
+            prob_model = toBinaryProba(prob_model, self.base_estimator.classes_)
+        crowd = np.asarray(crowd).reshape(len(crowd), -1)
+        if multi_output and crowd.shape[1] > 1:
+            n_outputs = len(prob_model)
+            if n_outputs % crowd.shape[1] != 0:
+                raise ValueError("Cannot match " + str(crowd.shape[1]) + " crowd columns with " +
+                    str(n_outputs) + " outputs")
+            is_crowd_all = np.repeat(crowd >= self.crowd_thr, n_outputs // crowd.shape[1], axis=1)
+        else:
+            is_crowd_all = None
+        is_crowd = crowd[:, 0] >= self.crowd_thr
 
+        # Use crowd to predict result
         # Use the model to predict result and merge them
         # if pred==0, no event
         # if pred==1, event predicted by the base estimator
         # if pred==2, event detected by the crowd
         # if pred==3, event both predicted by the base estimator and detected by the crowd
-        if self.base_estimator is not None:
-            prob_model = self.base_estimator.predict_proba(X)
-            pred_model = (prob_model[:,1] > X_thr).astype(int)
-            pred += pred_model
+        y_pred = None
+        if pred:
+            y_pred = is_crowd.astype(int) * 2
+            if multi_output:
+                y_crowd = y_pred[:, None] if is_crowd_all is None else is_crowd_all.astype(int) * 2
+                y_pred = y_crowd + np.stack([(p[:,1] > X_thr).astype(int) for p in prob_model], axis=1)
+            elif prob_model is not None:
+                y_pred += (prob_model[:,1] > X_thr).astype(int)
 
-        return pred
-
-    def predict_proba(self, X, crowd):
-        """Compute the probability for each class when predicting the result"""
         # Replace value > crowd_thr with [0.0, 1.0]
-        L = len(crowd)
-        prob = np.array([[1.0, 0.0]]*L)
-        prob[np.squeeze(crowd>=self.crowd_thr)] = [0.0, 1.0]
+        prob = None
+        if proba:
+            prob = []
+            for k, p in enumerate(prob_model if multi_output else [prob_model]):
+                if is_crowd_all is not None: is_crowd = is_crowd_all[:, k]
+                pr = np.array([[1.0, 0.0]]*len(is_crowd))
+                pr[is_crowd] = [0.0, 1.0]
+                if p is not None:
+                    # If no crowd event, then the prediction uses the base estimator
+                    pr[~is_crowd] = p[~is_crowd]
+                prob.append(pr)
+            if not multi_output: prob = prob[0]
 
-        if self.base_estimator is not None:
-            prob_model = self.base_estimator.predict_proba(X)
-            # If no crowd event, then the prediction uses the base estimator
-            idx = np.squeeze(crowd<self.crowd_thr)
-            prob[idx] = prob_model[idx]
-
-        return prob
+        return y_pred, prob
 
     def save(self, out_path):
         """Override the function for saving the model"""
@@ -78,3 +118,11 @@ class HybridCrowdClassifier():
         print(msg)
         if self.logger is not None:
             self.logger.info(msg)
+
+
+def toBinaryProba(p, classes):
+    """Convert the output of predict_proba to two columns, [P(no event), P(event)], even if a class was not trained"""
+    if p.shape[1] == 2:
+        return p
+    p1 = p[:, list(classes).index(1)] if 1 in list(classes) else np.zeros(len(p))
+    return np.stack([1 - p1, p1], axis=1)
@@ -9,46 +9,159 @@ from sklearn.tree import DecisionTreeClassifier
 from sklearn.tree import export_graphviz
 #from sklearn.linear_model import LogisticRegression
 from selectFeatures import selectFeatures
+from computeFeatureImportance import computePermutationImportance
 from sklearn.metrics import silhouette_score
 from sklearn.cluster import MeanShift
 from scipy.stats import pointbiserialr
+from scipy import sparse
 import pandas as pd
 import seaborn as sns
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 
+def generateSyntheticSamples(X, n_sets=1, seed=None):
+    """
+    Generate synthetic samples for running the random forest in the unsupervised mode
+
+    Input:
+        X (numpy.ndarray): the original samples with shape (n_samples, n_features)
+        n_sets (int): the number of synthetic sets, for example one set for each repeated run
+        seed (int): the random seed for reproducibility
+
+    Output:
+        synthetic (numpy.ndarray): the synthetic sets with shape (n_sets, n_samples, n_features)
+            ...each column in each set is an independent permutation of the same column in X
+    """
+    X = np.asarray(X)
+    synthetic = np.empty((n_sets,) + X.shape, dtype=X.dtype)
+    synthetic[:] = X # broadcast the original samples into the preallocated array
+    rng = np.random.default_rng(seed)
+    rng.permuted(synthetic, axis=1, out=synthetic) # shuffle every column of every set independently
+    return synthetic
+
+
+def pruneDecisionTree(dt, thr=40):
+    """
+    Prune the nodes that do not lead to positive labels in a fitted decision tree
+
+    A node wants to be pruned if num_neg>num_pos or num_neg+num_pos<thr
+        ...num_neg>num_pos means number of negative labels larger than positive labels
+        ...num_neg+num_pos<thr means sample size too small
+    A leaf node is pruned if it wants to be pruned,
+        ...and a non-leaf node is pruned only if it and all its children want to be pruned
+    The tree is processed level by level from the deepest level (a post-order pass without recursion),
+        ...so this works for very deep trees
+
+    Input:
+        dt (sklearn.tree.DecisionTreeClassifier): the fitted decision tree with labels 0 and 1
+        thr (int): the minimum number of samples for keeping a node
+
+    Output:
+        dt_pruned (sklearn.tree.DecisionTreeClassifier): a pruned copy of the decision tree
+            ...(the input tree is not modified)
+    """
+    tree = dt.tree_
+    left, right = tree.children_left, tree.children_right
+    is_leaf = left == -1
+
+    # Compute the depth of each node
+    depth = np.zeros(tree.node_count, dtype=int)
+    frontier = np.array([0])
+    d = 0
+    while len(frontier) > 0:
+        depth[frontier] = d
+        frontier = frontier[~is_leaf[frontier]]
+        frontier = np.concatenate([left[frontier], right[frontier]])
+        d += 1
+
+    # Number of negative and positive samples for each node
+    v = tree.value[:, 0, :]
+    v = v / v.sum(axis=1, keepdims=True) * tree.weighted_n_node_samples[:, None]
+    want = (v[:, 0] > v[:, 1]) | (v[:, 0] + v[:, 1] < thr)
+
+    # Mark nodes that need to be pruned, from the deepest level to the root
+    want_pruned = np.zeros(tree.node_count, dtype=bool)
+    for d in range(depth.max(), -1, -1):
+        nodes = np.where(depth == d)[0]
+        leaf = is_leaf[nodes]
+        children_pruned = np.zeros(len(nodes), dtype=bool)
+        children_pruned[~leaf] = want_pruned[left[nodes[~leaf]]] & want_pruned[right[nodes[~leaf]]]
+        want_pruned[nodes] = want[nodes] & (leaf | children_pruned)
+
+    # Cut the pruned non-leaf nodes in a copy of the tree
+    dt_pruned = deepcopy(dt)
+    cut = want_pruned & ~is_leaf
+    dt_pruned.tree_.children_left[cut] = -1
+    dt_pruned.tree_.children_right[cut] = -1
+    return dt_pruned
+
+
+def pruneForest(forest, thr=40):
+    """
+    Prune every tree in a fitted forest (see the pruneDecisionTree function)
+
+    Input:
+        forest (sklearn.ensemble.RandomForestClassifier or ExtraTreesClassifier): the fitted forest
+        thr (int): the minimum number of samples for keeping a node
+
+    Output:
+        (list of sklearn.tree.DecisionTreeClassifier): pruned copies of all trees in the forest
+    """
+    return [pruneDecisionTree(dt, thr=thr) for dt in forest.estimators_]
+
+
 class Interpreter():
     """
     This class builds and interprets the model
     """
+    # Parameters of DBSCAN for clustering samples with label 1
+    dbscan_eps = 0.965
+    dbscan_min_samples = 30
+    # Number of samples for the silhouette score with the sparse graph (the score needs a dense distance matrix)
+    sparse_silhouette_sample_size = 2000
+
     def __init__(self,
         df_X=None, # the predictors, a pandas dataframe
         df_Y=None, # the responses, a pandas dataframe
         out_p=None, # the path for saving graphs
         use_forest=True, # use random forest or not
         n_trees=200, # the number of trees for the forest (in the paper we use 1000)
+        sparse_graph=True, # cluster on a sparse radius-neighbors graph instead of a dense distance matrix
+        silhouette_sample_size="auto", # number of samples for the silhouette score (None means all samples,
+            # ..."auto" means sparse_silhouette_sample_size with the sparse graph and all samples without it)
+        synthetic=None, # the synthetic second class (output of generateSyntheticSamples), None means generating one
+        seed=None, # the random seed for generating the synthetic second class
+        importance="impurity", # "impurity" or "permutation", the method for reporting feature importance
         logger=None):
 
-        df_X = deepcopy(df_X)
-        df_Y = deepcopy(df_Y)
+        # Only the labels are modified in place later, so there is no need to copy the predictors
+        df_Y = df_Y.copy(deep=True)
 
         # We need to run the random forest in the unsupervised mode
         # Consider the original data as class 1
         # Create a synthetic second class of the same size that will be labeled as class 2
-        # The synthetic class is created by sampling at random from the univariate distributions of the original data
-        n = len(df_X)
-        synthetic = {}
-        for c in df_X.columns:
-            synthetic[c] = df_X[c].sample(n=n, replace=True).values
-        df_synthetic = pd.DataFrame(data=synthetic)
+        # The synthetic class is created by permuting each column of the original data independently,
+        # ...which keeps the univariate distributions but breaks the dependency between variables
+        if synthetic is None:
+            synthetic = generateSyntheticSamples(df_X.values, n_sets=1, seed=seed)[0]
+        df_synthetic = pd.DataFrame(data=synthetic, columns=df_X.columns)
         df_XX = pd.concat([df_X, df_synthetic])
-        df_YY = pd.concat([df_Y.applymap(lambda x: 1), df_Y.applymap(lambda x: -1)])
+        df_YY = pd.concat([
+            pd.DataFrame(data=np.ones(df_Y.shape, dtype=int), index=df_Y.index, columns=df_Y.columns),
+            pd.DataFrame(data=np.full(df_Y.shape, -1, dtype=int), index=df_Y.index, columns=df_Y.columns)])
 
         self.df_XX, self.df_YY = df_XX, df_YY
         self.df_X, self.df_Y = df_X, df_Y
         self.out_p = out_p
         self.logger = logger
+        self.sparse_graph = sparse_graph
+        if silhouette_sample_size == "auto":
+            silhouette_sample_size = self.sparse_silhouette_sample_size if sparse_graph else None
+        self.silhouette_sample_size = silhouette_sample_size
+        self.importance = importance
 
         if use_forest:
             # Fit the predictive model
@@ -56,7 +169,7 @@ class Interpreter():
             F = RandomForestClassifier(n_estimators=n_trees, max_features=0.15, n_jobs=-1, min_samples_split=4)
             F.fit(df_XX, df_YY.squeeze())
             self.reportPerformance(F, df_XX, df_YY)
-            self.reportFeatureImportance(F, df_XX, thr=0.3)
+            self.reportFeatureImportance(F, df_XX, thr=0.3, df_Y=df_YY)
 
             # Build the decision paths of samples with label 1
             # self.dp_rules contains all decision paths of positive labels
@@ -67,8 +180,13 @@ class Interpreter():
             self.dp_rules, self.dp_samples, self.df_X_pos, self.df_X_pos_idx = self.extractDecisionPath(F)
 
             # Compute the similarity matrix of samples having label 1
+            # (in the sparse mode, self.sm is a sparse distance graph that only stores the pairs within dbscan_eps,
+            # ...which are the only pairs that DBSCAN uses, so the clusters are the same but the graph is smaller)
             self.log("Compute the similarity matrix of samples with label 1...")
-            self.sm = self.computeSampleSimilarity(n_trees)
+            if sparse_graph:
+                self.sm = self.computeSampleGraph(n_trees, max_dist=self.dbscan_eps)
+            else:
+                self.sm = self.computeSampleSimilarity(n_trees)
 
             # Cluster samples with label 1 based on the similarity matrix
             self.log("Cluster samples with label 1...")
@@ -134,7 +252,7 @@ class Interpreter():
         dt = DecisionTreeClassifier(min_samples_split=10, max_depth=8, min_samples_leaf=5)
         dt.fit(self.df_X, self.df_Y.squeeze())
         self.reportPerformance(dt, self.df_X, self.df_Y)
-        self.reportFeatureImportance(dt, self.df_X)
+        self.reportFeatureImportance(dt, self.df_X, df_Y=self.df_Y)
         dt = self.selectDecisionTreePaths(dt)
         self.exportTreeGraph(dt)
 
@@ -164,41 +282,8 @@ class Interpreter():
 
     # Only select paths that lead to positive labels
     def selectDecisionTreePaths(self, dt):
-        tree = dt.tree_
-        self.dt_children_left = tree.children_left
-        self.dt_children_right = tree.children_right
-        #feature = tree.feature
-        #threshold = tree.threshold
-        self.dt_value = tree.value
-        self.dt_want_pruned = np.zeros(shape=tree.node_count, dtype=bool)
-
-        # Perform post-order DFS to mark nodes that need to be pruned
         self.log("Pruning nodes...")
-        self.postorderTraversal(0, 0)
-        return dt
-
-    # i is the current node id
-    # p is the parent node id
-    def postorderTraversal(self, i, depth):
-        if self.dt_children_left[i] != -1:
-            self.postorderTraversal(self.dt_children_left[i], depth+1)
-        if self.dt_children_right[i] != -1:
-            self.postorderTraversal(self.dt_children_right[i], depth+1)
-        # Check if this node want to be pruned (num_neg>num_pos or num_neg+num_pos<thr)
-        # num_neg>num_pos means number of negative labels larger than positive labels
-        # num_neg+num_pos<thr means sample size too small
-        left, right = self.dt_children_left[i], self.dt_children_right[i]
-        v = self.dt_value[i][0]
-        thr = 40
-        if v[0] > v[1] or v[0] + v[1] < thr:
-            if left != -1 and right != -1: # not a leaf node
-                # Only want to be pruned if all childs want to be pruned
-                if self.dt_want_pruned[left] and self.dt_want_pruned[right]:
-                    self.dt_want_pruned[i] = True
-                    self.dt_children_left[i] = -1
-                    self.dt_children_right[i] = -1
-            else: # a leaf node
-                self.dt_want_pruned[i] = True
+        return pruneDecisionTree(dt)
 
     def reportCoefficient(self, model):
         for (c, fn) in zip(np.squeeze(model.coef_), self.df_X.columns.values):
@@ -224,9 +309,17 @@ class Interpreter():
                 filled=True)
 
     def clusterSamplesWithPositiveLabels(self):
-        c = DBSCAN(metric="precomputed", min_samples=30, eps=0.965, n_jobs=-1) # for Random Forest
-        dist = 1.0 - self.sm # DBSCAN uses distance instead of similarity
-        cluster = c.fit_predict(dist)
+        if self.sparse_graph:
+            # Missing entries in the sparse graph are not neighbors (they have distance 1, larger than eps)
+            # DBSCAN counts a sample as its own neighbor in a sparse graph but not in the dense matrix
+            # (the diagonal of the dense distance matrix is 1, which is larger than eps),
+            # ...so we add one to min_samples to get the same clusters as the dense version
+            c = DBSCAN(metric="precomputed", min_samples=self.dbscan_min_samples+1, eps=self.dbscan_eps, n_jobs=-1)
+            cluster = c.fit_predict(self.sm)
+        else:
+            c = DBSCAN(metric="precomputed", min_samples=self.dbscan_min_samples, eps=self.dbscan_eps, n_jobs=-1)
+            dist = 1.0 - self.sm # DBSCAN uses distance instead of similarity
+            cluster = c.fit_predict(dist)
 
         # Clean clusters
         self.log("Select only the largest cluster")
@@ -243,12 +336,42 @@ class Interpreter():
 
         # Evaluate the quality of the cluster
         if len(np.unique(cluster)) > 1:
-            qc1 = silhouette_score(dist, cluster, metric="precomputed") # on the distance space
+            qc1, qc2 = self.computeSilhouetteScore(cluster)
             self.log("Silhouette coefficient on the distance space: %0.3f" % qc1)
-            qc2 = silhouette_score(self.df_X_pos, cluster) # on the original space
             self.log("Silhouette coefficient on the original space: %0.3f" % qc2)
         return cluster
 
+    def computeSilhouetteScore(self, cluster):
+        """
+        Compute the silhouette score on the distance space and on the original space
+        If silhouette_sample_size is set, only a random subset of samples is used,
+        ...which avoids building the dense L*L distance matrix for the sparse graph
+        In the sparse mode, all pairs that are not stored in the graph have distance 1,
+        ...which includes the pairs farther than dbscan_eps (i.e., the distance is truncated at eps),
+        ...so the score on the distance space is not comparable with the score of the dense mode
+        """
+        L = len(cluster)
+        n = self.silhouette_sample_size
+        if n is not None and n < L:
+            idx = np.sort(np.random.choice(L, n, replace=False))
+        else:
+            idx = np.arange(L)
+        if len(np.unique(cluster[idx])) < 2:
+            return np.nan, np.nan
+        if self.sparse_graph:
+            # Pairs that are not stored in the sparse graph have distance 1 (no shared leaf, or farther than eps)
+            # Stored entries are copied by their positions, so explicit zero distances stay zero
+            dist = self.sm[idx][:, idx].tocoo()
+            dist_dense = np.ones((len(idx), len(idx)))
+            dist_dense[dist.row, dist.col] = dist.data
+            np.fill_diagonal(dist_dense, 0)
+        else:
+            dist_dense = 1.0 - self.sm[np.ix_(idx, idx)]
+            np.fill_diagonal(dist_dense, 0)
+        qc1 = silhouette_score(dist_dense, cluster[idx], metric="precomputed") # on the distance space
+        qc2 = silhouette_score(self.df_X_pos.iloc[idx], cluster[idx]) # on the original space
+        return qc1, qc2
+
     def plotClusters(self, df_X, df_Y, out_p):
         # Visualize the clusters using PCA
         self.log("Plot PCA of positive labels...")
@@ -286,6 +409,48 @@ class Interpreter():
 
         return sm / n_trees
 
+    def computeSampleGraph(self, n_trees, max_dist=None, batch_size=10000000):
+        """
+        Compute the sparse neighbors graph of samples having label 1
+        The similarity of two samples is the fraction of trees where they share the same leaf,
+        ...and the graph stores the distance (1 - similarity) of pairs that share at least one leaf
+        Pairs that never share a leaf have distance 1 and are not stored
+        If max_dist is set, only pairs with distance <= max_dist are stored (a radius-neighbors graph)
+        Pair counts are accumulated in batches, so the memory is bounded by the number of non-zero entries
+        """
+        L = len(self.df_X_pos)
+        counts = sparse.csr_matrix((L, L))
+        rows, cols = [], []
+        n_pairs = 0
+        for k in self.dp_samples:
+            s = np.array(self.dp_samples[k])
+            if len(s) < 2: continue
+            i, j = np.triu_indices(len(s), k=1)
+            rows.append(s[i])
+            cols.append(s[j])
+            n_pairs += len(i)
+            if n_pairs >= batch_size:
+                counts = counts + self.pairsToMatrix(rows, cols, L)
+                rows, cols = [], []
+                n_pairs = 0
+        if n_pairs > 0:
+            counts = counts + self.pairsToMatrix(rows, cols, L)
+        counts = (counts + counts.T).tocsr() # the similarity matrix is symmetric
+
+        # Convert similarity to distance and sort each row by distance (DBSCAN prefers sorted sparse graphs)
+        # Explicit zero distances (samples sharing leaves in all trees) must be kept in the graph
+        dist = 1.0 - counts.data / n_trees
+        row = np.repeat(np.arange(L), np.diff(counts.indptr))
+        keep = np.ones(len(dist), dtype=bool) if max_dist is None else (dist <= max_dist)
+        dist, row, col = dist[keep], row[keep], counts.indices[keep]
+        order = np.lexsort((dist, row))
+        indptr = np.append(0, np.cumsum(np.bincount(row, minlength=L)))
+        return sparse.csr_matrix((dist[order], col[order], indptr), shape=(L, L))
+
+    def pairsToMatrix(self, rows, cols, L):
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(L, L))
+
     def extractDecisionPath(self, model, extract_rule=False):
         # Store all decision path rules
         # key: (tree_id, leaf_id), a tuple
@@ -352,16 +517,25 @@ class Interpreter():
         metric = computeMetric(df_Y[dt_idx], model.predict(df_X[dt_idx]), False)
         for m in metric: self.log(metric[m])
 
-    def reportFeatureImportance(self, model, df_X, thr=0.9):
-        feat_ims = np.array(model.feature_importances_)
-        sorted_ims_idx = np.argsort(feat_ims)[::-1]
-        feat_ims = np.round(feat_ims[sorted_ims_idx], 5)
-        feat_names = df_X.columns.copy()
-        feat_names = feat_names[sorted_ims_idx]
+    def reportFeatureImportance(self, model, df_X, thr=0.9, df_Y=None):
+        if self.importance == "permutation" and df_Y is not None:
+            # Permutation importance does not depend on the impurity of the tree nodes
+            df_imp = computePermutationImportance(model, df_X, df_Y, logger=self.logger)
+            feat_ims = df_imp["mean"].values
+            feat_names = df_imp.index
+            feat_ims_ratio = np.clip(feat_ims, 0, None) / max(np.clip(feat_ims, 0, None).sum(), 1e-12)
+        else:
+            feat_ims = np.array(model.feature_importances_)
+            sorted_ims_idx = np.argsort(feat_ims)[::-1]
+            feat_ims = feat_ims[sorted_ims_idx]
+            feat_names = df_X.columns.copy()
+            feat_names = feat_names[sorted_ims_idx]
+            feat_ims_ratio = np.round(feat_ims, 5)
+        feat_ims = np.round(feat_ims, 5)
         c = 0
-        for (fi, fn) in zip(feat_ims, feat_names):
+        for (fi, fr, fn) in zip(feat_ims, feat_ims_ratio, feat_names):
             self.log("{0:.5f}".format(fi) + " -- " + str(fn))
-            c += fi
+            c += fr
             if c > thr: break
 
     def log(self, msg):
@@ -0,0 +1,194 @@
+import json
+import queue
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from util import log
+from metrics import NOTIFICATIONS, LAST_NOTIFICATION_TIME
+
+
+class NotificationDispatcher():
+    """
+    Send push notifications in a background thread, so that the prediction does not wait for the sender
+
+    Notifications need to be claimed in the NotificationLedger before they are submitted,
+        ...and the dispatcher records the delivery status (sent, pending, or failed) in the ledger
+    A delivery is only retried (with an increasing delay, up to max_attempts times) when the sender raises a
+        ...RetryableSendError, which means that the notification was surely not pushed to the users
+    Any other error may happen after the push (e.g., a rake task that fails when writing its log),
+        ...so the notification is marked as unconfirmed and never sent again, instead of pushing it to every user twice
+        ...(a failed notification, which was surely not pushed, can be claimed again, see NotificationLedger.py)
+    """
+
+    def __init__(self, sender, ledger, max_attempts=3, retry_delay=30, logger=None):
+        """
+        Initialize the class and start the worker thread
+
+        Input:
+            sender: the object that delivers notifications (see the RakeSender, WebhookSender, and StubSender classes)
+            ledger (NotificationLedger): the record of notifications for tracking the delivery status
+            max_attempts (int): the maximum number of attempts for delivering a notification
+            retry_delay (float): the number of seconds to wait before the first retry (doubled for each retry)
+            logger: the python logger created by the generateLogger() function
+        """
+        self.sender = sender
+        self.ledger = ledger
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.logger = logger
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self.work, name="NotificationDispatcher", daemon=True)
+        self.worker.start()
+
+    def submit(self, notif_type, sent_dt):
+        """Add a claimed notification to the queue (returns immediately)"""
+        self.queue.put((notif_type, sent_dt))
+
+    def resumePending(self, date=None):
+        """
+        Submit the notifications that were claimed but not delivered (e.g., when the process was stopped)
+
+        Input:
+            date (datetime.date object): only resume the notifications on this date, None means today
+        """
+        if date is None: date = datetime.now().date()
+        for notif_type, sent_dt in self.ledger.pending(date=date):
+            log("Resume the " + notif_type + " notification at " + str(sent_dt), self.logger)
+            self.submit(notif_type, sent_dt)
+
+    def join(self, timeout=None):
+        """
+        Wait until all submitted notifications are delivered or failed (e.g., before a cron job exits)
+
+        Output:
+            True if the queue is empty, False if the timeout was reached
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0: return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def work(self):
+        """Deliver the notifications in the queue (runs in the worker thread)"""
+        while True:
+            notif_type, sent_dt = self.queue.get()
+            try:
+                self.deliver(notif_type, sent_dt)
+            except Exception as e:
+                # Keep the worker running (e.g., when the ledger is temporarily locked)
+                log("ERROR: cannot deliver the " + notif_type + " notification, " + str(e), self.logger, level="error")
+            finally:
+                self.queue.task_done()
+
+    def deliver(self, notif_type, sent_dt):
+        """Send one notification with retries and record the status"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.sender.send(notif_type, sent_dt)
+            except Exception as e:
+                error = str(type(e).__name__) + ": " + str(e)
+                retryable = isinstance(e, RetryableSendError)
+                give_up = attempt == self.max_attempts or not retryable
+                status = ("failed" if retryable else "unconfirmed") if give_up else "pending"
+                NOTIFICATIONS.inc(type=notif_type, status=status)
+                self.ledger.updateStatus(notif_type, sent_dt.date(), status, error=error)
+                log("WARNING: attempt " + str(attempt) + " of sending the " + notif_type + " notification failed, " +
+                    error, self.logger, level="warning")
+                if give_up: return
+                time.sleep(self.retry_delay * 2**(attempt - 1))
+            else:
+                NOTIFICATIONS.inc(type=notif_type, status="sent")
+                LAST_NOTIFICATION_TIME.set(time.time(), type=notif_type)
+                self.ledger.updateStatus(notif_type, sent_dt.date(), "sent")
+                log("The " + notif_type + " notification was delivered", self.logger)
+                return
+
+
+class RetryableSendError(Exception):
+    """An error of a sender that happened before the notification was pushed, so sending it again is safe"""
+    pass
+
+
+class RakeSender():
+    """Send notifications by running the rake tasks in the rails app (which boots the whole rails environment)"""
+
+    def __init__(self, server, tasks, rails_p="/var/www/rails-apps/smellpgh/", log_p="", retry_codes=(126, 127)):
+        """
+        Initialize the class
+
+        Input:
+            server (str): the rails environment, "staging" or "production"
+            tasks (dict): the rake task and the log file for each notification type
+                ...e.g., {"type1": ("send_prediction", "push.log")}
+            rails_p (str): the path of the rails apps
+            log_p (str): the path for the log files of the rake tasks
+            retry_codes (tuple of int): the exit codes that mean the task did not push the notification
+                ...the default is the codes of bash for a command that cannot be found or run (e.g., no bundle),
+                ...add the code that a rake task uses for errors before pushing (e.g., when rails fails to boot)
+                ...other nonzero codes are not retried, since the task may have pushed the notification already
+        """
+        self.server = server
+        self.tasks = tasks
+        self.rails_p = rails_p
+        self.log_p = log_p
+        self.retry_codes = tuple(retry_codes)
+
+    def send(self, notif_type, sent_dt):
+        task, log_file = self.tasks[notif_type]
+        # NOTE: Python by default uses the sh terminal but we want it to use bash,
+        # ...because "source" and "bundle" only works for bash on the Hal11 machine
+        # ...(on the sh terminal we will want to use "." instead of "source")
+        cmd = "source /etc/profile ; cd " + self.rails_p + self.server + "/current/ ; " + \
+            'bundle exec rake firebase_push_notification:' + task + '["/topics/SmellReports"] RAILS_ENV=' + \
+            self.server + " >> " + self.log_p + log_file + " 2>&1"
+        code = subprocess.call(["bash", "-c", cmd])
+        if code in self.retry_codes:
+            raise RetryableSendError("rake task " + task + " did not run, exit code " + str(code))
+        if code != 0:
+            raise RuntimeError("rake task " + task + " exited with code " + str(code))
+
+
+class WebhookSender():
+    """Send notifications by posting json to a URL (e.g., an endpoint of the rails server)"""
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, notif_type, sent_dt):
+        data = json.dumps({"type": notif_type, "sent_time": sent_dt.isoformat()}).encode("utf-8")
+        request = urllib.request.Request(self.url, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.URLError as e:
+            # Only a request that never reached the server is safe to send again (e.g., not a timeout or an HTTP error)
+            if not isinstance(e, urllib.error.HTTPError) and isinstance(e.reason, (ConnectionRefusedError,
+                socket.gaierror)):
+                raise RetryableSendError("cannot connect to " + self.url + ", " + str(e.reason))
+            raise
+
+
+class StubSender():
+    """Record notifications in memory instead of sending them (for testing and development)"""
+
+    def __init__(self, fail_times=0):
+        """
+        Input:
+            fail_times (int): the number of calls that raise a RetryableSendError first (for testing the retry)
+        """
+        self.sent = []
+        self.fail_times = fail_times
+
+    def send(self, notif_type, sent_dt):
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise RetryableSendError("stub failure")
+        self.sent.append((notif_type, sent_dt))
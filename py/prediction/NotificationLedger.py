@@ -0,0 +1,167 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+import pandas as pd
+from datetime import datetime, timedelta
+from util import log, checkAndCreateDir
+
+
+# The columns for tracking the delivery of notifications (name: SQL definition)
+STATUS_COLUMNS = {
+    "status": "TEXT NOT NULL DEFAULT 'sent'", # "pending", "sent", "failed", or "unconfirmed"
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "last_error": "TEXT",
+}
+
+# The number of minutes after which a notification that is still pending can be claimed again
+# NOTE: this needs to be longer than all delivery attempts of the dispatcher (see NotificationDispatcher.py),
+# ...a notification that stays pending longer was claimed by a process that stopped before delivering it
+# ...(e.g., a cron job that was killed), and no other process would deliver it on that day
+PENDING_TIMEOUT_MIN = 30
+
+class NotificationLedger():
+    """
+    An append-only record of the push notifications that were sent, stored in a SQLite database
+
+    Each notification type is sent at most once per day
+    The unique index on (type, date) makes the "already sent today?" check one index lookup,
+        ...and inserting a row is atomic and locked by SQLite, so overlapping runs (e.g., a slow cron job
+        ...and the next one) cannot both send the notification or corrupt the record
+    """
+
+    def __init__(self, db_p, legacy_csv=None, logger=None):
+        """
+        Initialize the class
+
+        Input:
+            db_p (str): the path of the SQLite database file (created if it does not exist)
+            legacy_csv (dict): the CSV files that recorded the sending times before, e.g., {"type1": "a.csv"}
+                ...the rows are copied into the database once (when the database has no rows of that type)
+            logger: the python logger created by the generateLogger() function
+        """
+        self.db_p = db_p
+        self.logger = logger
+        checkAndCreateDir(db_p)
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS notification ("
+                "id INTEGER PRIMARY KEY, type TEXT NOT NULL, date TEXT NOT NULL, sent_time TEXT NOT NULL)")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS notification_type_date ON notification (type, date)")
+            # Delivery status (see the NotificationDispatcher class), rows from older databases count as sent
+            columns = [c[1] for c in conn.execute("PRAGMA table_info(notification)")]
+            for c, definition in STATUS_COLUMNS.items():
+                if c not in columns:
+                    conn.execute("ALTER TABLE notification ADD COLUMN " + c + " " + definition)
+            if legacy_csv is not None:
+                self.migrate(conn, legacy_csv)
+
+    @contextmanager
+    def connect(self):
+        """Open a connection with a transaction that holds the write lock until it is committed"""
+        # Wait for other processes that are writing, instead of failing immediately
+        conn = sqlite3.connect(self.db_p, timeout=60, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction: conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def migrate(self, conn, legacy_csv):
+        """Copy the rows in the legacy CSV files into the database (only once for each type)"""
+        for notif_type, csv_p in legacy_csv.items():
+            if not os.path.isfile(csv_p): continue
+            if conn.execute("SELECT 1 FROM notification WHERE type = ? LIMIT 1", (notif_type,)).fetchone():
+                continue
+            df = pd.read_csv(csv_p, parse_dates=["DateTime"])
+            rows = [(notif_type, dt.date().isoformat(), dt.isoformat()) for dt in df["DateTime"].dropna()]
+            conn.executemany("INSERT OR IGNORE INTO notification (type, date, sent_time) VALUES (?, ?, ?)", rows)
+            log("Copied " + str(len(rows)) + " rows from " + csv_p + " into " + self.db_p, self.logger)
+
+    def claim(self, notif_type, sent_dt=None, pending_timeout_min=PENDING_TIMEOUT_MIN):
+        """
+        Record a notification before sending it, if the same type was not sent on the same day
+
+        A notification that failed to be delivered (after all retries) can be claimed again on the same day
+            ...(but not an unconfirmed one, which may have been pushed, see NotificationDispatcher.py),
+            ...and so can a notification that was claimed more than pending_timeout_min minutes before sent_dt
+            ...and is still pending (the process that claimed it stopped before delivering it)
+
+        Input:
+            notif_type (str): the type of the notification (e.g., "type1" or "type2")
+            sent_dt (datetime.datetime object): the sending time, None means the current time
+            pending_timeout_min (float): see the PENDING_TIMEOUT_MIN flag, None means never claiming pending ones
+
+        Output:
+            True if the notification should be sent, False if it was already sent on the same day
+        """
+        if sent_dt is None: sent_dt = datetime.now()
+        date = sent_dt.date().isoformat()
+        with self.connect() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO notification (type, date, sent_time, status) "
+                "VALUES (?, ?, ?, 'pending')", (notif_type, date, sent_dt.isoformat()))
+            if cursor.rowcount == 1: return True
+            status, claimed_time = conn.execute("SELECT status, sent_time FROM notification WHERE type = ? AND "
+                "date = ?", (notif_type, date)).fetchone()
+            if status == "pending":
+                if pending_timeout_min is None: return False
+                # (the times are compared without time zones, since all claims use the same clock)
+                claimed_dt = datetime.fromisoformat(claimed_time).replace(tzinfo=None)
+                if sent_dt.replace(tzinfo=None) - claimed_dt <= timedelta(minutes=pending_timeout_min): return False
+                log("Claim the " + notif_type + " notification that is pending since " + claimed_time, self.logger,
+                    level="warning")
+            elif status != "failed":
+                return False
+            conn.execute("UPDATE notification SET status = 'pending', sent_time = ?, attempts = 0 "
+                "WHERE type = ? AND date = ?", (sent_dt.isoformat(), notif_type, date))
+            return True
+
+    def updateStatus(self, notif_type, date, status, error=None):
+        """
+        Update the delivery status of a notification and count the delivery attempt
+
+        Input:
+            notif_type (str): the type of the notification
+            date (datetime.date object): the date of the notification
+            status (str): "pending" (will be retried), "sent", "failed" (not pushed, will not be retried),
+                ...or "unconfirmed" (the sender failed after it may have pushed the notification, never sent again)
+            error (str): the error message of the last attempt
+        """
+        with self.connect() as conn:
+            conn.execute("UPDATE notification SET status = ?, attempts = attempts + 1, last_error = ? "
+                "WHERE type = ? AND date = ?", (status, error, notif_type, date.isoformat()))
+
+    def pending(self, date=None):
+        """
+        Return the notifications that are not delivered yet
+
+        Input:
+            date (datetime.date object): only return the notifications on this date, None means all dates
+
+        Output:
+            rows (list of tuple): (notif_type, sent_dt) for each notification
+        """
+        sql = "SELECT type, sent_time FROM notification WHERE status = 'pending'"
+        params = ()
+        if date is not None:
+            sql += " AND date = ?"
+            params = (date.isoformat(),)
+        with self.connect() as conn:
+            rows = conn.execute(sql + " ORDER BY sent_time", params).fetchall()
+        return [(t, datetime.fromisoformat(dt)) for t, dt in rows]
+
+    def isSent(self, notif_type, date):
+        """Check if a notification type was sent (or claimed for sending) on a date (datetime.date object)"""
+        with self.connect() as conn:
+            return conn.execute("SELECT 1 FROM notification WHERE type = ? AND date = ?",
+                (notif_type, date.isoformat())).fetchone() is not None
+
+    def sentTimes(self, notif_type):
+        """Return the sending times of the delivered notifications of a type (pandas.Series of datetime)"""
+        with self.connect() as conn:
+            df = pd.read_sql_query("SELECT sent_time FROM notification WHERE type = ? AND status = 'sent' "
+                "ORDER BY sent_time", conn,
+                params=(notif_type,), parse_dates=["sent_time"])
+        return df["sent_time"]
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from util import log, checkAndCreateDir
+
+# The default maximum number of stages that run at the same time
+# NOTE: the stages that run concurrently (analyze and validation) already use all CPUs with n_jobs=-1,
+# ...so more workers only make them compete for the CPUs, and two is enough for the widest part of the graph
+MAX_WORKERS = 2
+
+
+class Pipeline():
+    """
+    A graph of pipeline stages (e.g., data -> preprocess -> feature -> validation) that only reruns stale stages
+
+    Each stage declares the files that it reads (inputs) and writes (outputs),
+        ...and a stage depends on the stages that write its inputs
+    The key of a stage is the hash of its name, its parameters, and the content of its input files,
+        ...so changing a parameter (e.g., is_regr) or an upstream file invalidates the stage and its dependents,
+        ...while rerunning an upstream stage that writes identical files does not
+    The keys and the digests of the outputs are stored in a manifest (json file) next to the artifacts
+    Stages that do not depend on each other (e.g., analyze and validation) run concurrently in separate processes
+    """
+
+    def __init__(self, manifest_p, max_workers=None, logger=None):
+        """
+        Initialize the class
+
+        Input:
+            manifest_p (str): the path of the manifest file (created if it does not exist)
+            max_workers (int): the maximum number of stages that run at the same time
+                ...None means the MAX_WORKERS flag (at most the number of CPUs), and 1 means running all stages
+                ...in this process
+            logger: the python logger created by the generateLogger() function
+        """
+        self.manifest_p = manifest_p
+        self.max_workers = max_workers if max_workers is not None else min(MAX_WORKERS, os.cpu_count() or 1)
+        self.logger = logger
+        self.stages = {}
+        self.manifest = {"stages": {}}
+        if os.path.isfile(manifest_p):
+            try:
+                with open(manifest_p) as f:
+                    self.manifest = json.load(f)
+            except ValueError as e:
+                log("WARNING: cannot read the manifest, rerun all stages (" + str(e) + ")", logger, level="warning")
+
+    def addStage(self, name, func, params=None, inputs=None, outputs=None, keep_existing=False):
+        """
+        Add a stage to the graph
+
+        Input:
+            name (str): the name of the stage (e.g., "feature")
+            func (function): the function that runs the stage, called as func(**params)
+                ...it must be defined at the module level, so that it can run in another process
+            params (dict): the parameters of the stage (json serializable, or converted by str)
+            inputs (list of str): the files or directories that the stage reads
+            outputs (list of str): the files or directories that the stage writes
+            keep_existing (bool): use the outputs that already exist if the stage never ran in this pipeline
+                ...(e.g., the raw data that is copied from the dataset directory instead of downloaded)
+        """
+        self.stages[name] = {"func": func, "params": params or {}, "inputs": inputs or [], "outputs": outputs or [],
+            "keep_existing": keep_existing}
+
+    def dependencies(self, name):
+        """Return the stages that write the inputs of a stage"""
+        inputs = set(self.stages[name]["inputs"])
+        return [s for s in self.stages if s != name and inputs & set(self.stages[s]["outputs"])]
+
+    def run(self, targets, force=()):
+        """
+        Run the target stages and the stages that they depend on, skipping the stages that are up to date
+
+        Input:
+            targets (list of str): the stages to bring up to date
+            force (list of str): the stages to rerun even if they are up to date (e.g., for downloading new data)
+
+        Output:
+            ran (list of str): the stages that were run (in the order that they finished)
+        """
+        # Find all stages that are needed for the targets
+        needed, todo = set(), list(targets)
+        while todo:
+            s = todo.pop()
+            if s not in needed:
+                needed.add(s)
+                todo += self.dependencies(s)
+
+        done, ran, failed, running = set(), [], [], {}
+        executor = ProcessPoolExecutor(max_workers=self.max_workers) if self.max_workers > 1 else None
+        try:
+            while len(done) + len(failed) < len(needed):
+                # Start (or skip) the stages whose dependencies are finished
+                progress = False
+                for s in sorted(needed - done - set(failed) - set(n for n, _ in running.values())):
+                    deps = self.dependencies(s)
+                    if any(d in failed for d in deps):
+                        log("Skip stage " + s + " because a dependency failed", self.logger)
+                        failed.append(s)
+                        progress = True
+                        continue
+                    if not all(d in done for d in deps): continue
+                    progress = True
+                    key = self.computeKey(s)
+                    if s not in force and self.isFresh(s, key):
+                        log("Stage " + s + " is up to date (" + key[:12] + ")", self.logger)
+                        done.add(s)
+                        continue
+                    stage = self.stages[s]
+                    if s not in force and stage["keep_existing"] and s not in self.manifest["stages"] and \
+                        all(os.path.exists(o) for o in stage["outputs"]):
+                        log("Use the existing outputs of stage " + s, self.logger)
+                        self.finish(s, key, done=done, ran=[])
+                        continue
+                    log("Run stage " + s + " (" + key[:12] + ")", self.logger)
+                    if executor is None:
+                        # Run in this process, one stage at a time
+                        try:
+                            stage["func"](**stage["params"])
+                        except Exception as e:
+                            self.finish(s, key, error=e, failed=failed)
+                        else:
+                            self.finish(s, key, done=done, ran=ran)
+                    else:
+                        running[executor.submit(stage["func"], **stage["params"])] = (s, key)
+                if len(running) == 0:
+                    if not progress:
+                        raise ValueError("Pipeline stages have circular dependencies: " +
+                            ", ".join(sorted(needed - done - set(failed))))
+                    continue
+
+                # Wait for at least one running stage
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    s, key = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        self.finish(s, key, done=done, ran=ran)
+                    else:
+                        self.finish(s, key, error=error, failed=failed)
+        finally:
+            if executor is not None: executor.shutdown(wait=True)
+        if len(failed) > 0:
+            raise RuntimeError("Pipeline stages failed: " + ", ".join(failed))
+        return ran
+
+    def finish(self, name, key, error=None, done=None, ran=None, failed=None):
+        """Record a finished stage in the manifest"""
+        missing = [p for p in self.stages[name]["outputs"] if not os.path.exists(p)]
+        if error is None and len(missing) > 0:
+            error = FileNotFoundError("the stage did not write " + ", ".join(missing))
+        if error is not None:
+            log("ERROR: stage " + name + " failed, " + str(type(error).__name__) + ": " + str(error), self.logger,
+                level="error")
+            failed.append(name)
+            # A failed stage may have written some of its outputs, so it is never up to date
+            self.manifest["stages"].pop(name, None)
+        else:
+            outputs = {p: self.fingerprint(p) for p in self.stages[name]["outputs"]}
+            self.manifest["stages"][name] = {"key": key, "outputs": outputs, "finish_time": time.time()}
+            log("Stage " + name + " finished", self.logger)
+            done.add(name)
+            ran.append(name)
+        self.saveManifest()
+
+    def computeKey(self, name):
+        """Hash the name, the parameters, and the content of the inputs of a stage"""
+        stage = self.stages[name]
+        content = {"stage": name, "params": stage["params"],
+            "inputs": {p: self.fingerprint(p)["digest"] for p in stage["inputs"]}}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def isFresh(self, name, key):
+        """Check if a stage ran with the same key and its outputs were not changed or removed since then"""
+        record = self.manifest["stages"].get(name)
+        if record is None or record["key"] != key:
+            return False
+        for p in self.stages[name]["outputs"]:
+            old = record["outputs"].get(p)
+            if old is None or not os.path.exists(p) or listFiles(p) != old["files"]:
+                return False
+        return True
+
+    def fingerprint(self, p):
+        """
+        Compute the digest of a file or a directory (all files in it)
+
+        The digest is only computed again when the size or the modification time of a file changes
+
+        Output:
+            fingerprint (dict): "files" is [relative path, size, modification time] of each file,
+                ...and "digest" is the sha256 of the content of all files
+        """
+        if not os.path.exists(p):
+            raise FileNotFoundError("Pipeline input " + p + " does not exist")
+        files = listFiles(p)
+        for record in self.manifest["stages"].values():
+            old = record["outputs"].get(p)
+            if old is not None and old["files"] == files:
+                return old
+        h = hashlib.sha256()
+        for rel, _, _ in files:
+            h.update(rel.encode("utf-8"))
+            with open(os.path.join(p, rel) if os.path.isdir(p) else p, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+        return {"files": files, "digest": h.hexdigest()}
+
+    def saveManifest(self):
+        """Write the manifest atomically, so that an interrupted run does not leave a broken file"""
+        checkAndCreateDir(self.manifest_p)
+        with open(self.manifest_p + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(self.manifest_p + ".tmp", self.manifest_p)
+
+
+def listFiles(p):
+    """Return [relative path, size, modification time] of a file or of all files in a directory"""
+    if not os.path.isdir(p):
+        st = os.stat(p)
+        return [["", st.st_size, st.st_mtime_ns]]
+    files = []
+    for root, _, names in os.walk(p):
+        for n in names:
+            full = os.path.join(root, n)
+            st = os.stat(full)
+            files.append([os.path.relpath(full, p), st.st_size, st.st_mtime_ns])
+    return sorted(files)
@@ -0,0 +1,361 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytz
+from datetime import datetime, timedelta
+from util import log
+from getData import getData
+from preprocessData import preprocessData
+from computeFeatures import computeFeatures, getResponseNames
+from modelArtifact import loadModelArtifact
+from profiling import span
+from metrics import PREDICTION_LATENCY, PREDICTIONS, LAST_PREDICTION, LAST_PREDICTION_TIME, MISSING_VALUES, \
+    MODEL_LOAD_SECONDS, MODEL_LOADS, MISSING_FEATURES
+
+
+class PredictionService():
+    """
+    A resident predictor that keeps the trained model and the normalization statistics in memory
+
+    The model and the mean and std of features (see the modelFiles() function) are loaded once,
+        ...and they are reloaded automatically when the production.train() function writes new files,
+        ...so each prediction only costs the data pull and one evaluation of the model
+    """
+
+    def __init__(self, data_path="data_production/", f_hr=8, b_hr=3, thr=40, engine="sklearn", data_window=None,
+        regions=None, data_source=None, logger=None):
+        """
+        Initialize the class
+
+        Input:
+            data_path: the path that stores the model files (output of the production.train() function)
+            f_hr: the number of hours to look further and compute responses (see computeFeatures.py)
+            b_hr: the number of hours to look back and compute features (see computeFeatures.py)
+            thr: the threshold for binning the smell value into two classes (see computeFeatures.py)
+                ...f_hr or thr can be lists for a multi-output model, and the first (f_hr, thr) pair is the primary one
+            engine: the inference engine for the model artifact (see loadModelArtifact() in modelArtifact.py)
+                ..."flat" is much faster for predicting a few rows, and the pickle file always uses "sklearn"
+            data_window: the DataWindow object that keeps the recent data between predictions (see DataWindow.py)
+                ...the timestamps of the predictTimestamps() function are also served from the window
+                ...None means pulling all data for each prediction
+            regions: the zipcodes of each region for a regional model (see computeFeatures.py)
+                ...a model artifact that was saved with regions always uses its own regions
+            data_source: the object that provides the data instead of ESDR and SmellPGH (see the getData() function)
+                ...(the DataWindow object has its own data source)
+            logger: the python logger created by the generateLogger() function
+        """
+        self.data_path = data_path
+        self.f_hr = f_hr
+        self.b_hr = b_hr
+        self.thr = thr
+        self.engine = engine
+        self.regions = regions
+        self.multi_output = isinstance(f_hr, (list, tuple)) or isinstance(thr, (list, tuple)) or regions is not None
+        self.targets = getResponseNames(f_hr, thr, regions=regions) if self.multi_output else None
+        self.primary_thr = thr[0] if isinstance(thr, (list, tuple)) else thr
+        self.data_window = data_window
+        self.data_source = data_source
+        self.logger = logger
+        self.model = None
+        self.df_X_mean = None
+        self.df_X_std = None
+        self.feature_names = None # the feature columns in the order that the model uses (None means unknown)
+        self.loaded_version = None
+
+    def modelFiles(self):
+        """
+        Return the paths of the model and the normalization statistics
+
+        The model artifact (see modelArtifact.py) is preferred, since it stores the mean and std also,
+            ...and it loads much faster than the pickle file
+        """
+        p = self.data_path
+        if os.path.isfile(p + "model/header.json"):
+            return [p + "model/header.json"]
+        return [p + "model.pkl", p + "mean.csv", p + "std.csv"]
+
+    def reload(self, force=False):
+        """
+        Load the model and the normalization statistics if they changed since the last load
+
+        Output:
+            True if new files are loaded, False otherwise
+        """
+        try:
+            version = tuple(os.stat(f).st_mtime_ns for f in self.modelFiles())
+        except OSError as e:
+            if self.model is None: raise
+            self.log("WARNING: cannot check the model files, keep the loaded model (" + str(e) + ")")
+            return False
+        if not force and version == self.loaded_version:
+            return False
+
+        # Keep the loaded model if the new files cannot be loaded (e.g., training is still writing them)
+        files = self.modelFiles()
+        load_start = time.perf_counter()
+        try:
+            self.log("Load model...")
+            if len(files) == 1:
+                model, header = loadModelArtifact(os.path.dirname(files[0]), engine=self.engine,
+                    logger=self.logger)
+                df_X_mean, df_X_std = header["mean"], header["std"]
+                feature_names = header.get("feature_names")
+                if "regions" in header:
+                    # The zipcodes need to be summed in the same way as in training
+                    regions, targets = header["regions"], header["targets"]
+                elif self.targets is not None and header.get("targets", self.targets) != self.targets:
+                    self.log("WARNING: the model predicts " + str(header["targets"]) + " instead of " +
+                        str(self.targets))
+            else:
+                import joblib
+                model = joblib.load(files[0])
+                df_X_mean = pd.read_csv(files[1], index_col=0).squeeze("columns")
+                df_X_std = pd.read_csv(files[2], index_col=0).squeeze("columns")
+                feature_names = getattr(getattr(model, "base_estimator", model), "feature_names_in_", None)
+                if feature_names is not None: feature_names = list(feature_names)
+        except Exception as e:
+            MODEL_LOADS.inc(model=self.metricsName(), result="error")
+            if self.model is None: raise
+            self.log("WARNING: cannot load the new model, keep the loaded model (" + str(e) + ")")
+            return False
+        MODEL_LOADS.inc(model=self.metricsName(), result="ok")
+        MODEL_LOAD_SECONDS.set(time.perf_counter() - load_start, model=self.metricsName())
+        if len(files) == 1 and "regions" in header:
+            self.regions, self.targets, self.multi_output = regions, targets, True
+        self.model, self.df_X_mean, self.df_X_std = model, df_X_mean, df_X_std
+        self.feature_names = feature_names
+        self.loaded_version = version
+        return True
+
+    def predict(self, end_dt=None):
+        """
+        Predict smell events at a time point using the data in the previous b_hr hours
+
+        Input:
+            end_dt (datetime.datetime object): the time for the prediction, None means the current time
+
+        Output:
+            result (dict): the prediction result, or None if there is not enough data
+                ...result["end_dt"] is the time for the prediction
+                ...result["y_pred"] is the output of the HybridCrowdClassifier.predict() function
+                    ...(0 means no event, 1 means predicted by the model, 2 means detected by the crowd, 3 means both)
+                    ...for a multi-output model, this is the prediction of the primary (f_hr, thr) pair
+                ...result["targets"] is the prediction for each (f_hr, thr) pair (only for a multi-output model)
+                ...result["regions"] is the prediction of the primary pair for each region (only for a regional model)
+        """
+        try:
+            with PREDICTION_LATENCY.time(model=self.metricsName(), stage="total"):
+                result = self.computePrediction(end_dt)
+        except Exception:
+            PREDICTIONS.inc(model=self.metricsName(), result="error")
+            raise
+        if result is not None:
+            PREDICTIONS.inc(model=self.metricsName(), result="ok")
+            self.recordPrediction(result)
+        return result
+
+    def computePrediction(self, end_dt=None):
+        """See the predict() function (this function also records the latency of each step in metrics.py)"""
+        b_hr = self.b_hr
+
+        # Get data for previous b_hr hours
+        if end_dt is None: end_dt = datetime.now()
+        start_dt = end_dt - timedelta(hours=b_hr+1)
+        with PREDICTION_LATENCY.time(model=self.metricsName(), stage="data"):
+            if self.data_window is not None:
+                # Only pull the data that is newer than the previous prediction
+                df_esdr_array_raw, df_smell_raw = self.data_window.select(start_dt, end_dt)
+            else:
+                self.log("Get data from " + str(start_dt) + " to " + str(end_dt))
+                df_esdr_array_raw, df_smell_raw = getData(start_dt=start_dt, end_dt=end_dt,
+                    data_source=self.data_source, logger=self.logger)
+        with PREDICTION_LATENCY.time(model=self.metricsName(), stage="preprocess"):
+            df_esdr, df_smell = preprocessData(df_esdr_array_raw=df_esdr_array_raw, df_smell_raw=df_smell_raw,
+                logger=self.logger)
+        recordMissingValues(df_esdr.tail(b_hr+1))
+        if len(df_esdr) < b_hr+1:
+            self.log("ERROR: Length of esdr is less than " + str(b_hr+1) + " hours")
+            self.log("Length of esdr = " + str(len(df_esdr)))
+            PREDICTIONS.inc(model=self.metricsName(), result="not_enough_data")
+            return None
+
+        # Load the model (only when it is not loaded yet or the files were updated)
+        self.reload()
+
+        # Compute features
+        # (f_hr=None keeps the latest hours, which have no future labels yet and are not needed for predicting)
+        with PREDICTION_LATENCY.time(model=self.metricsName(), stage="features"):
+            df_X, _, df_C = computeFeatures(df_esdr=df_esdr, df_smell=df_smell, f_hr=None, b_hr=b_hr,
+                thr=self.primary_thr, is_regr=False, add_inter=False, add_roll=False, add_diff=False,
+                logger=self.logger, df_X_mean=self.df_X_mean, df_X_std=self.df_X_std, regions=self.regions)
+        if len(df_X) != 1:
+            self.log("ERROR: Length of X is not 1")
+            self.log("Length of X = " + str(len(df_X)))
+            PREDICTIONS.inc(model=self.metricsName(), result="not_enough_data")
+            return None
+        if df_C is None:
+            df_C = self.noCrowd(df_X)
+        df_X = self.alignFeatures(df_X)
+        if df_X is None:
+            PREDICTIONS.inc(model=self.metricsName(), result="missing_features")
+            return None
+
+        # Predict result
+        with span("predict", rows=1), PREDICTION_LATENCY.time(model=self.metricsName(), stage="model"):
+            y_pred = self.model.predict(df_X, df_C)[0]
+        if self.multi_output:
+            result = {"end_dt": end_dt, "y_pred": y_pred[0], "targets": dict(zip(self.targets, y_pred))}
+            if self.regions is not None:
+                # The targets are grouped by region, and the first target of each group is the primary pair
+                step = len(self.targets) // len(self.regions)
+                result["regions"] = dict(zip(self.regions, y_pred[::step]))
+                self.log("Prediction for " + str(end_dt) + " is " + str(result["regions"]))
+                return result
+            self.log("Prediction for " + str(end_dt) + " is " + str(result["targets"]))
+            return result
+        self.log("Prediction for " + str(end_dt) + " is " + str(y_pred))
+        return {"end_dt": end_dt, "y_pred": y_pred}
+
+    def predictBatch(self, df_esdr_array_raw, df_smell_raw, timestamps=None):
+        """
+        Predict smell events for many time points with one evaluation of the model
+
+        Input:
+            df_esdr_array_raw (list of pandas.DataFrame): raw ESDR data (see the getData() function in getData.py)
+            df_smell_raw (pandas.DataFrame): raw smell data (see the getData() function in getData.py)
+            timestamps (list of int): epoch times in seconds to predict, None means all time points in the data
+                ...the prediction for a timestamp uses the hourly data bin that contains the timestamp
+
+        Output:
+            df_pred (pandas.DataFrame): the prediction for each time point (rows)
+                ...the "DateTime" column is the time of the hourly data bin
+                ...the "predict" column is the output of the HybridCrowdClassifier.predict() function
+                ...the "predict_proba" column is the probability of having a smell event
+                ...for a multi-output model, these two columns are for the primary (f_hr, thr) pair,
+                ...and the "predict_[name]" and "predict_proba_[name]" columns are for each pair
+                ...(see the getResponseNames() function in computeFeatures.py for the names)
+                ...for a regional model, the primary pair is the one of the first region
+                ...the "EpochTime" column is the requested timestamp (only if timestamps is not None)
+                ...timestamps without enough data are dropped
+        """
+        df_esdr, df_smell = preprocessData(df_esdr_array_raw=df_esdr_array_raw, df_smell_raw=df_smell_raw,
+            logger=self.logger)
+        self.reload()
+        # (f_hr=None keeps the latest hours, which have no future labels yet and are not needed for predicting)
+        df_X, _, df_C = computeFeatures(df_esdr=df_esdr, df_smell=df_smell, f_hr=None, b_hr=self.b_hr,
+            thr=self.primary_thr, is_regr=False, add_inter=False, add_roll=False, add_diff=False, logger=self.logger,
+            df_X_mean=self.df_X_mean, df_X_std=self.df_X_std, keep_datetime=True, regions=self.regions)
+
+        # Select the rows for the requested timestamps
+        if df_C is None:
+            df_C = self.noCrowd(df_X)
+        dt = df_X.pop("DateTime")
+        df_X = self.alignFeatures(df_X)
+        if df_X is None:
+            return None
+        if timestamps is not None:
+            # (hourly bins are labeled by their right edge, see the resampleData() function in preprocessData.py)
+            dt_want = pd.to_datetime(timestamps, unit="s", utc=True).floor("60Min") + pd.Timedelta(hours=1)
+            row = pd.Series(data=np.arange(len(dt)), index=dt.values)
+            idx = row.reindex(dt_want.values).values
+            found = ~np.isnan(idx)
+            idx = idx[found].astype(int)
+            df_X, df_C, dt = df_X.iloc[idx], df_C.iloc[idx], dt.iloc[idx]
+        if len(df_X) == 0:
+            return pd.DataFrame(columns=["DateTime", "predict", "predict_proba"])
+
+        # Predict all rows with one evaluation of the model
+        with span("predict", rows=len(df_X)):
+            y_pred, prob = self.model.predict_with_proba(df_X, df_C.values)
+        if self.multi_output:
+            columns = {"predict": y_pred[:, 0], "predict_proba": prob[0][:, 1]}
+            for k, name in enumerate(self.targets):
+                columns["predict_" + name] = y_pred[:, k]
+                columns["predict_proba_" + name] = prob[k][:, 1]
+        else:
+            columns = {"predict": y_pred, "predict_proba": prob[:, 1]}
+        df_pred = pd.DataFrame(data={"DateTime": dt.reset_index(drop=True), **columns})
+        if timestamps is not None:
+            df_pred.insert(0, "EpochTime", np.array(timestamps)[found])
+        return df_pred
+
+    def noCrowd(self, df_X):
+        """
+        Return the crowd feature when there are no smell reports in the data (e.g., a quiet night, or a replayed
+            ...dataset without smell_raw.csv), which means that the crowd did not notice a smell event
+
+        Output:
+            df_C (pandas.DataFrame): zero smell values for each row of df_X, with one column for each region
+        """
+        self.log("WARNING: No smell reports in the data, the smell values of the crowd feature are zero")
+        columns = ["smell"] if self.regions is None else list(self.regions)
+        return pd.DataFrame(data=0, index=df_X.index, columns=columns)
+
+    def predictTimestamps(self, timestamps):
+        """
+        Predict smell events for many time points, using the data pulled from ESDR and SmellPGH
+
+        With a data window, the data comes from the window, and only the part that it does not cover is pulled
+
+        Input:
+            timestamps (list of int): epoch times in seconds
+
+        Output:
+            df_pred (pandas.DataFrame): see the predictBatch() function
+        """
+        end_dt = datetime.fromtimestamp(max(timestamps), tz=pytz.utc)
+        start_dt = datetime.fromtimestamp(min(timestamps), tz=pytz.utc) - timedelta(hours=self.b_hr+1)
+        if self.data_window is not None:
+            df_esdr_array_raw, df_smell_raw = self.data_window.select(start_dt, end_dt)
+        else:
+            df_esdr_array_raw, df_smell_raw = getData(start_dt=start_dt, end_dt=end_dt, data_source=self.data_source,
+                logger=self.logger)
+        return self.predictBatch(df_esdr_array_raw, df_smell_raw, timestamps=timestamps)
+
+    def alignFeatures(self, df_X):
+        """
+        Put the feature columns in the order that the model was trained with
+
+        When an ESDR channel is missing or renamed, the normalization returns the union of the columns in a different
+            ...order, and predicting on these columns would silently use the wrong features
+
+        Output:
+            df_X (pandas.DataFrame): the features in the order of the model, or None if some features are missing
+        """
+        if self.feature_names is None:
+            return df_X
+        columns = set(df_X.columns)
+        missing = [c for c in self.feature_names if c not in columns]
+        MISSING_FEATURES.set(len(missing), model=self.metricsName())
+        if len(missing) > 0:
+            self.log("ERROR: " + str(len(missing)) + " features of the model are missing, e.g., " + str(missing[:5]))
+            return None
+        extra = len(columns) - len(self.feature_names)
+        if extra > 0:
+            self.log("WARNING: ignore " + str(extra) + " features that the model does not use")
+        return df_X.reindex(columns=self.feature_names)
+
+    def recordPrediction(self, result):
+        """Record the result of the predict() function in the metrics (see metrics.py)"""
+        name = self.metricsName()
+        LAST_PREDICTION.set(result["y_pred"], model=name, target="primary")
+        for target, y in result.get("targets", {}).items():
+            LAST_PREDICTION.set(y, model=name, target=target)
+        LAST_PREDICTION_TIME.set(result["end_dt"].timestamp(), model=name)
+
+    def metricsName(self):
+        """Return the value of the "model" label in the metrics (the daemon can run both models in one process)"""
+        return "county" if self.regions is None else "regional"
+
+    def log(self, msg):
+        """Log messages"""
+        log(msg, self.logger)
+
+
+def recordMissingValues(df_esdr):
+    """Record the number of missing readings (filled with -1 by preprocessData.py) of each channel in the metrics"""
+    missing = (df_esdr.drop(columns="DateTime", errors="ignore") == -1).sum()
+    MISSING_VALUES.clear()
+    for channel, n in missing.items():
+        MISSING_VALUES.set(n, channel=channel)
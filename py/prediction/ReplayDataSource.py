@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from util import log, datetimeToEpochtime, getAllFileNamesInFolder, smellZipcodes
+from esdrSources import ESDR_SOURCES, esdrSourceNames
+
+
+class ReplayDataSource():
+    """
+    A data source that replays the raw data of a bundled dataset (e.g., dataset/v2.1/) instead of pulling it
+        ...from ESDR and SmellPGH, so that the pipeline and the production code can run without network access
+
+    The getData() function returns the same format as the getData() function in getData.py
+    With a simulated clock (see the clock_dt argument), the now() function maps the wall clock to the dataset time,
+        ...and readings only become visible when they arrive at the simulated time (plus the delay of the sensors),
+        ...which simulates the data that the production code sees in real time
+    The files are read once and sliced by time with a binary search, and the object is safe to use from threads
+        ...(e.g., the handlers of the replay server in replayServer.py)
+    """
+
+    def __init__(self, dataset_p, clock_dt=None, speed=1.0, esdr_delay_min=0, logger=None):
+        """
+        Initialize the class
+
+        Input:
+            dataset_p (str): the dataset directory that has the "esdr_raw" folder and the "smell_raw.csv" file
+            clock_dt (datetime.datetime object): the dataset time when the object is created, None means no simulated
+                ...clock (the now() function returns the wall clock, and all readings in the files are visible)
+            speed (float): the number of simulated seconds for each second of the wall clock
+            esdr_delay_min (int): the number of minutes between the time of a sensor reading and its arrival
+            logger: the python logger created by the generateLogger() function
+        """
+        self.dataset_p = os.path.join(dataset_p, "")
+        self.clock_time = None if clock_dt is None else datetimeToEpochtime(clock_dt) / 1000
+        self.clock_tz = None if clock_dt is None else clock_dt.tzinfo
+        self.wall_time = time.time()
+        self.speed = speed
+        self.esdr_delay_min = esdr_delay_min
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.frames = {} # file name: (dataframe sorted by EpochTime, numpy array of EpochTime)
+        self.channels = None # "3.feed_[feed].[channel]": (file name, column), see the findChannel() function
+
+    def now(self):
+        """Return the current time (the simulated dataset time if there is a simulated clock)"""
+        if self.clock_time is None:
+            return datetime.now()
+        t = self.clock_time + (time.time() - self.wall_time) * self.speed
+        return datetime.fromtimestamp(t, tz=self.clock_tz)
+
+    def visibleTime(self, end_time, delay_min=0):
+        """Return the latest epoch time (in seconds) of the readings that arrived before end_time"""
+        if self.clock_time is None:
+            return end_time - delay_min * 60
+        now_time = datetimeToEpochtime(self.now()) / 1000
+        return min(end_time, now_time) - delay_min * 60
+
+    def sourceNames(self, sources=None):
+        """
+        Return the names of the ESDR files to replay
+
+        The names of the sources in the registry (see esdrSources.py) are used if the dataset has all of them,
+            ...otherwise (e.g., dataset/v1, which has older file names) all files in the "esdr_raw" folder are used
+        """
+        names = esdrSourceNames(sources or ESDR_SOURCES)
+        files = self.esdrFiles()
+        if all(n + ".csv" in files for n in names):
+            return names
+        return sorted(f[:-4] for f in files)
+
+    def esdrFiles(self):
+        """Return the names of the csv files in the "esdr_raw" folder"""
+        return [f for f in getAllFileNamesInFolder(self.dataset_p + "esdr_raw/") if f.endswith(".csv")]
+
+    def getData(self, start_dt, end_dt, region_setting=0, sources=None):
+        """
+        Return the raw ESDR and smell data between two times (both included)
+
+        For the input and output, see the getData() function in getData.py
+        """
+        start_time = datetimeToEpochtime(start_dt) / 1000
+        end_time = datetimeToEpochtime(end_dt) / 1000
+        log("Replay data from " + str(start_dt) + " to " + str(end_dt), self.logger)
+        df_esdr_array_raw = [self.getEsdr(n, start_time, end_time) for n in self.sourceNames(sources)]
+        # (the getData() function uses the V1 API for region_setting 0 and the V2 API otherwise)
+        df_smell_raw = self.getSmell(start_time, end_time, allegheny_county=region_setting != 0,
+            api_version=1 if region_setting == 0 else 2)
+        return df_esdr_array_raw, df_smell_raw
+
+    def getEsdr(self, name, start_time, end_time):
+        """Return the raw data of an ESDR file between two epoch times (in seconds)"""
+        end_time = self.visibleTime(end_time, delay_min=self.esdr_delay_min)
+        return self.sliceFrame("esdr_raw/" + name + ".csv", start_time, end_time)
+
+    def getSmell(self, start_time, end_time, allegheny_county=False, api_version=2):
+        """
+        Return the raw smell reports between two epoch times (in seconds), None if there are no reports
+
+        Input:
+            allegheny_county (bool): see the smellZipcodes() function in util.py
+            api_version (int): 1 for the columns of the V1 API (without the columns that only V2 has)
+        """
+        if not os.path.isfile(self.dataset_p + "smell_raw.csv"):
+            log("WARNING: no smell_raw.csv in " + self.dataset_p + ", replay without smell reports", self.logger,
+                level="warning")
+            return None
+        df = self.sliceFrame("smell_raw.csv", start_time, self.visibleTime(end_time))
+        zipcodes = smellZipcodes(allegheny_county)
+        df = df[df["zipcode"].astype(str).isin(zipcodes)]
+        if api_version == 1:
+            df = df.drop(columns=["skewed_latitude", "skewed_longitude", "additional_comments"], errors="ignore")
+        return None if df.empty else df
+
+    def getChannels(self, feed, channels, start_time, end_time):
+        """
+        Return the readings of some channels of an ESDR feed, in the format of the ESDR export API
+
+        A column that merges several feeds (e.g., "3.feed_11067.X..3.feed_43.X") is returned for each of the feeds,
+            ...so merging the feeds again (see the mergeEsdrFeeds() function in util.py) gives the column in the file
+
+        Output:
+            df (pandas.DataFrame): the readings indexed by EpochTime, with a "3.feed_[feed].[channel]" column for each
+                ...channel (NaN for unknown channels), or no rows if the dataset has none of the channels
+                ...(the same as a feed without readings between the two times, which is what ESDR returns)
+        """
+        names = ["3.feed_" + str(feed) + "." + c for c in channels]
+        columns = {}
+        for name, c in zip(names, channels):
+            found = self.findChannel(feed, c)
+            if found is not None: columns[name] = found
+        if len(columns) == 0:
+            log("WARNING: no channel " + ",".join(channels) + " of feed " + str(feed) + " in " + self.dataset_p,
+                self.logger, level="warning")
+            return pd.DataFrame(columns=names, index=pd.Index([], name="EpochTime", dtype=np.int64))
+        end_time = self.visibleTime(end_time, delay_min=self.esdr_delay_min)
+        parts = []
+        for name, (f, column) in columns.items():
+            parts.append(self.sliceFrame(f, start_time, end_time)[column].rename(name))
+        df = pd.concat(parts, axis=1) if len(parts) > 1 else parts[0].to_frame()
+        df = df.reindex(columns=names)
+        df.index.name = "EpochTime"
+        return df
+
+    def findChannel(self, feed, channel):
+        """Return (file name, column) of the column that has the readings of a channel, None if there is none"""
+        with self.lock:
+            if self.channels is None:
+                self.channels = {}
+                for f in sorted(self.esdrFiles()):
+                    columns = pd.read_csv(self.dataset_p + "esdr_raw/" + f, nrows=0).columns
+                    for column in columns:
+                        for part in column.split(".."):
+                            self.channels.setdefault(part, ("esdr_raw/" + f, column))
+        return self.channels.get("3.feed_" + str(feed) + "." + channel)
+
+    def sliceFrame(self, f, start_time, end_time):
+        """Return the rows of a csv file (relative to the dataset directory) between two epoch times"""
+        with self.lock:
+            if f not in self.frames:
+                df = pd.read_csv(self.dataset_p + f, index_col="EpochTime").sort_index(kind="stable")
+                self.frames[f] = (df, df.index.values)
+        df, t = self.frames[f]
+        i, j = np.searchsorted(t, start_time, side="left"), np.searchsorted(t, end_time, side="right")
+        return df.iloc[i:j].copy()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from util import log, checkAndCreateDir
+
+
+class SharedDataset():
+    """
+    A dataset (e.g., the features X, the labels Y, and the crowd feature C) stored once in memory-mapped files
+
+    Each array is written to a .npy file once, and all processes map the same file,
+        ...so the operating system keeps one copy of the data in memory no matter how many workers use it
+    The array(), frame(), and fold() functions return views (no copies) for contiguous rows,
+        ...which is the case for the folds of TimeSeriesSplit
+    Pickling the object (e.g., for joblib workers) only sends the file paths, and the worker maps the files again
+    """
+
+    def __init__(self, data, dir_p=None, logger=None):
+        """
+        Initialize the class and write the arrays
+
+        Input:
+            data (dict): the name and the data of each array (pandas.DataFrame, pandas.Series, or numpy.ndarray)
+                ...e.g., {"X": df_X, "Y": df_Y, "C": df_C}, None values are skipped
+            dir_p (str): the directory for the .npy files, None means a temporary directory that close() removes
+            logger: the python logger created by the generateLogger() function
+        """
+        self.owner = dir_p is None
+        self.dir_p = tempfile.mkdtemp(prefix="shared_dataset_") if dir_p is None else dir_p
+        self.logger = logger
+        self.columns = {}
+        self.arrays = {}
+        checkAndCreateDir(os.path.join(self.dir_p, ""))
+        for name, d in data.items():
+            if d is None: continue
+            if isinstance(d, pd.Series): d = d.to_frame()
+            self.columns[name] = list(d.columns) if isinstance(d, pd.DataFrame) else None
+            values = d.to_numpy() if isinstance(d, pd.DataFrame) else np.asarray(d)
+            if values.dtype == object:
+                # e.g., categorical labels from pd.cut, let numpy infer the numeric type
+                values = np.array(values.tolist())
+            np.save(self.path(name), np.ascontiguousarray(values))
+        log("Shared dataset created at " + self.dir_p, logger)
+
+    def path(self, name):
+        """Return the path of the .npy file of an array"""
+        return os.path.join(self.dir_p, name + ".npy")
+
+    def array(self, name, rows=None):
+        """
+        Return the memory-mapped array (read-only) or some of its rows
+
+        Input:
+            name (str): the name of the array (e.g., "X")
+            rows (slice or numpy.ndarray): the rows to select, a contiguous range of indices gives a view
+
+        Output:
+            a (numpy.ndarray): the rows of the array (a view if rows is None or contiguous)
+        """
+        if name not in self.arrays:
+            self.arrays[name] = np.load(self.path(name), mmap_mode="r")
+        a = self.arrays[name]
+        return a if rows is None else a[toSlice(rows)]
+
+    def frame(self, name, rows=None):
+        """Return the rows of an array as a pandas.DataFrame that shares the memory of the array"""
+        return pd.DataFrame(self.array(name, rows), columns=self.columns.get(name), copy=False)
+
+    def series(self, name, column, rows=None):
+        """Return one column of an array as a pandas.Series (e.g., for the plotting workers)"""
+        j = self.columns[name].index(column) if self.columns.get(name) is not None else column
+        return pd.Series(self.array(name, rows)[:, j], name=column, copy=False)
+
+    def fold(self, train_idx, test_idx, names=("X", "Y", "C")):
+        """
+        Return the training and testing sets of a cross validation fold
+
+        Output:
+            train (dict): the views of the arrays for the training rows, e.g., {"X": ..., "Y": ..., "C": ...}
+            test (dict): the views of the arrays for the testing rows
+        """
+        names = [n for n in names if n in self.columns]
+        return {n: self.array(n, train_idx) for n in names}, {n: self.array(n, test_idx) for n in names}
+
+    def __len__(self):
+        return len(self.array(next(iter(self.columns))))
+
+    def __getstate__(self):
+        # Send only the paths to other processes, the arrays are mapped again when they are used
+        state = self.__dict__.copy()
+        state["arrays"] = {}
+        state["owner"] = False
+        state["logger"] = None
+        return state
+
+    def close(self):
+        """Remove the files if they are in a temporary directory that this object created"""
+        self.arrays = {}
+        if self.owner and os.path.isdir(self.dir_p):
+            shutil.rmtree(self.dir_p, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def toSlice(rows):
+    """Convert a contiguous increasing range of indices to a slice (so numpy returns a view instead of a copy)"""
+    if isinstance(rows, slice):
+        return rows
+    rows = np.asarray(rows)
+    if rows.dtype == bool:
+        return rows
+    if len(rows) > 0 and rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+        return slice(int(rows[0]), int(rows[-1]) + 1)
+    return rows
@@ -18,7 +18,10 @@ from sklearn.decomposition import TruncatedSVD
 import seaborn as sns
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from computeFeatures import computeFeatures
-from Interpreter import Interpreter
+from FeatureCache import FeatureCache
+from esdrSources import displayNames
+from SharedDataset import SharedDataset
+from Interpreter import Interpreter, generateSyntheticSamples
 from sklearn.ensemble import RandomTreesEmbedding
 from sklearn.manifold import SpectralEmbedding
 from copy import deepcopy
@@ -42,47 +45,39 @@ def analyzeData(
     out_p = out_p_root + "analysis/"
     checkAndCreateDir(out_p)
 
+    # Read the data and compute each set of features only once for all analyses
+    cache = FeatureCache(spill_p=out_p_root + "feature_cache/", logger=logger)
+
     # Plot features
-    plotFeatures(in_p, out_p_root, logger)
+    plotFeatures(in_p, out_p_root, logger, cache=cache)
 
     # Plot aggregated smell data
-    plotAggrSmell(in_p, out_p, logger)
+    plotAggrSmell(in_p, out_p, logger, cache=cache)
 
     # Plot dimension reduction
-    plotLowDimensions(in_p, out_p, logger)
+    plotLowDimensions(in_p, out_p, logger, cache=cache)
 
     # Correlational study
-    corrStudy(in_p, out_p, logger)
-    corrStudy(in_p, out_p, logger, is_regr=True)
+    corrStudy(in_p, out_p, logger, cache=cache)
+    corrStudy(in_p, out_p, logger, is_regr=True, cache=cache)
 
     # Interpret model
     num_run = 1 # how many times to run the simulation
-    interpretModel(in_p, out_p, end_dt, start_dt, num_run, logger)
+    interpretModel(in_p, out_p, end_dt, start_dt, num_run, logger, cache=cache)
+    log("Feature cache: " + str(cache.hits) + " hits, " + str(cache.misses) + " misses", logger)
 
     print("END")
 
 
-def interpretModel(in_p, out_p, end_dt, start_dt, num_run, logger):
+def interpretModel(in_p, out_p, end_dt, start_dt, num_run, logger, cache=None):
     # Load time series data
-    df_esdr = pd.read_csv(in_p[0], parse_dates=True, index_col="DateTime")
-    df_smell = pd.read_csv(in_p[1], parse_dates=True, index_col="DateTime")
+    if cache is None: cache = FeatureCache(logger=logger)
+    df_esdr = cache.readCsv(in_p[0])
+    df_smell = cache.readCsv(in_p[1])
 
     # Select variables based on prior knowledge
     log("Select variables based on prior knowledge...")
-    want = {
-        #"3.feed_26.OZONE_PPM": "O3", # Lawrenceville ACHD
-        "3.feed_26.SONICWS_MPH": "Lawrenceville_wind_speed",
-        "3.feed_26.SONICWD_DEG": "Lawrenceville_wind_direction_@",
-        "3.feed_26.SIGTHETA_DEG": "Lawrenceville_wind_direction_std",
-        "3.feed_28.H2S_PPM": "Liberty_H2S", # Liberty ACHD
-        "3.feed_28.SIGTHETA_DEG": "Liberty_wind_direction_std",
-        "3.feed_28.SONICWD_DEG": "Liberty_wind_direction_@",
-        "3.feed_28.SONICWS_MPH": "Liberty_wind_speed",
-        #"3.feed_23.PM10_UG_M3": "FPpm", # Flag Plaza ACHD
-        "3.feed_11067.SIGTHETA_DEG..3.feed_43.SIGTHETA_DEG": "ParkwayEast_wind_direction_std", # Parkway East ACHD
-        "3.feed_11067.SONICWD_DEG..3.feed_43.SONICWD_DEG": "ParkwayEast_wind_direction_@",
-        "3.feed_11067.SONICWS_MPH..3.feed_43.SONICWS_MPH": "ParkwayEast_wind_speed"
-    } # key is the desired variables, value is the replaced name, @ is the flag for computing sine and cosine
+    want = displayNames() # key is the desired variables, value is the replaced name (see esdrSources.py)
     want_vars = want.keys()
     df_esdr_cp = df_esdr
     df_esdr = pd.DataFrame()
@@ -96,18 +91,27 @@ def interpretModel(in_p, out_p, end_dt, start_dt, num_run, logger):
     df_smell = df_smell.reset_index()
     df_X, df_Y, df_C = computeFeatures(df_esdr=df_esdr, df_smell=df_smell, f_hr=8, b_hr=2, thr=40, is_regr=False,
         add_inter=True, add_roll=False, add_diff=False, logger=logger)
-    for m in ["DT"]*num_run:
+    # Generate the synthetic samples of all runs at once (each run starts from the same original data)
+    synthetic = generateSyntheticSamples(df_X.values, n_sets=num_run)
+    for i, m in enumerate(["DT"]*num_run):
         start_time_str = datetime.now().strftime("%Y-%d-%m-%H%M%S")
         out_p_m = out_p + "experiment/" + start_time_str + "/"
         lg = generateLogger(out_p_m + m + "-" + start_time_str + ".log", format=None)
-        model = Interpreter(df_X=df_X, df_Y=df_Y, out_p=out_p_m, logger=lg)
-        df_Y = model.getFilteredLabels()
-        df_X = model.getSelectedFeatures()
+        model = Interpreter(df_X=df_X, df_Y=df_Y, out_p=out_p_m, synthetic=synthetic[i], logger=lg)
+        df_Y_m = model.getFilteredLabels()
+        df_X_m = model.getSelectedFeatures()
         num_folds = int((end_dt - start_dt).days / 7) # one fold represents a week
-        crossValidation(df_X=df_X, df_Y=df_Y, df_C=df_C, out_p_root=out_p_m, method=m, is_regr=False, logger=lg,
+        crossValidation(df_X=df_X_m, df_Y=df_Y_m, df_C=df_C, out_p_root=out_p_m, method=m, is_regr=False, logger=lg,
             num_folds=num_folds, skip_folds=48, train_size=8000)
 
 
+def getFeatures(cache, **kwargs):
+    """Compute features with the computeFeatures() function, or get them from the cache (see FeatureCache.py)"""
+    if cache is None:
+        return computeFeatures(**kwargs)
+    return cache.computeFeatures(**kwargs)
+
+
 def computeCrossCorrelation(x, y, max_lag=None):
     n = len(x)
     xo = x - x.mean()
@@ -119,13 +123,13 @@ def computeCrossCorrelation(x, y, max_lag=None):
     return cc
 
 
-def corrStudy(in_p, out_p, logger, is_regr=False):
+def corrStudy(in_p, out_p, logger, is_regr=False, cache=None):
     log("Compute correlation of lagged X and current Y...", logger)
     f_name = "corr_with_time_lag"
     if is_regr: f_name += "_is_regr"
 
     # Compute features
-    df_X, df_Y, _ = computeFeatures(in_p=in_p, f_hr=8, b_hr=0, thr=40, is_regr=is_regr,
+    df_X, df_Y, _ = getFeatures(cache, in_p=in_p, f_hr=8, b_hr=0, thr=40, is_regr=is_regr,
          add_inter=False, add_roll=False, add_diff=False, logger=logger)
 
     # Compute daytime index
@@ -190,8 +194,8 @@ def plotCorrelation(df_corr, out_p):
     plt.close()
 
 
-def plotAggrSmell(in_p, out_p, logger):
-    df_X, df_Y, _ = computeFeatures(in_p=in_p, f_hr=None, b_hr=0, thr=40, is_regr=True,
+def plotAggrSmell(in_p, out_p, logger, cache=None):
+    df_X, df_Y, _ = getFeatures(cache, in_p=in_p, f_hr=None, b_hr=0, thr=40, is_regr=True,
         add_inter=False, add_roll=False, add_diff=False, logger=logger)
 
     # Plot the distribution of smell values by days of week and hours of day
@@ -246,7 +250,7 @@ def plotDayHour(df_X, df_Y, out_p, logger):
     plt.close()
 
 
-def plotFeatures(in_p, out_p_root, logger):
+def plotFeatures(in_p, out_p_root, logger, cache=None):
     plot_time_hist_pair = True
     plot_corr = True
 
@@ -262,27 +266,28 @@ def plotFeatures(in_p, out_p_root, logger):
         checkAndCreateDir(f)
 
     # Compute features
-    df_X, df_Y, _ = computeFeatures(in_p=in_p, f_hr=8, b_hr=0, thr=40, is_regr=True,
+    df_X, df_Y, _ = getFeatures(cache, in_p=in_p, f_hr=8, b_hr=0, thr=40, is_regr=True,
         add_inter=False, add_roll=False, add_diff=False, logger=logger)
     df_Y = pd.to_numeric(df_Y.squeeze())
 
     # Plot feature histograms, or time-series, or pairs of (feature, label)
+    # (the workers map the shared dataset instead of receiving a copy of the columns for each plot)
     if plot_time_hist_pair:
-        with Parallel(n_jobs=-1) as parallel:
+        with Parallel(n_jobs=-1) as parallel, SharedDataset({"X": df_X, "Y": df_Y}, logger=logger) as data:
             # Plot time series
             log("Plot time series...", logger)
             h = "Time series "
-            parallel(delayed(plotTime)(df_X[v], h, out_p[0]) for v in df_X.columns)
+            parallel(delayed(plotColumn)(plotTime, data, v, h, out_p[0]) for v in df_X.columns)
             plotTime(df_Y, h, out_p[0])
             # Plot histograms
             log("Plot histograms...", logger)
             h = "Histogram "
-            parallel(delayed(plotHist)(df_X[v], h, out_p[1]) for v in df_X.columns)
+            parallel(delayed(plotColumn)(plotHist, data, v, h, out_p[1]) for v in df_X.columns)
             plotHist(df_Y, h, out_p[1])
             # Plot pairs of (feature, label)
             log("Plot pairs...", logger)
             h = "Pairs "
-            parallel(delayed(plotPair)(df_X[v], df_Y, h, out_p[2]) for v in df_X.columns)
+            parallel(delayed(plotColumn)(plotPair, data, v, h, out_p[2], y=df_Y.name) for v in df_X.columns)
 
     # Plot correlation matrix
     if plot_corr:
@@ -292,6 +297,14 @@ def plotFeatures(in_p, out_p_root, logger):
     log("Finished plotting features", logger)
 
 
+def plotColumn(plot, data, v, title_head, out_p, y=None):
+    """Plot a feature in the SharedDataset (and the label, for the plotPair() function) in a worker"""
+    if y is None:
+        plot(data.series("X", v), title_head, out_p)
+    else:
+        plot(data.series("X", v), data.series("Y", y), title_head, out_p)
+
+
 def plotTime(df_v, title_head, out_p):
     v = df_v.name
     fig = plt.figure(figsize=(40, 8), dpi=150)
@@ -348,14 +361,14 @@ def plotCorrMatirx(df, out_p):
     plt.close()
 
 
-def plotLowDimensions(in_p, out_p, logger):
-    df_X, df_Y, _ = computeFeatures(in_p=in_p, f_hr=8, b_hr=3, thr=40, is_regr=False,
+def plotLowDimensions(in_p, out_p, logger, cache=None):
+    df_X, df_Y, _ = getFeatures(cache, in_p=in_p, f_hr=8, b_hr=3, thr=40, is_regr=False,
         add_inter=False, add_roll=False, add_diff=False, logger=logger)
     X = df_X.values
     Y = df_Y.squeeze().values
     log("Number of positive samples: " + str(len(Y[Y==1])) + " (" + str(float(len(Y[Y==1]))/len(Y)) + ")")
     log("Number of negative samples: " + str(len(Y[Y==0])) + " (" + str(float(len(Y[Y==0]))/len(Y)) + ")")
-    _, df_Y_regr, _ = computeFeatures(in_p=in_p, f_hr=8, b_hr=3, thr=40, is_regr=True,
+    _, df_Y_regr, _ = getFeatures(cache, in_p=in_p, f_hr=8, b_hr=3, thr=40, is_regr=True,
         add_inter=False, add_roll=False, add_diff=False, logger=logger)
     Y_regr = df_Y_regr.squeeze().values
     log("Plot PCA...", logger)
@@ -0,0 +1,534 @@
+"""
+Benchmarks for finding performance regressions in the prediction pipeline across commits
+
+Each stage (preprocessData, computeFeatures, trainModel, evalEventDetection, crossValidation, and the prediction
+    ...of production.py) runs on the bundled dataset and on synthetic versions that have more hours
+    ...(the time series is appended to itself with shifted times) or more feeds (copies of the sensors with new ids)
+The wall time, the peak resident memory (RSS), and the throughput (rows per second) of each stage are stored
+    ...in a JSON file in OUT_PATH, together with the commit and the versions of the main packages
+
+Usage:
+    python benchmark.py
+        ...run the default scenarios (see the SCENARIOS flag)
+    python benchmark.py h2f1 h10f1 h1f10 h100f1
+        ...run the scenarios with N times the hours and M times the feeds of the dataset (hNfM)
+        ...(h100 needs a lot of memory, since the raw data is about a hundred times larger)
+    python benchmark.py compare [old.json] [new.json]
+        ...compare two results (by default the two latest files in OUT_PATH) and flag the stages that got slower
+    python benchmark.py startup [code path]
+        ...measure the cold start of the command line modes in new processes (importing production.py and main.py,
+        ...and "python production.py predict" with a small model and a replayed dataset), the code path is the
+        ...py/prediction directory to measure (e.g., of an older commit checked out by "git worktree")
+"""
+
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import threading
+import subprocess
+import joblib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+import pytz
+from util import log, checkAndCreateDir, evalEventDetection
+from preprocessData import preprocessData
+from computeFeatures import computeFeatures
+from trainModel import trainModel
+from crossValidation import crossValidation
+from modelArtifact import saveModelArtifact
+from HybridCrowdClassifier import HybridCrowdClassifier
+from PredictionService import PredictionService
+from DataWindow import DataWindow
+from ReplayDataSource import ReplayDataSource
+from profiling import currentRss
+
+# The dataset to benchmark (the smell reports of SMELL_PATH are used if the dataset has no smell_raw.csv file)
+DATASET_PATH = "../../dataset/v2.1/"
+SMELL_PATH = "../../dataset/v1/"
+
+# The path for storing the results
+OUT_PATH = "data_benchmark/"
+
+# The scenarios to run by default (hNfM means N times the hours and M times the feeds of the dataset)
+SCENARIOS = ["h1f1", "h2f1", "h1f2"]
+
+# The model (see trainModel.py), HCR is the model of production.py
+METHOD = "HCR"
+
+# The number of cross validation folds to run (the last folds of the weekly folds that main.py uses)
+N_EVAL_FOLDS = 8
+
+# The number of consecutive hourly predictions for the production.py stage
+N_PREDICTIONS = 24
+
+# A stage is flagged as a regression when it is slower than the old result by more than this ratio
+TOLERANCE = 0.1
+
+# The number of new processes for each command of the startup benchmark (the median is reported)
+STARTUP_REPEATS = 5
+
+# The modules that take long to import, the startup benchmark reports which of them each command loaded
+HEAVY_MODULES = ["sklearn", "scipy", "matplotlib", "seaborn", "joblib"]
+
+# The code that runs after each command of the startup benchmark and prints what the process used
+# NOTE: the peak memory is VmHWM, since ru_maxrss on Linux keeps the peak of the benchmark process that forked it
+STARTUP_PROBE = "\n".join(["import sys, json",
+    "try: peak = [int(l.split()[1]) / 1024 for l in open('/proc/self/status') if l.startswith('VmHWM')][0]",
+    "except (OSError, IndexError): peak = None",
+    "print(json.dumps({'peak_rss_mb': peak, 'modules': [m for m in %r if m in sys.modules]}))"])
+
+
+def main(argv):
+    if len(argv) >= 2 and argv[1] == "compare":
+        compareResults(*argv[2:4])
+    elif len(argv) >= 2 and argv[1] == "startup":
+        benchmarkStartup(code_p=argv[2] if len(argv) >= 3 else ".")
+    elif len(argv) >= 2 and argv[1] in ["help", "-h", "--help"]:
+        print(__doc__)
+    else:
+        runBenchmark(argv[1:] or SCENARIOS)
+
+
+def runBenchmark(scenarios, dataset_p=DATASET_PATH, out_p=OUT_PATH, method=METHOD, n_eval_folds=N_EVAL_FOLDS,
+    n_predictions=N_PREDICTIONS, logger=None):
+    """
+    Run the benchmark scenarios and store the results
+
+    Input:
+        scenarios (list of str): the scenarios, e.g., ["h1f1", "h10f1"] (see the docstring at the top of the file)
+        dataset_p (str): the dataset directory that has the "esdr_raw" folder
+        out_p (str): the directory for storing the JSON file of the results
+        method (str): the model to train (see trainModel.py)
+        n_eval_folds (int): the number of cross validation folds
+        n_predictions (int): the number of predictions in the production.py stage
+        logger: the python logger created by the generateLogger() function
+
+    Output:
+        result (dict): the information of the environment and the measurements of each scenario
+    """
+    esdr, smell = loadDataset(dataset_p, logger=logger)
+    result = {"commit": gitCommit(), "time": datetime.now().isoformat(timespec="seconds"),
+        "dataset": dataset_p, "method": method, "environment": environmentInfo(), "scenarios": {}}
+    for s in scenarios:
+        m = re.fullmatch(r"h(\d+)f(\d+)", s)
+        if m is None:
+            log("ERROR: scenario " + s + " is not in the hNfM format, skip it", logger, level="error")
+            continue
+        n_hours, n_feeds = int(m.group(1)), int(m.group(2))
+        log("================================================================================", logger)
+        log("Benchmark scenario " + s + " (" + str(n_hours) + "x hours, " + str(n_feeds) + "x feeds)", logger)
+        esdr_s, smell_s = scaleData(esdr, smell, n_hours=n_hours, n_feeds=n_feeds)
+        stages = benchmarkScenario(esdr_s, smell_s, method=method, n_eval_folds=n_eval_folds,
+            n_predictions=n_predictions, logger=logger)
+        result["scenarios"][s] = {"n_hours": n_hours, "n_feeds": n_feeds, "stages": stages}
+        del esdr_s, smell_s
+
+    saveResult(result, out_p, logger=logger)
+    return result
+
+
+def benchmarkStartup(code_p=".", dataset_p=DATASET_PATH, out_p=OUT_PATH, n_repeats=STARTUP_REPEATS, logger=None):
+    """
+    Measure the cold start of the command line modes, each in new python processes
+
+    The "production predict" stage runs the predict() function of production.py in the code directory,
+        ...with a small model trained on the last hours of the dataset, and the data replayed with a simulated clock
+        ...(without the data window file, so the process also pulls all data like the first run of a crontab)
+
+    Input:
+        code_p (str): the directory of the code to measure (py/prediction of this or another checkout)
+        n_repeats (int): the number of processes for each command
+        for the other input arguments, see the runBenchmark() function
+
+    Output:
+        result (dict): the measurements of each command (see the runCommand() function)
+    """
+    code_p = os.path.abspath(code_p)
+    result = {"commit": gitCommit(cwd=code_p), "time": datetime.now().isoformat(timespec="seconds"),
+        "dataset": dataset_p, "method": "HCR", "environment": environmentInfo(), "scenarios": {}}
+    tmp_p = tempfile.mkdtemp(prefix="benchmark_startup_")
+    try:
+        end_time = prepareStartup(dataset_p, tmp_p, logger=logger)
+        predict_code = "\n".join(["import production", "from datetime import datetime", "import pytz",
+            "production.DATA_PATH = %r" % (tmp_p + "/production/"),
+            "production.REPLAY_DATASET = %r" % (tmp_p + "/replay/"),
+            "production.REPLAY_CLOCK_DT = datetime.fromtimestamp(%d, tz=pytz.utc)" % end_time,
+            "production.ENABLE_RAKE_CALL = False", "production.METRICS_PATH = None", "production.predict()"])
+        commands = {"import production": "import production", "import main": "import main",
+            "production predict": predict_code}
+        stages = {}
+        for name, code in commands.items():
+            stages[name] = runCommand(code, code_p, n_repeats=n_repeats, logger=logger)
+        result["scenarios"]["startup"] = {"n_hours": 1, "n_feeds": 1, "stages": stages}
+    finally:
+        shutil.rmtree(tmp_p, ignore_errors=True)
+    saveResult(result, out_p, logger=logger)
+    for name, m in result["scenarios"]["startup"]["stages"].items():
+        log("\t%-20s loaded %s" % (name, ", ".join(m["modules"]) or "no heavy modules"), logger)
+    return result
+
+
+def prepareStartup(dataset_p, tmp_p, n_hours=2000, f_hr=8, b_hr=3, thr=40, logger=None):
+    """
+    Train a small model like production.train() does, and write the replay dataset for the startup benchmark
+
+    Output:
+        end_time (int): the epoch time (in seconds) for the prediction
+    """
+    esdr, smell = loadDataset(dataset_p, logger=logger)
+    raw = [df.copy() for _, df in esdr]
+    df_esdr, df_smell = preprocessData(df_esdr_array_raw=raw, df_smell_raw=smell.copy(), logger=logger)
+    df_X, df_Y, df_C = computeFeatures(df_esdr=df_esdr, df_smell=df_smell, f_hr=f_hr, b_hr=b_hr, thr=thr,
+        is_regr=False, add_inter=False, add_roll=False, add_diff=False, out_p_mean=tmp_p+"/mean.csv",
+        out_p_std=tmp_p+"/std.csv", logger=logger)
+    df_X_mean = pd.read_csv(tmp_p + "/mean.csv", index_col=0).squeeze("columns")
+    df_X_std = pd.read_csv(tmp_p + "/std.csv", index_col=0).squeeze("columns")
+    df_X, df_Y, df_C = df_X.iloc[-n_hours:], df_Y.iloc[-n_hours:], df_C.iloc[-n_hours:]
+    model = trainModel({"X": df_X, "Y": df_Y, "C": df_C}, method="HCR", logger=logger)
+    saveModelArtifact(model, tmp_p + "/production/model", df_X_mean=df_X_mean, df_X_std=df_X_std,
+        feature_names=df_X.columns, targets=df_Y.columns, logger=logger)
+    end_time = writeReplay(esdr, smell, tmp_p + "/replay/", 1, b_hr=b_hr)
+    return end_time
+
+
+def runCommand(code, code_p, n_repeats=STARTUP_REPEATS, logger=None):
+    """
+    Run python code in new processes and measure the wall time of the whole process
+
+    Output:
+        record (dict): "wall_s" is the median wall time in seconds, "wall_s_all" is the wall time of each process,
+            ..."peak_rss_mb" is the peak resident memory of the last process, and "modules" is the heavy modules
+            ...(see the HEAVY_MODULES flag) that the code loaded
+    """
+    probe = code + "\n" + STARTUP_PROBE % (HEAVY_MODULES,)
+    walls = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", probe], cwd=code_p, capture_output=True, text=True)
+        walls.append(time.perf_counter() - start)
+        if out.returncode != 0:
+            raise RuntimeError("Command failed in " + code_p + ":\n" + out.stderr[-2000:])
+    info = json.loads(out.stdout.strip().splitlines()[-1])
+    wall = float(np.median(walls))
+    record = {"wall_s": round(wall, 4), "wall_s_all": [round(w, 4) for w in walls],
+        "peak_rss_mb": round(info["peak_rss_mb"] or 0, 1), "rss_delta_mb": None, "rows": 1,
+        "rows_per_s": round(1 / wall, 2), "modules": info["modules"]}
+    log("Benchmark: " + json.dumps(record), logger)
+    return record
+
+
+def benchmarkScenario(esdr, smell, method=METHOD, n_eval_folds=N_EVAL_FOLDS, n_predictions=N_PREDICTIONS,
+    f_hr=8, b_hr=3, thr=40, logger=None):
+    """
+    Run and measure each stage on the raw data of a scenario
+
+    Input:
+        esdr (list of (str, pandas.DataFrame)): the name and the raw data of each ESDR source
+        smell (pandas.DataFrame): the raw smell reports
+        f_hr, b_hr, thr: see the train() function in production.py
+        for the other input arguments, see the runBenchmark() function
+
+    Output:
+        stages (dict): the measurements of each stage (see the measure() function)
+    """
+    stages = {}
+    tmp_p = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        # preprocessData() consumes the list, so it gets a new list with copies
+        raw = [df.copy() for _, df in esdr]
+        n_raw = sum(len(df) for df in raw) + len(smell)
+        (df_esdr, df_smell), stages["preprocessData"] = measure(lambda: preprocessData(df_esdr_array_raw=raw,
+            df_smell_raw=smell.copy(), logger=logger), n_raw, logger=logger)
+        del raw
+
+        (df_X, df_Y, df_C), stages["computeFeatures"] = measure(lambda: computeFeatures(df_esdr=df_esdr,
+            df_smell=df_smell, f_hr=f_hr, b_hr=b_hr, thr=thr, is_regr=False, add_inter=False, add_roll=False,
+            add_diff=False, out_p_mean=tmp_p+"/mean.csv", out_p_std=tmp_p+"/std.csv", logger=logger),
+            len(df_esdr), logger=logger)
+        del df_esdr, df_smell
+
+        model, stages["trainModel"] = measure(lambda: trainModel({"X": df_X, "Y": df_Y, "C": df_C}, method=method,
+            logger=logger), len(df_X), logger=logger)
+
+        # Detect events with the trained model on all rows, and measure the metric only
+        y_pred = model.predict(df_X, df_C) if isinstance(model, HybridCrowdClassifier) else model.predict(df_X)
+        y_pred = (np.asarray(y_pred) > 0).astype(int)
+        _, stages["evalEventDetection"] = measure(lambda: evalEventDetection(df_Y.values.squeeze(), y_pred, thr=1),
+            len(df_Y), logger=logger)
+
+        # The weekly folds of main.py, but only the last n_eval_folds folds are trained and tested
+        # ...(the plots are written to the temporary directory, since they are part of the validation stage)
+        num_folds = len(df_X) // 168
+        n_test = len(df_X) * n_eval_folds // (num_folds + 1)
+        _, stages["crossValidation"] = measure(lambda: crossValidation(df_X=df_X, df_Y=df_Y, df_C=df_C,
+            out_p_root=tmp_p+"/", method=method, num_folds=num_folds, skip_folds=num_folds-n_eval_folds,
+            train_size=8000, logger=logger),
+            n_test, logger=logger)
+
+        if isinstance(model, HybridCrowdClassifier):
+            stages["predict"] = benchmarkPredict(model, df_X, df_Y, esdr, smell, tmp_p, n_predictions=n_predictions,
+                f_hr=f_hr, b_hr=b_hr, thr=thr, logger=logger)
+        else:
+            # The PredictionService class needs the crowd feature, so it only works with HybridCrowdClassifier
+            log("Skip the prediction stage because method " + method + " is not HCR or CR", logger)
+    finally:
+        shutil.rmtree(tmp_p, ignore_errors=True)
+    return stages
+
+
+def benchmarkPredict(model, df_X, df_Y, esdr, smell, tmp_p, n_predictions=N_PREDICTIONS, f_hr=8, b_hr=3, thr=40,
+    logger=None):
+    """
+    Measure the predict() function of production.py for consecutive hours at the end of the data
+
+    The model is stored like production.train() does, and the data is replayed (see ReplayDataSource.py)
+        ...from a dataset directory that only has the last hours of the raw data
+
+    Output:
+        record (dict): see the measure() function, with the latency of the predictions in milliseconds
+    """
+    # Store the model and the last hours of the data (only these hours are needed for the predictions)
+    df_X_mean = pd.read_csv(tmp_p + "/mean.csv", index_col=0).squeeze("columns")
+    df_X_std = pd.read_csv(tmp_p + "/std.csv", index_col=0).squeeze("columns")
+    try:
+        saveModelArtifact(model, tmp_p + "/model", df_X_mean=df_X_mean, df_X_std=df_X_std,
+            feature_names=df_X.columns, targets=df_Y.columns, logger=logger)
+        engine = "flat"
+    except ValueError as e:
+        # Models that are not tree ensembles are stored as pickle files (see the modelFiles() function)
+        log("Store the model as a pickle file (" + str(e) + ")", logger)
+        joblib.dump(model, tmp_p + "/model.pkl")
+        engine = "sklearn"
+    dataset_p = tmp_p + "/replay/"
+    end_time = writeReplay(esdr, smell, dataset_p, n_predictions, b_hr=b_hr)
+
+    # Predict each hour like the daemon in production.py (the data window only pulls the new data)
+    data_source = ReplayDataSource(dataset_p, logger=logger)
+    service = PredictionService(data_path=tmp_p + "/", f_hr=f_hr, b_hr=b_hr, thr=thr, engine=engine,
+        data_window=DataWindow(b_hr+1, data_source=data_source, logger=logger), logger=logger)
+    latency = []
+
+    def predictAll():
+        n_predicted = 0
+        for k in range(n_predictions):
+            end_dt = datetime.fromtimestamp(end_time - (n_predictions - 1 - k) * 3600 + 60, tz=pytz.utc)
+            start = time.perf_counter()
+            n_predicted += service.predict(end_dt) is not None
+            latency.append(1000 * (time.perf_counter() - start))
+        return n_predicted
+    n_predicted, record = measure(predictAll, n_predictions, logger=logger)
+    record["engine"] = engine
+    record["n_predicted"] = n_predicted # predictions without enough data return None
+    record["latency_ms"] = {"first": latency[0], "median": float(np.median(latency)), "max": float(np.max(latency))}
+    return record
+
+
+def writeReplay(esdr, smell, dataset_p, n_predictions, b_hr=3):
+    """
+    Write a dataset directory for replaying (see ReplayDataSource.py) that only has the hours for the predictions
+
+    The hours that have the most smell reports are chosen, since the model needs the crowd feature
+
+    Output:
+        end_time (int): the epoch time (in seconds) of the hour of the last prediction
+    """
+    hours = (smell.index.values // 3600).astype(np.int64)
+    counts = pd.Series(1, index=hours).groupby(level=0).sum()
+    counts = counts.reindex(np.arange(hours.min(), hours.max() + 1), fill_value=0)
+    end_time = int(counts.rolling(n_predictions + b_hr + 1).sum().idxmax()) * 3600
+    start_time = end_time - (n_predictions + b_hr + 2) * 3600
+    checkAndCreateDir(dataset_p + "esdr_raw/")
+    for name, df in esdr:
+        df[(df.index >= start_time) & (df.index <= end_time + 3600)].to_csv(dataset_p + "esdr_raw/" + name + ".csv")
+    smell[(smell.index >= start_time) & (smell.index <= end_time + 3600)].to_csv(dataset_p + "smell_raw.csv")
+    return end_time
+
+
+def measure(func, rows, logger=None):
+    """
+    Run a function and measure its wall time, peak resident memory, and throughput
+
+    Input:
+        func (function): the function to run (without arguments)
+        rows (int): the number of rows (or items) that the function processes
+
+    Output:
+        output: the output of the function
+        record (dict): "wall_s" is the wall time in seconds, "peak_rss_mb" is the peak resident memory of the process
+            ...while the function runs, "rss_delta_mb" is the peak minus the memory before the function,
+            ..."rows" is the input rows, and "rows_per_s" is the throughput
+    """
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        output = func()
+    finally:
+        wall = time.perf_counter() - start
+        sampler.stop()
+    record = {"wall_s": round(wall, 4), "peak_rss_mb": round(sampler.peak / 1024**2, 1),
+        "rss_delta_mb": round((sampler.peak - sampler.before) / 1024**2, 1), "rows": int(rows),
+        "rows_per_s": round(rows / wall, 2) if wall > 0 else None}
+    log("Benchmark: " + json.dumps(record), logger)
+    return output, record
+
+
+class RssSampler():
+    """Sample the resident memory of this process in a background thread and keep the peak"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.before = currentRss()
+        self.peak = self.before
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, currentRss())
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, currentRss())
+
+
+def loadDataset(dataset_p, logger=None):
+    """
+    Load all raw data of a dataset
+
+    Output:
+        esdr (list of (str, pandas.DataFrame)): the name and the raw data of each ESDR source
+        smell (pandas.DataFrame): the raw smell reports
+            ...if the dataset has none, the reports in SMELL_PATH are used, and the ESDR data is limited to their time
+    """
+    data_source = ReplayDataSource(dataset_p, logger=logger)
+    start_time, end_time = -np.inf, np.inf
+    if not os.path.isfile(data_source.dataset_p + "smell_raw.csv"):
+        log("Use the smell reports in " + SMELL_PATH + " because " + dataset_p + " has none", logger)
+        smell = ReplayDataSource(SMELL_PATH, logger=logger).getSmell(start_time, end_time, allegheny_county=True)
+        start_time, end_time = smell.index.min(), smell.index.max()
+    else:
+        smell = data_source.getSmell(start_time, end_time, allegheny_county=True)
+    esdr = [(n, data_source.getEsdr(n, start_time, end_time)) for n in data_source.sourceNames()]
+    return esdr, smell
+
+
+def scaleData(esdr, smell, n_hours=1, n_feeds=1):
+    """
+    Create a synthetic version of the raw data with more hours and feeds
+
+    Input:
+        esdr, smell: the output of the loadDataset() function
+        n_hours (int): the number of times to repeat the time series (each copy starts after the previous one)
+        n_feeds (int): the number of copies of each feed (the copies have new feed ids, e.g., feed_26 -> feed_26001)
+
+    Output:
+        esdr, smell: the scaled data in the same format
+    """
+    if n_hours == 1 and n_feeds == 1:
+        return esdr, smell
+    t_min = min([df.index.min() for _, df in esdr if len(df) > 0] + [smell.index.min()])
+    t_max = max([df.index.max() for _, df in esdr if len(df) > 0] + [smell.index.max()])
+    span = int((t_max - t_min) // 3600 + 1) * 3600 # a whole number of hours, so that hours stay aligned
+
+    def repeat(df):
+        parts = [df.set_axis(df.index + k * span, axis=0) for k in range(n_hours)]
+        return pd.concat(parts) if n_hours > 1 else df
+
+    esdr_scaled = []
+    for name, df in esdr:
+        parts = [df] + [df.rename(columns=lambda c: re.sub(r"feed_(\d+)", lambda m: "feed_%s%03d" % (m.group(1), k),
+            c)) for k in range(1, n_feeds)]
+        df = pd.concat(parts, axis=1) if n_feeds > 1 else df
+        esdr_scaled.append((name, repeat(df)))
+    return esdr_scaled, repeat(smell)
+
+
+def saveResult(result, out_p, logger=None):
+    """Store a result in a JSON file named by the time and the commit, and print it"""
+    name = datetime.now().strftime("%Y-%m-%d-%H%M%S") + "-" + (result["commit"] or "unknown")[:8] + ".json"
+    checkAndCreateDir(out_p + name)
+    with open(out_p + name, "w") as f:
+        json.dump(result, f, indent=2)
+    log("Benchmark result created at " + out_p + name, logger)
+    printResult(result, logger=logger)
+
+
+def printResult(result, logger=None):
+    """Print a table of the wall time, peak memory, and throughput of each stage"""
+    for s, r in result["scenarios"].items():
+        log("Scenario " + s + ":", logger)
+        for stage, m in r["stages"].items():
+            log("\t%-20s %10.3f s %10.1f MB %14s rows/s" % (stage, m["wall_s"], m["peak_rss_mb"], m["rows_per_s"]),
+                logger)
+
+
+def compareResults(old_p=None, new_p=None, tolerance=TOLERANCE, out_p=OUT_PATH, logger=None):
+    """
+    Compare the wall time and the peak memory of two results
+
+    Input:
+        old_p (str): the path of the old result, None means the second latest file in out_p
+        new_p (str): the path of the new result, None means the latest file in out_p
+        tolerance (float): the ratio of slowdown that is flagged as a regression
+
+    Output:
+        regressions (list of str): the "scenario/stage" that got slower by more than the tolerance
+    """
+    if old_p is None or new_p is None:
+        files = sorted(f for f in os.listdir(out_p) if f.endswith(".json")) if os.path.isdir(out_p) else []
+        if len(files) < 2:
+            log("ERROR: need two results in " + out_p + " to compare", logger, level="error")
+            return None
+        old_p, new_p = old_p or out_p + files[-2], new_p or out_p + files[-1]
+    with open(old_p) as f:
+        old = json.load(f)
+    with open(new_p) as f:
+        new = json.load(f)
+    log("Compare " + str(old["commit"])[:8] + " (" + old_p + ") with " + str(new["commit"])[:8] + " (" + new_p + ")",
+        logger)
+    regressions = []
+    for s, r in new["scenarios"].items():
+        if s not in old["scenarios"]: continue
+        for stage, m in r["stages"].items():
+            m_old = old["scenarios"][s]["stages"].get(stage)
+            if m_old is None or not m_old["wall_s"]: continue
+            ratio = m["wall_s"] / m_old["wall_s"]
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "  <-- REGRESSION"
+                regressions.append(s + "/" + stage)
+            log("\t%-6s %-20s time %8.3f -> %8.3f s (x%.2f), memory %8.1f -> %8.1f MB%s" % (s, stage,
+                m_old["wall_s"], m["wall_s"], ratio, m_old["peak_rss_mb"], m["peak_rss_mb"], flag), logger)
+    return regressions
+
+
+def gitCommit(cwd=None):
+    """Return the current git commit (of the directory cwd), or None if it is not available"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=cwd).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environmentInfo():
+    """Return the versions of python and the main packages, and the number of CPUs"""
+    import sklearn
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+        "sklearn": sklearn.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,188 @@
+"""
+Compute model-agnostic feature importance and per-sample feature attribution
+"""
+
+
+import numpy as np
+import pandas as pd
+import warnings
+from scipy.sparse import csr_matrix
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.metrics import r2_score
+from sklearn.metrics import precision_recall_fscore_support
+from util import log, evalEventDetection
+from HybridCrowdClassifier import HybridCrowdClassifier
+
+
+def computePermutationImportance(model, X, Y, C=None, is_regr=False, scoring=None, n_repeats=5,
+    batch_size=None, n_jobs=-1, seed=None, feature_names=None, logger=None):
+    """
+    Compute the permutation importance of all features for a fitted model
+
+    The importance of a feature is the drop of the score after randomly permuting the feature
+    Features are split into batches, and each batch is processed by a worker in parallel
+        ...each worker keeps only one working copy of X and permutes one column at a time in place,
+        ...so we never materialize one full copy of X for each feature
+    Workers are threads, so the model, X, Y, and C are shared in memory without pickling
+
+    Input:
+        model: the fitted model from the trainModel() function in trainModel.py (including HybridCrowdClassifier)
+        X (numpy.ndarray or pandas.DataFrame): the features
+        Y (numpy.ndarray or pandas.DataFrame): the responses
+        C (numpy.ndarray or pandas.DataFrame): the crowd information (only for HybridCrowdClassifier)
+        is_regr (bool): regression or classification
+        scoring: "f_score", "event_f_score", "r2", or a function scoring(model, X, Y, C) that returns a number
+            ...None means "r2" for regression and "f_score" for classification
+        n_repeats (int): the number of times to permute each feature
+        batch_size (int): the number of features in each batch (None means splitting features evenly to workers)
+        n_jobs (int): the number of parallel workers
+        seed (int): the random seed for permuting features
+        feature_names (list of str): names of the features (None means using the columns of X if it is a DataFrame)
+        logger: the python logger created by the generateLogger() function
+
+    Output:
+        df_imp (pandas.DataFrame): the mean and std of the importance for each feature, sorted by the mean
+    """
+    log("Compute permutation importance...", logger)
+    if feature_names is None:
+        feature_names = X.columns if isinstance(X, pd.DataFrame) else [str(i) for i in range(X.shape[1])]
+    X = np.asarray(X)
+    Y = np.squeeze(np.asarray(Y))
+    C = None if C is None else np.asarray(C)
+    score = getScorer(scoring, is_regr)
+
+    # Split features into batches
+    n_feat = X.shape[1]
+    if batch_size is None:
+        batch_size = int(np.ceil(n_feat / float(effective_n_jobs(n_jobs))))
+    batches = [np.arange(i, min(i+batch_size, n_feat)) for i in range(0, n_feat, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    # Compute the scores with permuted features in parallel
+    # (models fitted on pandas.DataFrame warn about missing feature names for numpy arrays)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        base_score = score(model, X, Y, C)
+        log("Baseline score: " + str(base_score), logger)
+        result = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(permuteBatch)(model, X, Y, C, b, score, n_repeats, s) for b, s in zip(batches, seeds))
+    scores = np.concatenate(result, axis=0)
+    imp = base_score - scores
+
+    df_imp = pd.DataFrame(data={"mean": imp.mean(axis=1), "std": imp.std(axis=1)}, index=feature_names)
+    return df_imp.sort_values("mean", ascending=False)
+
+
+def permuteBatch(model, X, Y, C, features, score, n_repeats, seed):
+    """Compute the scores after permuting each feature in the batch, using one working copy of X"""
+    rng = np.random.default_rng(seed)
+    X_work = X.copy()
+    scores = np.zeros((len(features), n_repeats))
+    for i, j in enumerate(features):
+        col = X[:, j]
+        for r in range(n_repeats):
+            X_work[:, j] = col[rng.permutation(len(col))]
+            scores[i, r] = score(model, X_work, Y, C)
+        X_work[:, j] = col # restore the feature
+    return scores
+
+
+def getScorer(scoring, is_regr):
+    """Get the scoring function with the signature scoring(model, X, Y, C)"""
+    if callable(scoring):
+        return scoring
+    if scoring is None:
+        scoring = "r2" if is_regr else "f_score"
+    if scoring == "r2":
+        return lambda model, X, Y, C: r2_score(Y, predict(model, X, C), multioutput="variance_weighted")
+    elif scoring == "f_score":
+        return lambda model, X, Y, C: precision_recall_fscore_support(Y, predict(model, X, C, binary=True),
+            average="binary", zero_division=0)[2]
+    elif scoring == "event_f_score":
+        return lambda model, X, Y, C: evalEventDetection(Y, predict(model, X, C, binary=True), thr=1)["f_score"]
+    else:
+        raise ValueError("Scoring " + str(scoring) + " is not supported")
+
+
+def predict(model, X, C=None, binary=False):
+    """Predict with any model from the trainModel() function (the hybrid crowd classifier requires C)"""
+    if isinstance(model, HybridCrowdClassifier):
+        Y_pred = model.predict(X, C)
+        if binary:
+            # For the hybrid crowd classifier, label 1, 2, and 3 all mean that there is an event
+            Y_pred = (Y_pred > 0).astype(int)
+    else:
+        Y_pred = model.predict(X)
+    return Y_pred
+
+
+def computeTreePathAttribution(model, X, n_jobs=-1, feature_names=None, logger=None):
+    """
+    Compute the tree-path attribution of each feature for each sample
+
+    For each tree, the probability of the positive class changes at each split along the decision path,
+        ...and the change is attributed to the feature used by the split (also known as the Saabas method)
+    The prediction is decomposed as: predict_proba(X)[:,1] = bias + sum of the attribution of all features
+    Trees are processed in parallel by threads, and each tree uses one sparse matrix multiplication
+
+    Input:
+        model: the fitted forest classifier (e.g., ExtraTreesClassifier or RandomForestClassifier)
+            ...or a HybridCrowdClassifier with a forest as the base estimator
+        X (numpy.ndarray or pandas.DataFrame): the features
+        n_jobs (int): the number of parallel workers
+        feature_names (list of str): names of the features (None means using the columns of X if it is a DataFrame)
+        logger: the python logger created by the generateLogger() function
+
+    Output:
+        bias (numpy.ndarray): the expected probability of the positive class (the root of the trees) for each sample
+        df_attr (pandas.DataFrame): the attribution of each feature (columns) for each sample (rows)
+    """
+    log("Compute tree-path attribution...", logger)
+    if isinstance(model, HybridCrowdClassifier):
+        model = model.base_estimator
+    if feature_names is None:
+        feature_names = X.columns if isinstance(X, pd.DataFrame) else [str(i) for i in range(X.shape[1])]
+    X = np.ascontiguousarray(X, dtype=np.float32) # the data type that scikit-learn trees use
+    pos = len(model.classes_) - 1 # the index of the positive class
+
+    # Split trees into batches for the workers
+    trees = model.estimators_
+    n_batch = min(len(trees), effective_n_jobs(n_jobs))
+    batches = np.array_split(np.arange(len(trees)), n_batch)
+    result = Parallel(n_jobs=n_batch, prefer="threads")(
+        delayed(attributeTrees)([trees[i] for i in b], X, pos) for b in batches)
+
+    bias = sum(r[0] for r in result) / len(trees)
+    attr = sum(r[1] for r in result) / len(trees)
+    df_attr = pd.DataFrame(data=attr, columns=feature_names)
+    return np.full(len(X), bias), df_attr
+
+
+def attributeTrees(trees, X, pos):
+    """Sum the bias and the feature attribution of a batch of trees"""
+    n_sample, n_feat = X.shape
+    bias = 0.0
+    attr = np.zeros((n_sample, n_feat))
+    for dt in trees:
+        tree = dt.tree_
+        left, right = tree.children_left, tree.children_right
+        value = tree.value[:, 0, :]
+        prob = value[:, pos] / value.sum(axis=1)
+
+        # The parent of each node (the root has no parent)
+        is_split = left != -1
+        parent = np.full(tree.node_count, -1)
+        parent[left[is_split]] = np.where(is_split)[0]
+        parent[right[is_split]] = np.where(is_split)[0]
+
+        # The change of probability at each node, attributed to the feature that its parent splits on
+        child = np.where(parent >= 0)[0]
+        delta = prob[child] - prob[parent[child]]
+        D = csr_matrix((delta, (child, tree.feature[parent[child]])), shape=(tree.node_count, n_feat))
+
+        # Sum the changes along the decision path of each sample
+        path = dt.decision_path(X, check_input=False)
+        attr += (path @ D).toarray()
+        bias += prob[0]
+    return bias, attr
+
@@ -6,12 +6,15 @@ Compute features for classification or regression
 import numpy as np
 import pandas as pd
 from util import log, checkAndCreateDir, isDatetimeObjTzAware
+from profiling import profiled
 import pytz
+from functools import lru_cache
 
 
 def computeFeatures(df_esdr=None, df_smell=None, in_p=None, out_p=None, out_p_mean=None,
     out_p_std=None, is_regr=False, f_hr=8, b_hr=3, thr=40, add_roll=False, add_diff=False,
-    add_inter=False, add_sqa=False, in_p_mean=None, in_p_std=None, aggr_axis=True, logger=None):
+    add_inter=False, add_sqa=False, in_p_mean=None, in_p_std=None, aggr_axis=True, df_X_mean=None,
+    df_X_std=None, keep_datetime=False, regions=None, logger=None):
     """
     Compute both features (X) and responses (Y) to fit a model F where Y=F(X)
     
@@ -27,6 +30,8 @@ def computeFeatures(df_esdr=None, df_smell=None, in_p=None, out_p=None, out_p_me
         is_regr (bool): True means regression, and False means classification
         f_hr (int): the number of hours to look further and compute responses (Y),
             ...which is the sum of smell ratings (that are larger than 3) over the future f_hr hours
+            ...a list of hours (or a list of thresholds in thr) gives one column in Y for each (f_hr, thr) pair,
+            ...which is computed from the same features (see the getResponseName() function for column names)
         b_hr (int): the number of hours to look back and compute features (X),
             ...which are the sensor readings (on ESDR) over the past b_hr hours
         thr: the threshold for binning the smell value into two classes (for classification)
@@ -40,6 +45,13 @@ def computeFeatures(df_esdr=None, df_smell=None, in_p=None, out_p=None, out_p_me
         in_p_mean (str): the path to read the mean values for scaling features (X)
         in_p_std (str): the path to read the standard deviation values for scaling features (X)
         aggr_axis (bool): whether we want to sum all smell reports together for all zipcodes
+        df_X_mean (pandas.Series): the mean values for scaling features (X), used instead of in_p_mean
+        df_X_std (pandas.Series): the standard deviation values for scaling features (X), used instead of in_p_std
+        keep_datetime (bool): keep the "DateTime" column in the features (X), for matching predictions with time
+        regions (dict): predict smell events for each region instead of all zipcodes together (aggr_axis is ignored)
+            ...keys are region names, and values are lists of zipcodes (e.g., {"15213": ["15213"], ...})
+            ...Y has one column for each (region, f_hr, thr), and C has one column for each region
+            ...(see the getZipcodeRegions() and getResponseNames() functions)
         logger: the python logger created by the generateLogger() function
 
     Output:
@@ -88,7 +100,9 @@ def computeFeatures(df_esdr=None, df_smell=None, in_p=None, out_p=None, out_p_me
     df_X[df_X < 1e-6] = 0 # prevent extreme small values
 
     # Transform features
-    if in_p_mean is not None and in_p_std is not None:
+    if df_X_mean is not None and df_X_std is not None:
+        pass # use the mean and std that are already loaded (e.g., by the PredictionService class)
+    elif in_p_mean is not None and in_p_std is not None:
         df_X_mean = pd.read_csv(in_p_mean, index_col=0, squeeze=True)
         df_X_std = pd.read_csv(in_p_std, index_col=0, squeeze=True)
     else:
@@ -106,9 +120,23 @@ def computeFeatures(df_esdr=None, df_smell=None, in_p=None, out_p=None, out_p_me
 
     # Extract responses from smell data
     if df_smell is not None:
-        bins = None if is_regr else [-np.inf, thr, np.inf] # bin smell reports into labels or not
+        if regions is not None:
+            # Sum the zipcodes in each region, and compute the responses of all regions together
+            df_smell = sumRegions(df_smell, regions)
+            aggr_axis = False
+            if f_hr is not None and not isinstance(f_hr, (list, tuple)): f_hr = [f_hr]
+        if isinstance(f_hr, (list, tuple)) or isinstance(thr, (list, tuple)):
+            # Multiple horizons or thresholds, one column in Y for each pair (see extractSmellResponse)
+            if not isinstance(f_hr, (list, tuple)): f_hr = [f_hr]
+            if not isinstance(thr, (list, tuple)): thr = [thr]
+            bins = None if is_regr else [[-np.inf, t, np.inf] for t in thr]
+        else:
+            bins = None if is_regr else [-np.inf, thr, np.inf] # bin smell reports into labels or not
         labels = None if is_regr else [0, 1]
-        df_Y = extractSmellResponse(df_smell, f_hr, bins, labels, aggr_axis=aggr_axis)
+        if regions is not None and f_hr is None:
+            df_Y = None # regional responses need future hours (f_hr=None is only for predicting)
+        else:
+            df_Y = extractSmellResponse(df_smell, f_hr, bins, labels, aggr_axis=aggr_axis)
         if df_Y is not None:
             df_Y = df_Y.reset_index()
             # Sync DateTime column in esdr and smell data
@@ -120,7 +148,8 @@ def computeFeatures(df_esdr=None, df_smell=None, in_p=None, out_p=None, out_p_me
         df_C = pd.merge_ordered(df_X["DateTime"].to_frame(), df_C, on="DateTime", how="inner", fill_method=None)
 
     # drop datetime
-    df_X = df_X.drop("DateTime", axis=1)
+    if not keep_datetime:
+        df_X = df_X.drop("DateTime", axis=1)
     if df_smell is not None:
         if df_Y is not None:
             df_Y = df_Y.drop("DateTime", axis=1)
@@ -149,6 +178,7 @@ def computeFeatures(df_esdr=None, df_smell=None, in_p=None, out_p=None, out_p_me
     return df_X, df_Y, df_C
 
 
+@profiled()
 def extractFeatures(df, b_hr, add_inter, add_roll, add_diff, add_sqa):
     df = df.copy(deep=True)
     df_all = []
@@ -216,6 +246,10 @@ def extractFeatures(df, b_hr, add_inter, add_roll, add_diff, add_sqa):
 
 
 def extractSmellResponse(df, f_hr, bins, labels, aggr_axis=False):
+    # Compute the responses for several horizons and thresholds at once
+    if isinstance(f_hr, (list, tuple)):
+        return extractMultiSmellResponse(df, f_hr, bins, labels, aggr_axis=aggr_axis)
+
     df_resp = df.copy(deep=True)
 
     # Compute the total smell_values in future f_hr hours
@@ -236,17 +270,154 @@ def extractSmellResponse(df, f_hr, bins, labels, aggr_axis=False):
     return df_resp
 
 
+def extractMultiSmellResponse(df, f_hr, bins, labels, aggr_axis=True):
+    """
+    Compute the total smell values in the future f_hr hours for several f_hr values with one cumulative sum
+
+    Input:
+        df (pandas.DataFrame): the smell values for each zipcode or region (columns)
+        f_hr (list of int): the number of hours to look further
+        bins (list): the bins for each threshold (see the computeFeatures() function), None means regression
+        labels (list): the labels of the bins
+        aggr_axis (bool): True means summing the smell values of all columns,
+            ...and False means computing the responses of each column (e.g., each region) separately
+
+    Output:
+        df_resp (pandas.DataFrame): one column for each (column in df, f_hr, threshold), named by getResponseName()
+            ...the last max(f_hr) rows are removed, so that all columns have the same rows
+    """
+    if aggr_axis:
+        values, regions = df.sum(axis=1).values[:, None], [None]
+    else:
+        values, regions = np.nan_to_num(df.values.astype(float)), list(df.columns)
+    n = len(values) - max(f_hr)
+    if n <= 0: return None
+
+    # The sum over the rows t+1, ..., t+h is cs[t+h+1] - cs[t+1] (for all columns at once)
+    cs = np.concatenate([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    t = np.arange(n)
+    resp = {}
+    for h in f_hr:
+        total = cs[t+h+1] - cs[t+1]
+        if bins is None or labels is None:
+            for i, r in enumerate(regions):
+                resp[getResponseName(h, region=r)] = total[:, i]
+        else:
+            for b in bins:
+                # The same bins as pd.cut(total, b, labels=labels, right=False)
+                y = np.asarray(labels)[np.digitize(total, b[1:-1])]
+                for i, r in enumerate(regions):
+                    resp[getResponseName(h, b[1], region=r)] = y[:, i]
+
+    # Order the columns by region (see the getResponseNames() function)
+    thrs = [None] if bins is None or labels is None else [b[1] for b in bins]
+    columns = [getResponseName(h, t, region=r) for r in regions for h in f_hr for t in thrs]
+    return pd.DataFrame(data={c: resp[c] for c in columns}, index=df.index[:n])
+
+
+def getResponseName(f_hr, thr=None, region=None):
+    """Return the name of the response column for a horizon, a threshold (None for regression), and a region"""
+    name = "smell_" if region is None else "smell_" + str(region) + "_"
+    if thr is None:
+        return name + "f" + str(f_hr)
+    return name + "f" + str(f_hr) + "_t" + str(thr)
+
+
+def getResponseNames(f_hr, thr, is_regr=False, regions=None):
+    """
+    Return the names of the response columns for the f_hr, thr, and regions arguments of computeFeatures()
+
+    The first name is the response for the first horizon and the first threshold (of the first region)
+    The names are grouped by region, in the order of the columns in the crowd feature (C)
+    """
+    if not isinstance(f_hr, (list, tuple)): f_hr = [f_hr]
+    if not isinstance(thr, (list, tuple)): thr = [thr]
+    if is_regr: thr = [None]
+    return [getResponseName(h, t, region=r) for r in (regions or [None]) for h in f_hr for t in thr]
+
+
+def sumRegions(df, regions):
+    """
+    Sum the smell values of the zipcodes in each region
+
+    Input:
+        df (pandas.DataFrame): the smell values for each zipcode (columns, see preprocessData.py)
+        regions (dict): the zipcodes (list of str) of each region (key)
+
+    Output:
+        df_region (pandas.DataFrame): the smell values for each region (columns, in the order of the regions)
+            ...zipcodes without smell reports in df count as zero
+    """
+    # Zipcodes are strings when read from csv files but may be numbers in data from the API
+    values = df.rename(columns=str)
+    zipcodes = [z for r in regions.values() for z in map(str, r)]
+    values = values.reindex(columns=pd.unique(np.array(zipcodes)), fill_value=0).fillna(0)
+
+    # Use a membership matrix (zipcodes x regions), so all regions are summed with one matrix product
+    member = np.zeros((values.shape[1], len(regions)))
+    col = {z: i for i, z in enumerate(values.columns)}
+    for j, r in enumerate(regions.values()):
+        member[[col[str(z)] for z in r], j] = 1
+    return pd.DataFrame(data=values.values @ member, index=df.index, columns=list(regions))
+
+
+def getZipcodeRegions(df, min_smell=100, other="other"):
+    """
+    Define one region for each zipcode that has enough smell reports, and merge the other zipcodes into one region
+
+    Input:
+        df (pandas.DataFrame): the smell values for each zipcode (columns, see preprocessData.py)
+        min_smell (float): the minimum total smell value of a zipcode for having its own region
+        other (str): the name of the region that merges the other zipcodes
+
+    Output:
+        regions (dict): the zipcodes (list of str) of each region (see the computeFeatures() function)
+    """
+    df = df.drop(columns=["DateTime"], errors="ignore").rename(columns=str)
+    total = df.sum(axis=0)
+    regions = {z: [z] for z in total.index[total >= min_smell]}
+    rest = list(total.index[total < min_smell])
+    if len(rest) > 0: regions[other] = rest
+    return regions
+
+
 def convertWindDirection(df):
-    df_cp = df.copy(deep=True)
-    for c in df.columns:
-        if "SONICWD_DEG" in c or "@" in c:
-            df_c = df[c]
-            df_c.name = df_c.name.replace("@", "")
-            df_c_cos = np.cos(np.deg2rad(df_c))
-            df_c_sin = np.sin(np.deg2rad(df_c))
-            df_c_cos.name += "cosine"
-            df_c_sin.name += "sine"
-            df_cp.drop([c], axis=1, inplace=True)
-            df_cp[df_c_cos.name] = df_c_cos
-            df_cp[df_c_sin.name] = df_c_sin
-    return df_cp
+    """
+    Replace each wind direction column (in degrees) with its cosine and sine
+
+    The columns are "SONICWD_DEG" sensors or the columns that are marked with "@" (which is removed from the name)
+    The kept columns stay in the same order, followed by the cosine and sine of each direction column
+    All columns are converted to float and written into one preallocated array (see windDirectionPlan())
+    """
+    keep, direction, columns = windDirectionPlan(tuple(df.columns))
+    values = df.to_numpy(dtype=np.float64)
+    out = np.empty((len(df), len(columns)))
+    k = len(keep)
+    out[:, :k] = values[:, keep]
+    rad = np.deg2rad(values[:, direction])
+    np.cos(rad, out=out[:, k::2])
+    np.sin(rad, out=out[:, k+1::2])
+    return pd.DataFrame(out, index=df.index, columns=columns, copy=False)
+
+
+@lru_cache(maxsize=32)
+def windDirectionPlan(columns):
+    """
+    Find the wind direction columns once for each set of columns (the result is cached)
+
+    Input:
+        columns (tuple of str): the columns of the data frame
+
+    Output:
+        keep (numpy.ndarray): the positions of the columns that are kept
+        direction (numpy.ndarray): the positions of the wind direction columns
+        out_columns (list of str): the columns of the output
+    """
+    is_direction = ["SONICWD_DEG" in c or "@" in c for c in columns]
+    keep = np.array([i for i, d in enumerate(is_direction) if not d], dtype=np.intp)
+    direction = np.array([i for i, d in enumerate(is_direction) if d], dtype=np.intp)
+    out_columns = [columns[i] for i in keep]
+    for i in direction:
+        c = columns[i].replace("@", "")
+        out_columns += [c + "cosine", c + "sine"]
+    return keep, direction, out_columns
@@ -12,6 +12,8 @@ from sklearn.model_selection import TimeSeriesSplit
 from trainModel import trainModel
 from util import log, checkAndCreateDir, computeMetric, evaluateData
 from selectFeatures import selectFeatures
+from SharedDataset import SharedDataset
+from profiling import span, profiled
 import copy
 from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import roc_curve
@@ -33,11 +35,13 @@ def crossValidation(
     num_folds=144, # number of folds for validation
     skip_folds=48, # skip first n folds (not enough data for training)
     select_feat=False, # False means do not select features, int means select n number of features
+    warm_start_feat=False, # start the feature selection of each fold from the ranking of the previous fold
     hd_start=5, # definition of the starting time of "daytime", e.g. 6 means 6am
     hd_end=11, # definition of the ending time of "daytime", e.g. 14 means 2pm
     train_size=8000, # number of samples for training data
     event_thr=40, # the threshold of smell values to define an event, only used for is_regr=True
     pos_out=True, # always output positive values for regression or not
+    dataset=None, # the SharedDataset that stores X, Y, and C (used instead of df_X, df_Y, df_C, and in_p)
     logger=None):
 
     log("================================================================================", logger)
@@ -48,6 +52,7 @@ def crossValidation(
     log("num_folds = " + str(num_folds), logger)
     log("skip_folds = " + str(skip_folds), logger)
     log("select_feat = " + str(select_feat), logger)
+    log("warm_start_feat = " + str(warm_start_feat), logger)
 
     # Ouput path
     if out_p_root is not None:
@@ -56,7 +61,9 @@ def crossValidation(
         checkAndCreateDir(out_p)
 
     # Read features
-    if df_X is None or df_Y is None:
+    if dataset is not None:
+        df_X, df_Y, df_C = dataset.frame("X"), dataset.frame("Y"), dataset.frame("C")
+    elif df_X is None or df_Y is None:
         if in_p is not None:
             df_X = pd.read_csv(in_p[0])
             df_Y = pd.read_csv(in_p[1])
@@ -74,7 +81,13 @@ def crossValidation(
     # Perform feature selection for each cross validation fold
     if only_day_time:
         df_X, df_Y, df_C = df_X[daytime_idx], df_Y[daytime_idx], df_C[daytime_idx]
-    X, Y, C = df_X, df_Y, df_C
+
+    # Store the data once, so that each fold (and each worker) uses views instead of copies
+    own_dataset = dataset is None or only_day_time
+    if own_dataset:
+        dataset = SharedDataset({"X": df_X, "Y": df_Y, "C": df_C}, logger=logger)
+    X_columns = df_X.columns
+    df_X, df_Y, df_C = None, None, None
 
     # Validation folds
     # Notice that this is time-series prediction, we cannot use traditional cross-validation folds
@@ -88,33 +101,35 @@ def crossValidation(
     train_all = {"X": [], "Y": [], "Y_pred": [], "Y_score": [], "C": []}
     test_all = {"X": [], "Y": [], "Y_pred": [], "Y_score": [], "C": []}
     metric_all = {"train": [], "test": []}
-    for train_idx, test_idx in tscv.split(X, Y):
+    for train_idx, test_idx in tscv.split(np.zeros(len(dataset))):
         if fold < skip_folds:
             fold += 1
             continue
         fold += 1
         log("--------------------------------------------------------------", logger)
         log("Processing fold " + str(fold) + " with method " + str(method) + ":", logger)
-        # Do feature selection and convert data to numpy format
-        X_train, Y_train, C_train = X.iloc[train_idx], Y.iloc[train_idx], C.iloc[train_idx]
-        X_test, Y_test, C_test = X.iloc[test_idx], Y.iloc[test_idx], C.iloc[test_idx]
+        # Do feature selection and get the data in numpy format (views of the shared dataset)
+        train, test = dataset.fold(train_idx, test_idx)
         if select_feat:
-            X_train, Y_train = selectFeatures(X_train, Y_train, is_regr=is_regr, logger=logger, num_feat_rfe=select_feat)
-        X_test = X_test[X_train.columns]
-        X_train, Y_train, C_train = X_train.values, Y_train.values, C_train.values
-        X_test, Y_test, C_test = X_test.values, Y_test.values, C_test.values
+            # Adjacent folds share most of the training data, so RFE can start from the ranking of the previous fold
+            # NOTE: a warm start only refits the top features of the previous fold, so the selected features can differ
+            # ...from running RFE on each fold separately and depend on the order of the folds (off by default)
+            X_train, _ = selectFeatures(dataset.frame("X", train_idx), dataset.frame("Y", train_idx), is_regr=is_regr,
+                logger=logger, num_feat_rfe=select_feat, warm_start=warm_start_feat)
+            train["X"] = X_train.values
+            test["X"] = dataset.frame("X", test_idx)[X_train.columns].values
         # Prepare training and testing set
-        train = {"X": X_train, "Y": Y_train, "Y_pred": None, "C": C_train}
-        test = {"X": X_test, "Y": Y_test, "Y_pred": None, "C": C_test}
+        train["Y_pred"], test["Y_pred"] = None, None
         # Train model
         model = trainModel(train, method=method, is_regr=is_regr, logger=logger)
         # Evaluate model
-        if method in ["HCR", "CR"]: # the hybrid crowd classifier requires Y
-            test["Y_pred"] = model.predict(test["X"], test["C"])
-            train["Y_pred"] = model.predict(train["X"], train["C"])
-        else:
-            test["Y_pred"] = model.predict(test["X"])
-            train["Y_pred"] = model.predict(train["X"])
+        with span("predict", method=method, fold=fold, rows=len(test["X"]) + len(train["X"])):
+            if method in ["HCR", "CR"]: # the hybrid crowd classifier requires Y
+                test["Y_pred"] = model.predict(test["X"], test["C"])
+                train["Y_pred"] = model.predict(train["X"], train["C"])
+            else:
+                test["Y_pred"] = model.predict(test["X"])
+                train["Y_pred"] = model.predict(train["X"])
         # For regression, check if want to always output positive values
         if is_regr and pos_out:
             test["Y_pred"][test["Y_pred"]<0] = 0
@@ -134,8 +149,9 @@ def crossValidation(
             else:
                 test_all["Y_score"].append(model.predict_proba(test["X"]))
                 train_all["Y_score"].append(model.predict_proba(train["X"]))
-        train_all["X"].append(train["X"])
-        test_all["X"].append(test["X"])
+        # Only the last two columns (DayOfWeek and HourOfDay) are used for the evaluation, so do not copy all features
+        train_all["X"].append(np.array(train["X"][:,-2:]))
+        test_all["X"].append(np.array(test["X"][:,-2:]))
         # Print result
         for m in metric_i_train:
             log("Training metrics: " + m, logger)
@@ -177,7 +193,7 @@ def crossValidation(
         hd = "HourOfDay"
         dw = "DayOfWeek"
         # For training data
-        eva = evaluateData(train_all["Y"], train_all["Y_pred"], train_all["X"][:,-2:], col_names=df_X.columns[-2:].values)
+        eva = evaluateData(train_all["Y"], train_all["Y_pred"], train_all["X"][:,-2:], col_names=X_columns[-2:].values)
         log("--------------------------------------------------------------", logger)
         log("True positive counts (training data):", logger)
         log(eva["tp"][hd].value_counts(), logger)
@@ -195,7 +211,7 @@ def crossValidation(
         log(eva["fn"][hd].value_counts(), logger)
         log(eva["fn"][dw].value_counts(), logger)
         # For testing data
-        eva = evaluateData(test_all["Y"], test_all["Y_pred"], test_all["X"][:,-2:], col_names=df_X.columns[-2:].values)
+        eva = evaluateData(test_all["Y"], test_all["Y_pred"], test_all["X"][:,-2:], col_names=X_columns[-2:].values)
         log("--------------------------------------------------------------", logger)
         log("True positive counts (testing data):", logger)
         log(eva["tp"][hd].value_counts(), logger)
@@ -287,12 +303,7 @@ def crossValidation(
         #timeSeriesPlot(method, Y_true, Y_pred, out_p, dt_idx_te, w=40) # NOTE: this takes very long time
 
     # Release memory
-    del df_X
-    del df_Y
-    del X
-    del Y
-    del X_train
-    del X_test
+    if own_dataset: dataset.close()
     del train_all_dt
     del train_all
     del test_all_dt
@@ -302,6 +313,7 @@ def crossValidation(
     return True
 
 
+@profiled()
 def rocPlot(method, Y_true, Y_score, out_p):
     roc = round(roc_auc_score(Y_true, Y_score[:, -1]), 4)
     # Precision vs recall
@@ -342,6 +354,7 @@ def rocPlot(method, Y_true, Y_score, out_p):
     fig.savefig(out_p + method + "_clas_tpr_thr.png")
 
 
+@profiled()
 def prPlot(method, Y_true, Y_score, out_p):
     # Precision vs recall
     fig = plt.figure(figsize=(8, 8), dpi=150)
@@ -380,6 +393,7 @@ def prPlot(method, Y_true, Y_score, out_p):
     fig.savefig(out_p + method + "_clas_r_thr.png")
 
 
+@profiled()
 def timeSeriesPlot(method, Y_true, Y_pred, out_p, dt_idx, fold="all", show_y_tick=False, w=18):
     if len(Y_true.shape) > 1: Y_true = np.sum(Y_true, axis=1)
     if len(Y_pred.shape) > 1: Y_pred = np.sum(Y_pred, axis=1)
@@ -414,6 +428,7 @@ def timeSeriesPlot(method, Y_true, Y_pred, out_p, dt_idx, fold="all", show_y_tic
     plt.close()
 
 
+@profiled()
 def residualPlot(method, r2, mse, Y_true, Y_pred, out_p, dt_idx, r2_dt, mse_dt):
     if len(Y_true.shape) > 1: Y_true = np.sum(Y_true, axis=1)
     if len(Y_pred.shape) > 1: Y_pred = np.sum(Y_pred, axis=1)
@@ -487,6 +502,7 @@ def residualPlot(method, r2, mse, Y_true, Y_pred, out_p, dt_idx, r2_dt, mse_dt):
     fig.savefig(out_p + method + "_regr_res_pred_dt.png")
 
 
+@profiled()
 def predictionPlot(method, r2, mse, Y_true, Y_pred, out_p, dt_idx, r2_dt, mse_dt):
     if len(Y_true.shape) > 1: Y_true = np.sum(Y_true, axis=1)
     if len(Y_pred.shape) > 1: Y_pred = np.sum(Y_pred, axis=1)
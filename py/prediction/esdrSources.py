@@ -0,0 +1,138 @@
+"""
+The registry of ESDR sources (air quality and weather monitoring stations) that the model uses
+
+Each source is one raw data file (see the getData() function in getData.py) and has the following keys:
+    name (str): the name of the source, also the file name of its raw data
+    feeds (list of dict): the ESDR feeds that are merged into the source, from the lowest to the highest priority
+        ...(a later feed replaces the readings of the earlier feeds at the same time)
+        ...feed (str): the ESDR feed id
+        ...channels (list of str): the channels to get, the i-th channels of all feeds are merged into one column
+        ...factor (float): the scale factor for the readings of the feed (optional, e.g., for converting units)
+    display (dict): readable names of some channels (optional, keyed by the channel of the first feed)
+        ..."@" at the end marks a wind direction (see the convertWindDirection() function in computeFeatures.py)
+"""
+
+
+# Feed 26: Lawrenceville ACHD
+# Feed 28: Liberty ACHD
+# Feed 23: Flag Plaza ACHD
+# Feed 43 and 11067: Parkway East ACHD
+# Feed 1: Avalon ACHD
+# Feed 27: Lawrenceville 2 ACHD
+# Feed 29: Liberty 2 ACHD
+# Feed 3: North Braddock ACHD
+# Feed 3506: BAPC 301 39TH STREET BLDG AirNow
+# Feed 5975: Parkway East AirNow
+# Feed 3508: South Allegheny High School AirNow
+# Feed 24: Glassport High Street ACHD
+# Feed 11067: Parkway East Near Road ACHD
+# Feed 59665: Pittsburgh ACHD
+ESDR_SOURCES = [
+    {"name": "Feed_1_Avalon_ACHD_PM25", "feeds": [
+        {"feed": "1", "channels": ["PM25B_UG_M3"]},
+        {"feed": "1", "channels": ["PM25T_UG_M3"]},
+        {"feed": "1", "channels": ["PM25_640_UG_M3"]}]},
+    {"name": "Feed_1_Avalon_ACHD", "feeds": [
+        {"feed": "1", "channels": ["SO2_PPM", "H2S_PPM", "SIGTHETA_DEG", "SONICWD_DEG", "SONICWS_MPH"]}]},
+    {"name": "Feed_26_Lawrenceville_ACHD", "feeds": [
+        {"feed": "26", "channels": ["OZONE_PPM", "SONICWS_MPH", "SONICWD_DEG", "SIGTHETA_DEG"]}],
+        "display": {"SONICWS_MPH": "Lawrenceville_wind_speed", "SONICWD_DEG": "Lawrenceville_wind_direction_@",
+            "SIGTHETA_DEG": "Lawrenceville_wind_direction_std"}},
+    {"name": "Feed_26_and_Feed_59665_Lawrenceville_ACHD_PM25", "feeds": [
+        {"feed": "26", "channels": ["PM25B_UG_M3"]},
+        {"feed": "26", "channels": ["PM25T_UG_M3"]},
+        {"feed": "59665", "channels": ["PM25_640_UG_M3"]}]},
+    {"name": "Feed_26_and_Feed_59665_Lawrenceville_ACHD_PM10", "feeds": [
+        {"feed": "26", "channels": ["PM10B_UG_M3"]},
+        {"feed": "59665", "channels": ["PM10_640_UG_M3"]}]},
+    {"name": "Feed_27_Lawrenceville_2_ACHD", "feeds": [
+        {"feed": "27", "channels": ["NO_PPB", "NOY_PPB", "CO_PPB", "SO2_PPB"]}]},
+    {"name": "Feed_28_Liberty_ACHD", "feeds": [
+        {"feed": "28", "channels": ["H2S_PPM", "SO2_PPM", "SIGTHETA_DEG", "SONICWD_DEG", "SONICWS_MPH"]}],
+        "display": {"H2S_PPM": "Liberty_H2S", "SIGTHETA_DEG": "Liberty_wind_direction_std",
+            "SONICWD_DEG": "Liberty_wind_direction_@", "SONICWS_MPH": "Liberty_wind_speed"}},
+    {"name": "Feed_29_Liberty_2_ACHD_PM10", "feeds": [
+        {"feed": "29", "channels": ["PM10_UG_M3"]}]},
+    {"name": "Feed_29_Liberty_2_ACHD_PM25", "feeds": [
+        {"feed": "29", "channels": ["PM25_UG_M3"]},
+        {"feed": "29", "channels": ["PM25T_UG_M3"]}]},
+    {"name": "Feed_3_North_Braddock_ACHD", "feeds": [
+        {"feed": "3", "channels": ["SO2_PPM", "SONICWD_DEG", "SONICWS_MPH", "SIGTHETA_DEG"]}]},
+    {"name": "Feed_3_North_Braddock_ACHD_PM10", "feeds": [
+        {"feed": "3", "channels": ["PM10B_UG_M3"]},
+        {"feed": "3", "channels": ["PM10_640_UG_M3"]}]},
+    {"name": "Feed_23_Flag_Plaza_ACHD_CO", "feeds": [
+        {"feed": "23", "channels": ["CO_PPM"]},
+        {"feed": "23", "channels": ["CO_PPB"], "factor": 0.001}]},
+    {"name": "Feed_23_Flag_Plaza_ACHD_PM10", "feeds": [
+        {"feed": "23", "channels": ["PM10_UG_M3"]}]},
+    {"name": "Feed_43_and_Feed_11067_Parkway_East_ACHD", "feeds": [
+        {"feed": "11067", "channels": ["CO_PPB", "NO2_PPB", "NOX_PPB", "NO_PPB", "PM25T_UG_M3", "SIGTHETA_DEG",
+            "SONICWD_DEG", "SONICWS_MPH"]},
+        {"feed": "43", "channels": ["CO_PPB", "NO2_PPB", "NOX_PPB", "NO_PPB", "PM25T_UG_M3", "SIGTHETA_DEG",
+            "SONICWD_DEG", "SONICWS_MPH"]}],
+        "display": {"SIGTHETA_DEG": "ParkwayEast_wind_direction_std", "SONICWD_DEG": "ParkwayEast_wind_direction_@",
+            "SONICWS_MPH": "ParkwayEast_wind_speed"}},
+    {"name": "Feed_3506_BAPC_301_39TH_STREET_BLDG_AirNow", "feeds": [
+        {"feed": "3506", "channels": ["PM2_5", "OZONE"]}]},
+    {"name": "Feed_5975_Parkway_East_AirNow", "feeds": [
+        {"feed": "5975", "channels": ["PM2_5"]}]},
+    {"name": "Feed_3508_South_Allegheny_High_School_AirNow", "feeds": [
+        {"feed": "3508", "channels": ["PM2_5"]}]},
+    {"name": "Feed_24_Glassport_High_Street_ACHD", "feeds": [
+        {"feed": "24", "channels": ["PM10_UG_M3"]}]},
+]
+
+
+def esdrSourceNames(sources=None):
+    """Return the names of the sources (in the order of the data that the getData() function returns)"""
+    return [s["name"] for s in (sources or ESDR_SOURCES)]
+
+
+def esdrRequests(sources=None):
+    """
+    Return the ESDR requests for the getEsdrData() function in util.py
+
+    Output:
+        requests (list of list of dict): for each source, {"feed": ..., "channel": ..., "factor": ...} of each feed
+            ...where the channels are joined by commas
+    """
+    requests = []
+    for s in (sources or ESDR_SOURCES):
+        r = []
+        for f in s["feeds"]:
+            q = {"feed": f["feed"], "channel": ",".join(f["channels"])}
+            if "factor" in f: q["factor"] = f["factor"]
+            r.append(q)
+        requests.append(r)
+    return requests
+
+
+def esdrColumnName(feed, channel):
+    """Return the column name of a channel in the data exported from ESDR"""
+    return "3.feed_" + str(feed) + "." + channel
+
+
+def mergeColumnNames(a, b):
+    """Return the name of the column that merges two columns (see the mergeEsdrFeeds() function in util.py)"""
+    return a if a == b else a + ".." + b
+
+
+def esdrColumns(source):
+    """Return the columns of a source after merging its feeds, e.g., "3.feed_11067.CO_PPB..3.feed_43.CO_PPB" """
+    columns = None
+    for f in source["feeds"]:
+        names = [esdrColumnName(f["feed"], c) for c in f["channels"]]
+        columns = names if columns is None else [mergeColumnNames(a, b) for a, b in zip(columns, names)]
+    return columns
+
+
+def displayNames(sources=None):
+    """Return the readable names of the columns that have one, e.g., {"3.feed_28.H2S_PPM": "Liberty_H2S", ...}"""
+    names = {}
+    for s in (sources or ESDR_SOURCES):
+        channels = s["feeds"][0]["channels"]
+        for channel, column in zip(channels, esdrColumns(s)):
+            if channel in s.get("display", {}):
+                names[column] = s["display"][channel]
+    return names
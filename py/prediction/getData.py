@@ -4,9 +4,10 @@ Get smell and sensor data for training the prediction model
 
 
 from util import log, datetimeToEpochtime, getEsdrData, getSmellReports, checkAndCreateDir
+from esdrSources import ESDR_SOURCES, esdrSourceNames, esdrRequests
 
 
-def getData(out_p=None, start_dt=None, end_dt=None, region_setting=0, logger=None):
+def getData(out_p=None, start_dt=None, end_dt=None, region_setting=0, sources=None, data_source=None, logger=None):
     """
     Get and save smell and ESDR data
 
@@ -15,6 +16,9 @@ def getData(out_p=None, start_dt=None, end_dt=None, region_setting=0, logger=Non
         start_dt (datetime.datetime object): starting date that you want to get the data
         end_dt (datetime.datetime object): ending date that you want to get the data
         region_setting: setting of the region that we want to get the smell reports
+        sources (list of dict): the ESDR sources to get, None means all sources in the registry (see esdrSources.py)
+        data_source: the object that provides the data instead of ESDR and SmellPGH (e.g., ReplayDataSource)
+            ...it needs the getData(start_dt, end_dt, region_setting, sources) and sourceNames(sources) functions
         logger: the python logger created by the generateLogger() function
 
     Output:
@@ -23,102 +27,31 @@ def getData(out_p=None, start_dt=None, end_dt=None, region_setting=0, logger=Non
     """
     log("Get data...", logger)
 
-    # Get and save ESDR data
-    # Feed 26: Lawrenceville ACHD
-    # Feed 28: Liberty ACHD
-    # Feed 23: Flag Plaza ACHD
-    # Feed 43 and 11067: Parkway East ACHD
-    # Feed 1: Avalon ACHD
-    # Feed 27: Lawrenceville 2 ACHD
-    # Feed 29: Liberty 2 ACHD
-    # Feed 3: North Braddock ACHD
-    # Feed 3506: BAPC 301 39TH STREET BLDG AirNow
-    # Feed 5975: Parkway East AirNow
-    # Feed 3508: South Allegheny High School AirNow
-    # Feed 24: Glassport High Street ACHD
-    # Feed 11067: Parkway East Near Road ACHD
-    # Feed 59665: Pittsburgh ACHD
-    esdr_source_names = [
-        "Feed_1_Avalon_ACHD_PM25",
-        "Feed_1_Avalon_ACHD",
-        "Feed_26_Lawrenceville_ACHD",
-        "Feed_26_and_Feed_59665_Lawrenceville_ACHD_PM25",
-        "Feed_26_and_Feed_59665_Lawrenceville_ACHD_PM10",
-        "Feed_27_Lawrenceville_2_ACHD",
-        "Feed_28_Liberty_ACHD",
-        "Feed_29_Liberty_2_ACHD_PM10",
-        "Feed_29_Liberty_2_ACHD_PM25",
-        "Feed_3_North_Braddock_ACHD",
-        "Feed_3_North_Braddock_ACHD_PM10",
-        "Feed_23_Flag_Plaza_ACHD_CO",
-        "Feed_23_Flag_Plaza_ACHD_PM10",
-        "Feed_43_and_Feed_11067_Parkway_East_ACHD",
-        "Feed_3506_BAPC_301_39TH_STREET_BLDG_AirNow",
-        "Feed_5975_Parkway_East_AirNow",
-        "Feed_3508_South_Allegheny_High_School_AirNow",
-        "Feed_24_Glassport_High_Street_ACHD"
-    ]
-    # IMPORTANT: if you add more data that changes the length of the esdr_source list,
-    # ...you need to also add a name to the corresponding index of the esdr_source_names list.
-    esdr_source = [
-        [
-            {"feed": "1", "channel": "PM25B_UG_M3"},
-            {"feed": "1", "channel": "PM25T_UG_M3"},
-            {"feed": "1", "channel": "PM25_640_UG_M3"}
-        ],
-        [{"feed": "1", "channel": "SO2_PPM,H2S_PPM,SIGTHETA_DEG,SONICWD_DEG,SONICWS_MPH"}],
-        [{"feed": "26", "channel": "OZONE_PPM,SONICWS_MPH,SONICWD_DEG,SIGTHETA_DEG"}],
-        [
-            {"feed": "26", "channel": "PM25B_UG_M3"},
-            {"feed": "26", "channel": "PM25T_UG_M3"},
-            {"feed": "59665", "channel": "PM25_640_UG_M3"}
-        ],
-        [
-            {"feed": "26", "channel": "PM10B_UG_M3"},
-            {"feed": "59665", "channel": "PM10_640_UG_M3"}
-        ],
-        [{"feed": "27", "channel": "NO_PPB,NOY_PPB,CO_PPB,SO2_PPB"}],
-        [{"feed": "28", "channel": "H2S_PPM,SO2_PPM,SIGTHETA_DEG,SONICWD_DEG,SONICWS_MPH"}],
-        [{"feed": "29", "channel": "PM10_UG_M3"}],
-        [
-            {"feed": "29", "channel": "PM25_UG_M3"},
-            {"feed": "29", "channel": "PM25T_UG_M3"}
-        ],
-        [{"feed": "3", "channel": "SO2_PPM,SONICWD_DEG,SONICWS_MPH,SIGTHETA_DEG"}],
-        [
-            {"feed": "3", "channel": "PM10B_UG_M3"},
-            {"feed": "3", "channel": "PM10_640_UG_M3"}
-        ],
-        [
-            {"feed": "23", "channel": "CO_PPM"},
-            {"feed": "23", "channel": "CO_PPB", "factor": 0.001}
-        ],
-        [{"feed": "23", "channel": "PM10_UG_M3"}],
-        [
-            {"feed": "11067", "channel": "CO_PPB,NO2_PPB,NOX_PPB,NO_PPB,PM25T_UG_M3,SIGTHETA_DEG,SONICWD_DEG,SONICWS_MPH"},
-            {"feed": "43", "channel": "CO_PPB,NO2_PPB,NOX_PPB,NO_PPB,PM25T_UG_M3,SIGTHETA_DEG,SONICWD_DEG,SONICWS_MPH"}
-        ],
-        [{"feed": "3506", "channel": "PM2_5,OZONE"}],
-        [{"feed": "5975", "channel": "PM2_5"}],
-        [{"feed": "3508", "channel": "PM2_5"}],
-        [{"feed": "24", "channel": "PM10_UG_M3"}]
-    ]
-    start_time = datetimeToEpochtime(start_dt) / 1000 # ESDR uses seconds
-    end_time = datetimeToEpochtime(end_dt) / 1000 # ESDR uses seconds
-    df_esdr_array_raw = getEsdrData(esdr_source, start_time=start_time, end_time=end_time)
-
-    if region_setting == 0:
-        # Get smell reports (for the Smell PGH paper, only contains a certain zipcodes)
-        df_smell_raw = getSmellReports(start_time=start_time, end_time=end_time, api_version=1)
+    # Get and save ESDR data (see esdrSources.py for the sources)
+    if sources is None: sources = ESDR_SOURCES
+    if data_source is not None:
+        df_esdr_array_raw, df_smell_raw = data_source.getData(start_dt, end_dt, region_setting=region_setting,
+            sources=sources)
+        names = data_source.sourceNames(sources)
     else:
-        # Get smell reports (for general tasks, contains data from a wider geographical region)
-        df_smell_raw = getSmellReports(start_time=start_time, end_time=end_time, allegheny_county=True, api_version=2)
+        start_time = datetimeToEpochtime(start_dt) / 1000 # ESDR uses seconds
+        end_time = datetimeToEpochtime(end_dt) / 1000 # ESDR uses seconds
+        df_esdr_array_raw = getEsdrData(esdrRequests(sources), start_time=start_time, end_time=end_time)
+        names = esdrSourceNames(sources)
+
+        if region_setting == 0:
+            # Get smell reports (for the Smell PGH paper, only contains a certain zipcodes)
+            df_smell_raw = getSmellReports(start_time=start_time, end_time=end_time, api_version=1)
+        else:
+            # Get smell reports (for general tasks, contains data from a wider geographical region)
+            df_smell_raw = getSmellReports(start_time=start_time, end_time=end_time, allegheny_county=True,
+                api_version=2)
 
     # Check directory and save file
     if out_p is not None:
         for p in out_p: checkAndCreateDir(p)
-        for i in range(len(df_esdr_array_raw)):
-            df_esdr_array_raw[i].to_csv(out_p[0] + esdr_source_names[i] + ".csv")
+        for name, df in zip(names, df_esdr_array_raw):
+            df.to_csv(out_p[0] + name + ".csv")
         df_smell_raw.to_csv(out_p[1])
         log("Raw ESDR data created at " + out_p[0], logger)
         log("Raw smell data created at " + out_p[1], logger)
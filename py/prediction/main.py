@@ -2,9 +2,9 @@ import sys
 from util import checkAndCreateDir, generateLogger
 from getData import getData
 from preprocessData import preprocessData
-from analyzeData import analyzeData
-from computeFeatures import computeFeatures
-from crossValidation import crossValidation
+from Pipeline import Pipeline
+from ReplayDataSource import ReplayDataSource
+from profiling import profiled
 from datetime import datetime
 import pytz
 
@@ -16,7 +16,7 @@ def main(argv):
         mode = argv[1]
 
     # Parameters
-    # NOTE: if is_regr is changed, you need to run the computeFeatures function again to generate new features
+    # NOTE: the stages that depend on these parameters are computed again automatically when they are changed
     is_regr = False # False for classification, True for regression
     smell_thr = 40 # threshold to define a smell event
 
@@ -31,69 +31,105 @@ def main(argv):
     end_dt = datetime(2022, 12, 11, 0, tzinfo=pytz.timezone("US/Eastern"))
     region_setting = 1
 
-    # Set mode
-    get_data, preprocess_data, analyze_data, compute_features, cross_validation = False, False, False, False, False
-    if mode == "pipeline":
-        get_data = True
-        preprocess_data = True
-        compute_features = True
-        cross_validation = True
-    elif mode == "data":
-        get_data = True
-    elif mode == "preprocess":
-        preprocess_data = True
-    elif mode == "feature":
-        compute_features = True
-    elif mode == "validation":
-        cross_validation = True
-    elif mode == "analyze":
-        analyze_data = True
-    else:
-        get_data = True
-        preprocess_data = True
-        compute_features = True
-        cross_validation = True
+    # The dataset for replaying the raw data instead of downloading it (see ReplayDataSource.py)
+    # NOTE: None means downloading from ESDR and SmellPGH, and the smell_raw.csv file needs to be in the dataset
+    replay_p = None
+    #replay_p = "../../dataset/v2.1/"
+
+    # Build the pipeline
+    # NOTE: each stage only runs when its parameters or input files changed since its last run
+    # ...(see Pipeline.py, the keys of the stages are stored in the manifest.json file)
+    pipeline = Pipeline(p+"manifest.json")
 
     # Get data
     # OUTPUT: raw esdr and raw smell data
-    if get_data:
-        getData(out_p=[p+"esdr_raw/",p+"smell_raw.csv"], start_dt=start_dt, end_dt=end_dt, region_setting=region_setting)
+    # NOTE: raw data that is copied from the dataset directory is used as it is
+    # ...replay_p is only a parameter when it is set, so that the keys of existing pipelines do not change
+    data_params = {"p": p, "start_dt": start_dt, "end_dt": end_dt, "region_setting": region_setting}
+    if replay_p is not None: data_params["replay_p"] = replay_p
+    pipeline.addStage("data", runData, params=data_params, outputs=[p+"esdr_raw/", p+"smell_raw.csv"],
+        keep_existing=True)
 
     # Preprocess data
     # INPUT: raw esdr and raw smell data
     # OUTPUT: preprocessed esdr and smell data
-    if preprocess_data:
-        preprocessData(in_p=[p+"esdr_raw/",p+"smell_raw.csv"], out_p=[p+"esdr.csv",p+"smell.csv"])
+    pipeline.addStage("preprocess", runPreprocess, params={"p": p},
+        inputs=[p+"esdr_raw/", p+"smell_raw.csv"], outputs=[p+"esdr.csv", p+"smell.csv"])
 
     # Analyze data
-    if analyze_data:
-        analyzeData(in_p=[p+"esdr.csv",p+"smell.csv"], out_p_root=p, start_dt=start_dt, end_dt=end_dt)
+    # INPUT: preprocessed esdr and smell data
+    # OUTPUT: plots and tables
+    pipeline.addStage("analyze", runAnalyze, params={"p": p, "start_dt": start_dt, "end_dt": end_dt},
+        inputs=[p+"esdr.csv", p+"smell.csv"])
 
     # Compute features
     # INPUT: preprocessed esdr and smell data
     # OUTPUT: features and labels
-    if compute_features:
-        computeFeatures(in_p=[p+"esdr.csv",p+"smell.csv"], out_p=[p+"X.csv",p+"Y.csv",p+"C.csv"],
-            is_regr=is_regr, f_hr=8, b_hr=3, thr=smell_thr, add_inter=False, add_roll=False, add_diff=False)
+    pipeline.addStage("feature", runFeature, params={"p": p, "is_regr": is_regr, "f_hr": 8, "b_hr": 3,
+        "thr": smell_thr, "add_inter": False, "add_roll": False, "add_diff": False},
+        inputs=[p+"esdr.csv", p+"smell.csv"], outputs=[p+"X.csv", p+"Y.csv", p+"C.csv"])
 
     # Cross validation
     # INPUT: features
     # OUTPUT: plots or metrics
-    if cross_validation:
-        #methods = ["ET", "RF", "SVM", "RLR", "LR", "LA", "EN", "MLP", "KN", "DMLP"] # regression
-        #methods = ["ET", "RF", "SVM", "LG", "MLP", "KN", "DMLP", "HCR", "CR", "DT"] # classification
-        methods = ["ET"] # default for extra trees
-        #methods = genModelSet(is_regr)
-        p_log = p + "log/"
-        if is_regr: p_log += "regression/"
-        else: p_log += "classification/"
-        checkAndCreateDir(p_log)
-        num_folds = int((end_dt - start_dt).days / 7) # one fold represents a week
-        for m in methods:
-            start_time_str = datetime.now().strftime("%Y-%d-%m-%H%M%S")
-            lg = generateLogger(p_log + m + "-" + start_time_str + ".log", format=None)
-            crossValidation(in_p=[p+"X.csv",p+"Y.csv",p+"C.csv"], out_p_root=p, event_thr=smell_thr,
-                method=m, is_regr=is_regr, logger=lg, num_folds=num_folds, skip_folds=48, train_size=8000)
+    #methods = ["ET", "RF", "SVM", "RLR", "LR", "LA", "EN", "MLP", "KN", "DMLP"] # regression
+    #methods = ["ET", "RF", "SVM", "LG", "MLP", "KN", "DMLP", "HCR", "CR", "DT"] # classification
+    methods = ["ET"] # default for extra trees
+    #methods = genModelSet(is_regr)
+    num_folds = int((end_dt - start_dt).days / 7) # one fold represents a week
+    pipeline.addStage("validation", runValidation, params={"p": p, "methods": methods, "is_regr": is_regr,
+        "smell_thr": smell_thr, "num_folds": num_folds}, inputs=[p+"X.csv", p+"Y.csv", p+"C.csv"])
+
+    # Set mode
+    # NOTE: the stage of the mode always runs, and the stages before it only run if they are out of date
+    if mode in ["data", "preprocess", "feature", "validation", "analyze"]:
+        pipeline.run([mode], force=[mode])
+    elif mode == "all":
+        # The analyze and validation stages do not depend on each other and run at the same time
+        pipeline.run(["analyze", "validation"])
+    else:
+        pipeline.run(["validation"])
+
+
+@profiled("stage.data")
+def runData(p, start_dt, end_dt, region_setting, replay_p=None):
+    data_source = None if replay_p is None else ReplayDataSource(replay_p)
+    getData(out_p=[p+"esdr_raw/",p+"smell_raw.csv"], start_dt=start_dt, end_dt=end_dt, region_setting=region_setting,
+        data_source=data_source)
+
+
+@profiled("stage.preprocess")
+def runPreprocess(p):
+    preprocessData(in_p=[p+"esdr_raw/",p+"smell_raw.csv"], out_p=[p+"esdr.csv",p+"smell.csv"])
+
+
+@profiled("stage.analyze")
+def runAnalyze(p, start_dt, end_dt):
+    # The stages import their modules when they run, so that "python main.py data" does not load
+    # ...scikit-learn, matplotlib, and seaborn (analyzeData.py alone takes seconds to import)
+    from analyzeData import analyzeData
+    analyzeData(in_p=[p+"esdr.csv",p+"smell.csv"], out_p_root=p, start_dt=start_dt, end_dt=end_dt)
+
+
+@profiled("stage.feature")
+def runFeature(p, is_regr, f_hr, b_hr, thr, add_inter, add_roll, add_diff):
+    from computeFeatures import computeFeatures
+    computeFeatures(in_p=[p+"esdr.csv",p+"smell.csv"], out_p=[p+"X.csv",p+"Y.csv",p+"C.csv"],
+        is_regr=is_regr, f_hr=f_hr, b_hr=b_hr, thr=thr, add_inter=add_inter, add_roll=add_roll, add_diff=add_diff)
+
+
+@profiled("stage.validation")
+def runValidation(p, methods, is_regr, smell_thr, num_folds):
+    from crossValidation import crossValidation
+    p_log = p + "log/"
+    if is_regr: p_log += "regression/"
+    else: p_log += "classification/"
+    checkAndCreateDir(p_log)
+    for m in methods:
+        start_time_str = datetime.now().strftime("%Y-%d-%m-%H%M%S")
+        lg = generateLogger(p_log + m + "-" + start_time_str + ".log", format=None)
+        crossValidation(in_p=[p+"X.csv",p+"Y.csv",p+"C.csv"], out_p_root=p, event_thr=smell_thr,
+            method=m, is_regr=is_regr, logger=lg, num_folds=num_folds, skip_folds=48, train_size=8000)
 
 
 def genModelSet(is_regr):
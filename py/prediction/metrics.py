@@ -0,0 +1,257 @@
+"""
+Metrics of the production predictor in the Prometheus text format (version 0.0.4)
+
+The metrics are kept in memory by the process and can be exposed in two ways:
+    writeMetrics(path)
+        ...writes all metrics to a file (e.g., for the textfile collector of the node exporter),
+        ...the file is replaced atomically, so a scraper never reads a partially written file
+    serveMetrics(host, port)
+        ...serves "GET /metrics" from a background thread (predictionServer.py also serves "GET /metrics")
+
+The metrics of the predictor are defined at the bottom of this file, for example:
+    with PREDICTION_LATENCY.time(model="county", stage="model"):
+        y_pred = model.predict(X, C)
+    LAST_PREDICTION.set(y_pred, model="county", target="primary")
+
+No client library is needed, the format is simple enough to write directly
+"""
+
+
+import os
+import math
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric():
+    """The base class of the metrics, which stores one value for each combination of label values"""
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {} # tuple of label values: value
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("Metric " + self.name + " needs the labels " + str(self.labels) + ", got " + str(labels))
+        return tuple(str(labels[k]) for k in self.labels)
+
+    def render(self):
+        """Return the lines of the metric in the text format"""
+        lines = ["# HELP " + self.name + " " + self.documentation.replace("\\", "\\\\").replace("\n", "\\n"),
+            "# TYPE " + self.name + " " + self.kind]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self.renderValue(key, value))
+        return lines
+
+    def renderValue(self, key, value):
+        return [self.name + formatLabels(self.labels, key) + " " + formatValue(value)]
+
+
+class Counter(Metric):
+    """A value that only goes up (e.g., the number of sent notifications)"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down (e.g., the last prediction)"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = float(value)
+
+    def clear(self):
+        """Remove all label values (e.g., the channels of the previous data window)"""
+        with self.lock:
+            self.values = {}
+
+
+class Histogram(Metric):
+    """The distribution of observed values (e.g., latencies) in cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels=labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0]
+            counts, _ = self.values[key]
+            for i, b in enumerate(self.buckets):
+                if value <= b: counts[i] += 1
+            self.values[key][1] += value
+
+    def time(self, **labels):
+        """Return a context manager that observes the number of seconds spent inside it"""
+        return Timer(self, labels)
+
+    def renderValue(self, key, value):
+        counts, total = value
+        lines = []
+        for b, c in zip(self.buckets, counts):
+            le = "+Inf" if b == math.inf else formatValue(b)
+            lines.append(self.name + "_bucket" + formatLabels(self.labels + ("le",), key + (le,)) + " " + str(c))
+        lines.append(self.name + "_sum" + formatLabels(self.labels, key) + " " + formatValue(total))
+        lines.append(self.name + "_count" + formatLabels(self.labels, key) + " " + str(counts[-1]))
+        return lines
+
+
+class Timer():
+    """See the time() function of the Histogram class"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry():
+    """The metrics that are exposed together"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def add(self, metric):
+        with self.lock:
+            if any(m.name == metric.name for m in self.metrics):
+                raise ValueError("Metric " + metric.name + " already exists")
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return all metrics in the text format"""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+def formatLabels(names, values):
+    if len(names) == 0:
+        return ""
+    escaped = [v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in values]
+    return "{" + ",".join(k + "=\"" + v + "\"" for k, v in zip(names, escaped)) + "}"
+
+
+def formatValue(value):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def writeMetrics(path, registry=None):
+    """
+    Write the metrics to a file in the text format
+
+    Input:
+        path (str): the file path (e.g., "data_production/metrics.prom")
+        registry (MetricsRegistry): the metrics to write, None means the metrics of the predictor
+    """
+    text = (registry or REGISTRY).render()
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first and then rename it, so that a scraper never reads a partial file
+    path_tmp = path + ".tmp"
+    with open(path_tmp, "w") as f:
+        f.write(text)
+    os.replace(path_tmp, path)
+
+
+def serveMetrics(host="127.0.0.1", port=9108, registry=None):
+    """
+    Serve "GET /metrics" in a background thread (the thread stops when the process exits)
+
+    Output:
+        server (ThreadingHTTPServer): the server, port=0 means a free port in server.server_address[1]
+    """
+    handler = type("Handler", (MetricsHandler,), {"registry": registry or REGISTRY})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        sendMetrics(self, self.registry)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def sendMetrics(handler, registry=None):
+    """Send the metrics as the response of an HTTP request handler"""
+    data = (registry or REGISTRY).render().encode("utf-8")
+    handler.send_response(200)
+    handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    handler.send_header("Content-Length", str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+
+# The metrics of the predictor
+REGISTRY = MetricsRegistry()
+PREDICTION_LATENCY = REGISTRY.add(Histogram("smell_prediction_latency_seconds",
+    "Time of each step of a prediction (data, preprocess, features, model, and total)", labels=["model", "stage"]))
+PREDICTIONS = REGISTRY.add(Counter("smell_predictions_total",
+    "Number of predictions by result (ok, or the reason why there is no prediction)", labels=["model", "result"]))
+LAST_PREDICTION = REGISTRY.add(Gauge("smell_last_prediction",
+    "Last prediction (0 no event, 1 predicted, 2 detected by the crowd, 3 both) for each target",
+    labels=["model", "target"]))
+LAST_PREDICTION_TIME = REGISTRY.add(Gauge("smell_last_prediction_timestamp_seconds",
+    "Epoch time of the last prediction", labels=["model"]))
+ESDR_FETCH_LATENCY = REGISTRY.add(Histogram("smell_esdr_fetch_latency_seconds",
+    "Time of pulling the channels of one ESDR feed", labels=["feed"]))
+ESDR_FETCH_ERRORS = REGISTRY.add(Counter("smell_esdr_fetch_errors_total",
+    "Number of failed pulls of an ESDR feed", labels=["feed"]))
+ESDR_LAST_READING = REGISTRY.add(Gauge("smell_esdr_last_reading_timestamp_seconds",
+    "Epoch time of the latest reading of an ESDR feed in the last pull (for the data freshness)", labels=["feed"]))
+MISSING_VALUES = REGISTRY.add(Gauge("smell_missing_channel_values",
+    "Number of hours that are filled with -1 in the data window of the last prediction", labels=["channel"]))
+MISSING_FEATURES = REGISTRY.add(Gauge("smell_missing_features",
+    "Number of model features that the data of the last prediction did not have (no prediction if not 0)",
+    labels=["model"]))
+MODEL_LOAD_SECONDS = REGISTRY.add(Gauge("smell_model_load_seconds",
+    "Time of the last model load", labels=["model"]))
+MODEL_LOADS = REGISTRY.add(Counter("smell_model_loads_total",
+    "Number of model loads by result (ok or error)", labels=["model", "result"]))
+NOTIFICATIONS = REGISTRY.add(Counter("smell_notifications_total",
+    "Number of push notification attempts by type and status (sent, pending, failed, or unconfirmed)",
+    labels=["type", "status"]))
+LAST_NOTIFICATION_TIME = REGISTRY.add(Gauge("smell_last_notification_timestamp_seconds",
+    "Epoch time of the last delivered push notification", labels=["type"]))
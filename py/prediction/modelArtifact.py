@@ -0,0 +1,228 @@
+"""
+Save and load tree ensembles as a model artifact (a directory) instead of a pickle file
+
+The artifact stores the nodes of all trees in flat numpy arrays (one .npy file per array),
+    ...which can be memory-mapped, so loading does not unpickle thousands of python objects,
+    ...and several processes that map the same files share the pages in the operating system cache
+The header.json file stores the metadata, including the feature columns and the mean/std for scaling features
+
+Layout of the artifact directory:
+    header.json: format version, model type, parameters, classes, feature columns, mean, std, ...
+    nodes.npy: the nodes of all trees concatenated (the structured array in sklearn.tree._tree.Tree)
+    values.npy: the class counts (or regression values) of all nodes, shape (n_nodes, n_outputs, max_n_classes)
+    offsets.npy: node i of tree t is at offsets[t] + i, shape (n_trees + 1,)
+"""
+
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from util import log, checkAndCreateDir
+from HybridCrowdClassifier import HybridCrowdClassifier
+from FlatForest import FlatForest, flattenTrees
+
+
+# The version of the artifact layout, increase it when the layout changes
+FORMAT_VERSION = 1
+
+# The estimators that can be stored in the artifact (name: (ensemble class name, tree class name))
+# NOTE: the classes are looked up by the estimatorClasses() function, so that the flat engine does not need
+# ...to import scikit-learn (which takes most of the startup time of the production predictor)
+ESTIMATORS = {
+    "RandomForestClassifier": ("RandomForestClassifier", "DecisionTreeClassifier"),
+    "ExtraTreesClassifier": ("ExtraTreesClassifier", "ExtraTreeClassifier"),
+    "RandomForestRegressor": ("RandomForestRegressor", "DecisionTreeRegressor"),
+    "ExtraTreesRegressor": ("ExtraTreesRegressor", "ExtraTreeRegressor"),
+    "DecisionTreeClassifier": (None, "DecisionTreeClassifier"),
+    "DecisionTreeRegressor": (None, "DecisionTreeRegressor"),
+}
+
+
+def saveModelArtifact(model, out_p, df_X_mean=None, df_X_std=None, feature_names=None, targets=None, regions=None,
+    logger=None):
+    """
+    Save a tree ensemble (or a HybridCrowdClassifier that uses a tree ensemble) as a model artifact
+
+    The new artifact is written to a temporary directory first and then swapped in with a symbolic link,
+        ...so that a running predictor never loads a partially written artifact
+
+    Input:
+        model: the trained model (see the supported estimators in the ESTIMATORS variable)
+        out_p (str): the path of the artifact directory (e.g., "data_production/model")
+        df_X_mean (pandas.Series): the mean values for scaling features (see computeFeatures.py)
+        df_X_std (pandas.Series): the standard deviation values for scaling features (see computeFeatures.py)
+        feature_names (list of str): the feature columns in the order that the model uses
+            ...None means using the feature names that the model was trained with (if any)
+        targets (list of str): the names of the responses (the columns in Y, see computeFeatures.py)
+        regions (dict): the zipcodes of each region for a regional model (see computeFeatures.py)
+        logger: the python logger created by the generateLogger() function
+    """
+    header = {"format_version": FORMAT_VERSION}
+    estimator = model
+    if isinstance(model, HybridCrowdClassifier):
+        header["hybrid"] = {"crowd_thr": model.crowd_thr}
+        estimator = model.base_estimator
+    if estimator is not None:
+        name = type(estimator).__name__
+        if name not in ESTIMATORS:
+            raise ValueError("Model " + name + " cannot be saved as an artifact")
+        trees = estimator.estimators_ if ESTIMATORS[name][0] is not None else [estimator]
+        header["estimator"] = name
+        header["params"] = jsonSafe(estimator.get_params(deep=False))
+        header["n_features_in"] = int(estimator.n_features_in_)
+        header["n_outputs"] = int(estimator.n_outputs_)
+        if hasattr(estimator, "classes_"):
+            classes = estimator.classes_ if estimator.n_outputs_ > 1 else [estimator.classes_]
+            header["classes"] = [jsonSafe(list(c)) for c in classes]
+        nodes, values, offsets, header["max_depth"] = flattenTrees(trees)
+        if feature_names is None and hasattr(estimator, "feature_names_in_"):
+            feature_names = estimator.feature_names_in_
+    if feature_names is not None:
+        header["feature_names"] = [str(f) for f in feature_names]
+    if targets is not None:
+        header["targets"] = [str(t) for t in targets]
+    if regions is not None:
+        header["regions"] = {str(r): [str(z) for z in zipcodes] for r, zipcodes in regions.items()}
+    if df_X_mean is not None and df_X_std is not None:
+        header["mean"] = jsonSafe(df_X_mean.to_dict())
+        header["std"] = jsonSafe(df_X_std.to_dict())
+
+    # Write everything into a new directory next to the artifact path
+    out_p = out_p.rstrip("/")
+    checkAndCreateDir(out_p)
+    version_p = out_p + "." + str(os.getpid()) + "." + str(int(1000 * pd.Timestamp.now().timestamp()))
+    os.makedirs(version_p)
+    if estimator is not None:
+        np.save(os.path.join(version_p, "nodes.npy"), nodes)
+        np.save(os.path.join(version_p, "values.npy"), values)
+        np.save(os.path.join(version_p, "offsets.npy"), offsets)
+    with open(os.path.join(version_p, "header.json"), "w") as f:
+        json.dump(header, f, indent=2)
+
+    # Point the artifact path to the new directory (renaming a symbolic link is atomic)
+    old_p = os.path.realpath(out_p) if os.path.islink(out_p) else None
+    if os.path.isdir(out_p) and old_p is None:
+        shutil.rmtree(out_p) # a plain directory cannot be replaced atomically (e.g., copied from another machine)
+    link_p = version_p + ".link"
+    os.symlink(os.path.basename(version_p), link_p)
+    os.replace(link_p, out_p)
+    if old_p is not None and old_p != os.path.realpath(out_p):
+        # Processes that still map the old files can keep using them after the files are removed
+        shutil.rmtree(old_p, ignore_errors=True)
+    log("Model artifact saved at " + out_p, logger)
+
+
+def loadModelArtifact(in_p, mmap_mode="r", engine="sklearn", logger=None):
+    """
+    Load a model artifact that is saved by the saveModelArtifact() function
+
+    Input:
+        in_p (str): the path of the artifact directory
+        mmap_mode (str): the memory-map mode for the node arrays (see numpy.load), None means reading into memory
+        engine (str): "sklearn" rebuilds the scikit-learn estimator
+            ..."flat" uses the FlatForest class, which predicts directly from the (shared) node arrays
+            ...and is much faster for predicting a few rows
+        logger: the python logger created by the generateLogger() function
+
+    Output:
+        model: the model that was saved (the scikit-learn estimator or the HybridCrowdClassifier)
+        header (dict): the metadata of the artifact
+            ...header["feature_names"] is the feature columns in the order that the model uses
+            ...header["mean"] and header["std"] are pandas.Series for scaling features (if they were saved)
+            ...header["targets"] is the names of the responses (if they were saved)
+            ...header["regions"] is the zipcodes of each region (only for a regional model)
+    """
+    header = readModelHeader(in_p)
+    for k in ["mean", "std"]:
+        if k in header: header[k] = pd.Series(header[k], dtype=float)
+
+    # Rebuild the trees from the node arrays
+    estimator = None
+    if "estimator" in header:
+        arrays = loadNodeArrays(in_p, mmap_mode=mmap_mode)
+        n_features, n_outputs = header["n_features_in"], header["n_outputs"]
+        attrs = {"n_features_in_": n_features, "n_outputs_": n_outputs}
+        if "classes" in header:
+            classes = [np.array(c) for c in header["classes"]]
+            n_classes = np.array([len(c) for c in classes], dtype=np.intp)
+            attrs["classes_"] = classes[0] if n_outputs == 1 else classes
+            attrs["n_classes_"] = int(n_classes[0]) if n_outputs == 1 else list(n_classes)
+        else:
+            n_classes = np.ones(n_outputs, dtype=np.intp)
+        if "feature_names" in header:
+            attrs["feature_names_in_"] = np.array(header["feature_names"], dtype=object)
+        offsets, nodes, values = arrays["offsets"], arrays["nodes"], arrays["values"]
+        if engine == "flat":
+            classes = [np.array(c) for c in header["classes"]] if "classes" in header else None
+            estimator = FlatForest(nodes, values, offsets, max(header["max_depth"]), classes=classes,
+                n_features_in=n_features, feature_names=header.get("feature_names"), logger=logger)
+        elif engine != "sklearn":
+            raise ValueError("Engine " + str(engine) + " is not supported")
+    if estimator is None and "estimator" in header:
+        from sklearn.tree._tree import Tree
+        ensemble_class, tree_class = estimatorClasses(header["estimator"])
+        trees = []
+        for t in range(len(offsets) - 1):
+            start, end = offsets[t], offsets[t+1]
+            tree = Tree(n_features, n_classes, n_outputs)
+            tree.__setstate__({"max_depth": header["max_depth"][t], "node_count": int(end - start),
+                "nodes": np.ascontiguousarray(nodes[start:end]),
+                "values": np.ascontiguousarray(values[start:end, :, :max(n_classes)])})
+            dt = tree_class()
+            dt.__dict__.update(attrs)
+            dt.max_features_ = n_features
+            dt.tree_ = tree
+            trees.append(dt)
+        if ensemble_class is None:
+            estimator = trees[0]
+            estimator.set_params(**header["params"])
+        else:
+            estimator = ensemble_class(**header["params"])
+            estimator.__dict__.update(attrs)
+            estimator.estimators_ = trees
+            estimator.base_estimator_ = tree_class()
+
+    # Wrap the estimator with the hybrid crowd classifier
+    model = estimator
+    if "hybrid" in header:
+        model = HybridCrowdClassifier(base_estimator=estimator, crowd_thr=header["hybrid"]["crowd_thr"], logger=logger)
+    return model, header
+
+
+def estimatorClasses(name):
+    """Return (ensemble class, tree class) of an estimator in the ESTIMATORS variable"""
+    from sklearn import ensemble, tree
+    ensemble_name, tree_name = ESTIMATORS[name]
+    return getattr(ensemble, ensemble_name) if ensemble_name is not None else None, getattr(tree, tree_name)
+
+
+def readModelHeader(in_p):
+    """Read and check the header of a model artifact"""
+    with open(os.path.join(in_p, "header.json")) as f:
+        header = json.load(f)
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError("Model artifact format version " + str(header.get("format_version")) +
+            " is not supported (expected " + str(FORMAT_VERSION) + ")")
+    return header
+
+
+def loadNodeArrays(in_p, mmap_mode="r"):
+    """Load the node arrays of a model artifact (memory-mapped by default)"""
+    return {k: np.load(os.path.join(in_p, k + ".npy"), mmap_mode=mmap_mode) for k in ["nodes", "values", "offsets"]}
+
+
+def jsonSafe(obj):
+    """Convert numpy types in a dictionary or list to python types for writing json files"""
+    if isinstance(obj, dict):
+        return {str(k): jsonSafe(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [jsonSafe(v) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, float) and not np.isfinite(obj):
+        return None
+    if obj is not None and not isinstance(obj, (str, int, float, bool)):
+        return None # e.g., a numpy RandomState object as the random_state parameter
+    return obj
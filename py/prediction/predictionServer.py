@@ -0,0 +1,125 @@
+"""
+A local HTTP/JSON service for querying smell event predictions (without sending push notifications)
+
+GET /health
+    ...returns {"status": "ok", "model_loaded": true or false}
+
+GET /metrics
+    ...returns the metrics of the predictor in the Prometheus text format (see metrics.py)
+
+POST /predict with one of the following JSON bodies
+    {"timestamps": [1546300800, ...]}
+        ...pull the data around the epoch times (in seconds) from ESDR and SmellPGH, and predict each time point
+    {"esdr": [[{"EpochTime": 1546300800, "column": value, ...}, ...], ...], "smell": [{"EpochTime": ..., ...}, ...]}
+        ...use a window of raw readings (one list of records for each ESDR source, see the getData() function)
+        ...and predict all time points that have enough data
+    ...returns {"predictions": [{"EpochTime": ..., "DateTime": ..., "predict": ..., "predict_proba": ...}, ...]}
+    ...for the meaning of "predict", see the predict() function in HybridCrowdClassifier.py
+    ...a multi-output model also returns "predict_[name]" and "predict_proba_[name]" for each horizon and threshold
+"""
+
+
+import json
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from util import log
+from metrics import sendMetrics
+
+
+def servePredictions(service, host="127.0.0.1", port=8000, logger=None):
+    """
+    Start the HTTP server and handle requests until the process is stopped
+
+    Input:
+        service (PredictionService): the object that stores the model and computes predictions
+        host (str): the address to bind, the default only accepts connections from the local machine
+        port (int): the port to bind
+        logger: the python logger created by the generateLogger() function
+    """
+    server = createServer(service, host=host, port=port, logger=logger)
+    log("Serve predictions at http://" + host + ":" + str(server.server_address[1]), logger)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def createServer(service, host="127.0.0.1", port=8000, logger=None):
+    """
+    Create the HTTP server (port=0 means a free port chosen by the operating system)
+
+    For the description of the input arguments, see the servePredictions() function
+    """
+    # Load the model before accepting requests, so that the first request is not slow
+    service.reload()
+    handler = type("Handler", (PredictionHandler,), {"service": service, "logger": logger})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    service = None
+    logger = None
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            return sendMetrics(self)
+        if self.path != "/health":
+            return self.sendJson(404, {"error": "Not found"})
+        self.sendJson(200, {"status": "ok", "model_loaded": self.service.model is not None})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            return self.sendJson(404, {"error": "Not found"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if "timestamps" in body:
+                df_pred = self.service.predictTimestamps([int(t) for t in body["timestamps"]])
+            elif "esdr" in body and "smell" in body:
+                df_esdr_array_raw = [recordsToDataFrame(r) for r in body["esdr"]]
+                df_pred = self.service.predictBatch(df_esdr_array_raw, recordsToDataFrame(body["smell"]))
+            else:
+                return self.sendJson(400, {"error": "Need either 'timestamps' or 'esdr' and 'smell'"})
+        except (ValueError, TypeError, KeyError) as e:
+            return self.sendJson(400, {"error": str(type(e).__name__) + ": " + str(e)})
+        except Exception as e:
+            log("ERROR: prediction failed, " + str(type(e).__name__) + ": " + str(e), self.logger, level="error")
+            return self.sendJson(500, {"error": str(type(e).__name__) + ": " + str(e)})
+        if df_pred is None:
+            return self.sendJson(503, {"error": "Not enough data for the prediction"})
+        self.sendJson(200, {"predictions": predictionToRecords(df_pred)})
+
+    def sendJson(self, code, content):
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Use the logger of the service instead of printing every request to stderr
+        if self.logger is not None:
+            self.logger.debug(format % args)
+
+
+def recordsToDataFrame(records):
+    """Convert a list of records (dict) to a dataframe with the EpochTime index (the format of raw data)"""
+    df = pd.DataFrame.from_records(records)
+    if "EpochTime" not in df.columns:
+        raise ValueError("Each record needs the EpochTime field")
+    return df.set_index("EpochTime")
+
+
+def predictionToRecords(df_pred):
+    """Convert the predictions to json serializable records"""
+    df_pred = df_pred.copy()
+    if "EpochTime" not in df_pred.columns:
+        df_pred.insert(0, "EpochTime", df_pred["DateTime"].map(pd.Timestamp.timestamp).astype(np.int64))
+    df_pred["DateTime"] = df_pred["DateTime"].map(pd.Timestamp.isoformat)
+    for c in df_pred.columns:
+        if c.startswith("predict_proba"):
+            df_pred[c] = df_pred[c].astype(float).round(6)
+        elif c.startswith("predict"):
+            df_pred[c] = df_pred[c].astype(int)
+    return df_pred.to_dict(orient="records")
@@ -5,8 +5,8 @@ Prepare data for the prediction model
 
 import pandas as pd
 from util import log, getAllFileNamesInFolder, checkAndCreateDir, epochtimeIdxToDatetime
+from profiling import profiled
 import re
-from sklearn.feature_extraction.text import CountVectorizer
 
 
 def preprocessData(df_esdr_array_raw=None, df_smell_raw=None, in_p=None, out_p=None, logger=None):
@@ -59,6 +59,7 @@ def preprocessData(df_esdr_array_raw=None, df_smell_raw=None, in_p=None, out_p=N
     return df_esdr, df_smell
 
 
+@profiled()
 def mergeEsdrData(data):
     # Resample data
     df = resampleData(data.pop(0), method="mean").reset_index()
@@ -71,6 +72,7 @@ def mergeEsdrData(data):
     return df
 
 
+@profiled()
 def aggregateSmellData(df):
     if df is None: return None
 
@@ -137,6 +139,7 @@ def bagOfWords(df):
     line = [line.lower()] # to lower case
 
     # Bag of words
+    from sklearn.feature_extraction.text import CountVectorizer
     model = CountVectorizer(stop_words="english")
     model.fit_transform(line)
     return model.vocabulary_
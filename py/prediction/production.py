@@ -5,17 +5,24 @@ The production code for predicting smell events and sending push notifications
 
 
 import sys
-from util import log, generateLogger, computeMetric, isFileHere
+from util import log, generateLogger, computeMetric
 import pandas as pd
 from getData import getData
 from preprocessData import preprocessData
-from computeFeatures import computeFeatures
-#from selectFeatures import selectFeatures
-from trainModel import trainModel
-import joblib
+from computeFeatures import computeFeatures, getZipcodeRegions
+from modelArtifact import saveModelArtifact, loadModelArtifact
+from FlatForest import compareWithSklearn
+from PredictionService import PredictionService
+from DataWindow import DataWindow
+from NotificationLedger import NotificationLedger
+from NotificationDispatcher import NotificationDispatcher, RakeSender, WebhookSender, StubSender
+from predictionServer import servePredictions
+from ReplayDataSource import ReplayDataSource
+from metrics import writeMetrics, serveMetrics
 from datetime import timedelta, datetime
+import pytz
 import os
-import subprocess
+import time
 
 # The flag to determine the server type
 SERVER = "staging"
@@ -25,9 +32,75 @@ SERVER = "staging"
 #ENABLE_RAKE_CALL = False
 ENABLE_RAKE_CALL = True
 
+# The URL for sending push notifications by a webhook instead of the rake call (None means using the rake call)
+WEBHOOK_URL = None
+
+# The engine for evaluating the model (see the loadModelArtifact() function in modelArtifact.py)
+# NOTE: "flat" is much faster for one row, use "sklearn" to predict with the scikit-learn model
+MODEL_ENGINE = "flat"
+
+# The flag for keeping only the trees that are needed for the event detection f-score (see trainModel.py)
+# NOTE: this makes the model smaller and faster, but the training takes longer (the forest is trained on each fold)
+REDUCE_FOREST = False
+#REDUCE_FOREST = True
+
+# The number of hours to look further and the threshold of smell values for defining a smell event
+# NOTE: lists (e.g., F_HR = [8, 2, 4, 12]) train one multi-output model that predicts all (F_HR, THR) pairs,
+# ...and the first pair is used for sending push notifications
+F_HR = 8
+THR = 40
+
+# The flag for also training and running a regional model that predicts smell events for each zipcode
+# NOTE: zipcodes with a total smell value smaller than REGIONAL_MIN_SMELL are merged into one "other" region,
+# ...the regional model is stored in DATA_PATH + "regional/", and it does not send push notifications
+# ...(use "python production.py serve regional" to query the regional predictions)
+REGIONAL = False
+#REGIONAL = True
+REGIONAL_MIN_SMELL = 100
+
 # The path for storing push notification data
 DATA_PATH = "data_production/"
 
+# The dispatcher for sending push notifications in the background (created by the getDispatcher() function)
+DISPATCHER = None
+
+# The number of seconds that the predict mode waits for the notifications to be delivered before it exits
+# NOTE: notifications that are not delivered in time stay pending in the ledger, and they are delivered by the daemon
+# ...(see the resumePending() function in NotificationDispatcher.py) or claimed again by a later prediction
+# ...(see the claim() function in NotificationLedger.py), so a hanging rake task cannot keep the cron job alive
+NOTIFICATION_TIMEOUT_SEC = 300
+
+# The dataset for replaying the data instead of pulling it from ESDR and SmellPGH (None means the live servers)
+# NOTE: REPLAY_CLOCK_DT is the dataset time when the process starts, and REPLAY_SPEED is the number of simulated
+# ...seconds for each second, so the predictions only see the readings that arrived before the simulated time
+# ...(see ReplayDataSource.py, and replayServer.py for replaying through the HTTP API instead)
+# ...set ENABLE_RAKE_CALL to False when replaying, so that the replayed predictions do not notify real users
+REPLAY_DATASET = None
+#REPLAY_DATASET = "../../dataset/v2.1/"
+REPLAY_CLOCK_DT = None
+#REPLAY_CLOCK_DT = datetime(2022, 6, 1, 5, tzinfo=pytz.utc)
+REPLAY_SPEED = 1.0
+
+# The replay data source (created by the getDataSource() function)
+DATA_SOURCE = None
+
+# The file for the metrics of the predictor in the Prometheus text format (see metrics.py), None means no file
+# NOTE: the file is written after each prediction, e.g., for the textfile collector of the node exporter
+# ...(a crontab run only has the metrics of its own prediction, the daemon accumulates them)
+METRICS_PATH = DATA_PATH + "metrics.prom"
+#METRICS_PATH = None
+
+# The data window of the serve mode (see DataWindow.py), which keeps the readings of the last SERVE_WINDOW_HR hours
+# NOTE: timestamps in the window are predicted without pulling data, unless the last pull is older than
+# ...SERVE_REFRESH_MIN minutes, and only the readings before the window are pulled for older timestamps
+SERVE_WINDOW_HR = 24
+SERVE_REFRESH_MIN = 5
+
+# The port for serving the metrics at "GET /metrics" when running the daemon (None means no server)
+# NOTE: the serve mode always has "GET /metrics" on its own port
+METRICS_PORT = None
+#METRICS_PORT = 9108
+
 
 def main(argv):
     mode = None
@@ -38,22 +111,30 @@ def main(argv):
         train()
     elif mode == "predict":
         predict()
+    elif mode == "daemon":
+        daemon()
+    elif mode == "serve":
+        serve(regional=len(argv) >= 3 and argv[2] == "regional")
     else:
-        print("Use 'python main.py [mode]'; mode can be 'train' or 'predict'")
+        print("Use 'python production.py [mode]'; mode can be 'train', 'predict', 'daemon', or 'serve'")
 
 
-def train(f_hr=8, b_hr=3, thr=40, method="HCR"):
+def train(f_hr=F_HR, b_hr=3, thr=THR, method="HCR"):
     """
     Train the machine learning model for predicting smell events
     
     Input:
         f_hr: the number of hours to look further and compute responses (Y),
             ...which is the sum of smell ratings (that are larger than 3) over the future f_hr hours
+            ...f_hr and thr can be lists for training a multi-output model (see the F_HR and THR flags)
         b_hr: the number of hours to look back and compute features (X),
             ...which are the sensor readings (on ESDR) over the past b_hr hours
         thr: the threshold for binning the smell value into two classes (for classification)
         method: the method used in the "trainModel.py" file
     """
+    # Only training needs scikit-learn, and importing it takes most of the startup time of the other modes
+    from trainModel import trainModel
+    #from selectFeatures import selectFeatures
     p = DATA_PATH
 
     # Set logger
@@ -62,10 +143,11 @@ def train(f_hr=8, b_hr=3, thr=40, method="HCR"):
     log("---------------------------------  Train  --------------------------------", logger)
 
     # Get and preprocess data
-    end_dt = datetime.now() - timedelta(hours=24)
+    end_dt = currentTime(logger) - timedelta(hours=24)
     start_dt = end_dt - timedelta(hours=8000)
     log("Get data from " + str(start_dt) + " to " + str(end_dt), logger)
-    df_esdr_array_raw, df_smell_raw = getData(start_dt=start_dt, end_dt=end_dt, logger=logger)
+    df_esdr_array_raw, df_smell_raw = getData(start_dt=start_dt, end_dt=end_dt, data_source=getDataSource(logger),
+        logger=logger)
     df_esdr, df_smell = preprocessData(df_esdr_array_raw=df_esdr_array_raw, df_smell_raw=df_smell_raw, logger=logger)
 
     # Compute features
@@ -78,13 +160,64 @@ def train(f_hr=8, b_hr=3, thr=40, method="HCR"):
 
     # Train, save, and evaluate model
     # NOTE: to know more about the model, see the "HybridCrowdClassifier.py" file
-    model = trainModel({"X": df_X, "Y": df_Y, "C": df_C}, method=method, out_p=p+"model.pkl", logger=logger)
-    metric = computeMetric(df_Y, model.predict(df_X, df_C), False)
-    for m in metric:
-        log(metric[m], logger)
-
+    model = trainModel({"X": df_X, "Y": df_Y, "C": df_C}, method=method, out_p=p+"model.pkl",
+        reduce_forest=REDUCE_FOREST, logger=logger)
+    df_X_mean = pd.read_csv(p+"mean.csv", index_col=0).squeeze("columns")
+    df_X_std = pd.read_csv(p+"std.csv", index_col=0).squeeze("columns")
+    saveModelArtifact(model, p+"model", df_X_mean=df_X_mean, df_X_std=df_X_std, feature_names=df_X.columns,
+        targets=df_Y.columns, logger=logger)
+
+    # Check that the flat engine gives the same probabilities as the scikit-learn model
+    flat_model, _ = loadModelArtifact(p+"model", engine="flat", logger=logger)
+    compareWithSklearn(getattr(model, "base_estimator", model), getattr(flat_model, "base_estimator", flat_model), df_X,
+        n_repeats=3, logger=logger)
+    y_pred = model.predict(df_X, df_C)
+    for k, c in enumerate(df_Y.columns):
+        if len(df_Y.columns) > 1: log("Metric for " + c, logger)
+        metric = computeMetric(df_Y[[c]], y_pred[:, k] if y_pred.ndim > 1 else y_pred, False)
+        for m in metric:
+            log(metric[m], logger)
+
+    # Train the regional model with the same features
+    if REGIONAL:
+        trainRegional(df_esdr, df_smell, df_X, f_hr=f_hr, b_hr=b_hr, thr=thr, method=method, logger=logger)
+
+
+def trainRegional(df_esdr, df_smell, df_X, f_hr=F_HR, b_hr=3, thr=THR, method="HCR", logger=None):
+    """
+    Train one multi-output model that predicts smell events for each region (see the REGIONAL flag)
 
-def predict(f_hr=8, b_hr=3, thr=40):
+    Input:
+        df_esdr, df_smell: the preprocessed data (see the preprocessData() function in preprocessData.py)
+        df_X: the features of the county-wide model (only for checking that both models use the same rows)
+        f_hr, b_hr, thr, method: see the docstring in the train() function
+        logger: the python logger created by the generateLogger() function
+    """
+    from trainModel import trainModel
+    p = DATA_PATH + "regional/"
+    regions = getZipcodeRegions(df_smell, min_smell=REGIONAL_MIN_SMELL)
+    log("Train the regional model for " + str(len(regions)) + " regions", logger)
+    df_X_r, df_Y, df_C = computeFeatures(df_esdr=df_esdr, df_smell=df_smell, f_hr=f_hr, b_hr=b_hr, thr=thr,
+        is_regr=False, add_inter=False, add_roll=False, add_diff=False, logger=logger, out_p_mean=p+"mean.csv",
+        out_p_std=p+"std.csv", regions=regions)
+    if len(df_X_r) != len(df_X):
+        log("WARNING: the regional model uses " + str(len(df_X_r)) + " rows instead of " + str(len(df_X)), logger,
+            level="warning")
+    model = trainModel({"X": df_X_r, "Y": df_Y, "C": df_C}, method=method, out_p=p+"model.pkl", logger=logger)
+    df_X_mean = pd.read_csv(p+"mean.csv", index_col=0).squeeze("columns")
+    df_X_std = pd.read_csv(p+"std.csv", index_col=0).squeeze("columns")
+    saveModelArtifact(model, p+"model", df_X_mean=df_X_mean, df_X_std=df_X_std, feature_names=df_X_r.columns,
+        targets=df_Y.columns, regions=regions, logger=logger)
+
+    # Log the metric of the primary (f_hr, thr) pair for each region
+    y_pred = model.predict(df_X_r, df_C)
+    step = len(df_Y.columns) // len(regions)
+    for k, r in zip(range(0, len(df_Y.columns), step), regions):
+        metric = computeMetric(df_Y.iloc[:, [k]], y_pred[:, k], False)
+        log("Event metric for region " + str(r) + ": " + str(metric["event_prf"]), logger)
+
+
+def predict(f_hr=F_HR, b_hr=3, thr=THR):
     """
     Predict smell events using the trained machine learning model
     
@@ -97,33 +230,123 @@ def predict(f_hr=8, b_hr=3, thr=40):
     log("--------------------------------------------------------------------------", logger)
     log("--------------------------------  Predict  -------------------------------", logger)
 
-    # Get data for previous b_hr hours
-    end_dt = datetime.now()
-    start_dt = end_dt - timedelta(hours=b_hr+1)
-    log("Get data from " + str(start_dt) + " to " + str(end_dt), logger)
-    df_esdr_array_raw, df_smell_raw = getData(start_dt=start_dt, end_dt=end_dt, logger=logger)
-    df_esdr, df_smell = preprocessData(df_esdr_array_raw=df_esdr_array_raw, df_smell_raw=df_smell_raw, logger=logger)
-    if len(df_esdr) < b_hr+1:
-        log("ERROR: Length of esdr is less than " + str(b_hr+1) + " hours", logger)
-        log("Length of esdr = " + str(len(df_esdr)), logger)
-        return
+    # Predict and send push notifications
+    # NOTE: the data window is stored in a file, so the next run only pulls the new data
+    data_window = DataWindow(b_hr+1, cache_p=p+"data_window.pickle", data_source=getDataSource(logger),
+        logger=logger)
+    service = PredictionService(data_path=p, f_hr=f_hr, b_hr=b_hr, thr=thr, engine=MODEL_ENGINE,
+        data_window=data_window, logger=logger)
+    predictAndPush(service, currentTime(logger), logger)
 
-    # Compute features
-    df_X, _, df_C = computeFeatures(df_esdr=df_esdr, df_smell=df_smell, f_hr=f_hr, b_hr=b_hr, thr=thr, is_regr=False,
-        add_inter=False, add_roll=False, add_diff=False, logger=logger, in_p_mean=p+"mean.csv", in_p_std=p+"std.csv")
-    if len(df_X) != 1:
-        log("ERROR: Length of X is not 1", logger)
-        log("Length of X = " + str(len(df_X)), logger)
-        return
+    # Wait for the notifications to be delivered before the process exits
+    if DISPATCHER is not None and not DISPATCHER.join(timeout=NOTIFICATION_TIMEOUT_SEC):
+        log("WARNING: the notifications were not delivered in " + str(NOTIFICATION_TIMEOUT_SEC) + " seconds, " +
+            "leave them pending", logger, level="warning")
+    exportMetrics(logger)
+
+
+def daemon(f_hr=F_HR, b_hr=3, thr=THR, interval_min=15, start_hr=5, end_hr=13):
+    """
+    Run the prediction periodically in a long-running process (instead of calling predict() by crontab)
+
+    The model and the normalization statistics are loaded once and kept in memory,
+        ...and they are reloaded when the train() function writes a new model
+    
+    Input:
+        f_hr, b_hr, thr: see the docstring in the train() function
+        interval_min: the number of minutes between two predictions (aligned to the clock, e.g., 5:00, 5:15)
+        start_hr: the first hour of the day to perform the prediction
+        end_hr: the last hour of the day to perform the prediction
+    """
+    p = DATA_PATH
+
+    # Set logger
+    logger = generateLogger(p+"log.log")
+    log("--------------------------------------------------------------------------", logger)
+    log("--------------------------------  Daemon  --------------------------------", logger)
+
+    # Load the model once, and keep the data of the previous b_hr+1 hours in memory
+    data_window = DataWindow(b_hr+1, data_source=getDataSource(logger), logger=logger)
+    service = PredictionService(data_path=p, f_hr=f_hr, b_hr=b_hr, thr=thr, engine=MODEL_ENGINE,
+        data_window=data_window, logger=logger)
+    service.reload()
+
+    # The regional model reuses the data window (the second update only pulls the overlap again)
+    regional_service = None
+    if REGIONAL:
+        regional_service = PredictionService(data_path=p+"regional/", f_hr=f_hr, b_hr=b_hr, thr=thr,
+            engine=MODEL_ENGINE, data_window=data_window, logger=logger)
+        regional_service.reload()
+
+    # Deliver the notifications of today that were not delivered when the daemon stopped
+    # (the date is from the simulated clock when replaying a dataset, which is the date of the claimed notifications)
+    getDispatcher(logger).resumePending(date=currentTime(logger).date())
+
+    # Serve the metrics of the predictor (see metrics.py)
+    if METRICS_PORT is not None:
+        serveMetrics(port=METRICS_PORT)
+        log("Serve metrics at http://127.0.0.1:" + str(METRICS_PORT) + "/metrics", logger)
+
+    while True:
+        # Sleep until the next time slot
+        # (a replay with a simulated clock sleeps for the simulated time divided by REPLAY_SPEED)
+        now = currentTime(logger)
+        next_dt = now.replace(second=0, microsecond=0) + timedelta(minutes=interval_min - now.minute % interval_min)
+        speed = REPLAY_SPEED if REPLAY_CLOCK_DT is not None and getDataSource(logger) is not None else 1
+        time.sleep(max(0, (next_dt - currentTime(logger)).total_seconds() / speed))
+        if not (start_hr <= next_dt.hour <= end_hr):
+            continue
+
+        # Predict and send push notifications
+        log("--------------------------------  Predict  -------------------------------", logger)
+        try:
+            end_dt = currentTime(logger)
+            predictAndPush(service, end_dt, logger)
+            if regional_service is not None: regional_service.predict(end_dt)
+        except Exception as e:
+            # Keep the daemon running (e.g., when the ESDR server is temporarily unavailable)
+            log("ERROR: prediction failed, " + str(type(e).__name__) + ": " + str(e), logger, level="error")
+        exportMetrics(logger)
+
+
+def serve(f_hr=F_HR, b_hr=3, thr=THR, host="127.0.0.1", port=8000, regional=False):
+    """
+    Run a local HTTP/JSON service for querying predictions (without sending push notifications)
+
+    For the API, see the docstring in the "predictionServer.py" file
+
+    Input:
+        f_hr, b_hr, thr: see the docstring in the train() function
+        host: the address to bind (the default only accepts connections from the local machine)
+        port: the port to bind
+        regional: serve the regional model instead of the county-wide model (see the REGIONAL flag)
+    """
+    p = DATA_PATH
+
+    # Set logger
+    logger = generateLogger(p+"log.log")
+    log("--------------------------------------------------------------------------", logger)
+    log("--------------------------------  Serve  ---------------------------------", logger)
+
+    # Serve the recent timestamps from a data window in memory, which only pulls the new readings
+    data_window = DataWindow(SERVE_WINDOW_HR, refresh_min=SERVE_REFRESH_MIN, data_source=getDataSource(logger),
+        logger=logger)
+    service = PredictionService(data_path=p+"regional/" if regional else p, f_hr=f_hr, b_hr=b_hr, thr=thr,
+        engine=MODEL_ENGINE, data_window=data_window, logger=logger)
+    servePredictions(service, host=host, port=port, logger=logger)
 
-    # Select features
-    # NOTE: currently, the best model uses all the features
-    #df_feat_selected = pd.read_csv(p+"feat_selected.csv")
-    #df_X = df_X[df_feat_selected.columns]
 
-    # Load model
-    log("Load model...", logger)
-    model = joblib.load(p+"model.pkl")
+def predictAndPush(service, end_dt, logger):
+    """
+    Predict smell events and send push notifications
+
+    Input:
+        service: the PredictionService object that stores the model
+        end_dt: the time for the prediction (which is the current time)
+        logger: the python logger created by the generateLogger() function
+    """
+    result = service.predict(end_dt)
+    if result is None: return
 
     # Predict result
     # For the hybrid crowd classifier
@@ -131,8 +354,7 @@ def predict(f_hr=8, b_hr=3, thr=40):
     # if pred==1, event predicted by the base estimator
     # if pred==2, event detected by the crowd
     # if pred==3, event both predicted by the base estimator and detected by the crowd
-    y_pred = model.predict(df_X, df_C)[0]
-    log("Prediction for " + str(end_dt) + " is " + str(y_pred), logger)
+    y_pred = result["y_pred"]
 
     # Send the predictive push notification
     if y_pred in (1, 3): pushType1(end_dt, logger)
@@ -150,36 +372,16 @@ def pushType1(end_dt, logger):
         end_dt: the ending time for getting the ESDR data that is used for prediction (which is the current time)
         logger: the python logger created by the generateLogger() function
     """
-    p = DATA_PATH
-
-    # Read the push notification file
-    nst_p = p + "notification_sent_times.csv"
-    if isFileHere(nst_p):
-        # If the file that stores the notification sending time exist,
-        # ...load the times and check if we already sent the notification at the same date before
-        df_nst = pd.read_csv(nst_p, parse_dates=["DateTime"])
-        last_date = df_nst["DateTime"].dt.date.iloc[-1] # the last date that we send the notification
-        current_date = end_dt.date()
-        if current_date == last_date: # check if the dates (only year, month, and day) match
-            # We already sent push notifications to users today, do not send it again until next day
-            log("Ignore this prediction because we already sent a push notification today", logger)
-            return
-    else:
-        # If the file did not exist, create a new pandas Dataframe to store the time when we send notifications
-        df_nst = pd.DataFrame(data=[], columns=["DateTime"])
-
-    # Send push notification to users
-    if ENABLE_RAKE_CALL:
-        # NOTE: Python by default uses the sh terminal but we want it to use bash,
-        # ...because "source" and "bundle" only works for bash on the Hal11 machine
-        # ...(on the sh terminal we will want to use "." instead of "source")
-        cmd = 'source /etc/profile ; cd /var/www/rails-apps/smellpgh/' + SERVER + '/current/ ; bundle exec rake firebase_push_notification:send_prediction["/topics/SmellReports"] RAILS_ENV=' + SERVER + ' >> /var/www/smell-pittsburgh-prediction/py/prediction/data_production/push.log 2>&1'
-        subprocess.call(["bash", "-c", cmd])
+    # Record the notification first, and check if we already sent the notification at the same date before
+    # NOTE: recording before sending makes sure that overlapping runs do not send the notification twice
+    if not getLedger(logger).claim("type1", end_dt):
+        # We already sent push notifications to users today, do not send it again until next day
+        log("Ignore this prediction because we already sent a push notification today", logger)
+        return
 
-    # Create a CSV file that writes the time when the system send the push notification
-    log("A prediction push notification was sent to users", logger)
-    df_nst = df_nst.append({"DateTime": end_dt}, ignore_index=True) # append a row to the pandas Dataframe
-    df_nst.to_csv(nst_p, index=False) # re-write the Dataframe to a CSV file
+    # Send push notification to users (in the background, see NotificationDispatcher.py)
+    getDispatcher(logger).submit("type1", end_dt)
+    log("A prediction push notification was queued for sending to users", logger)
 
 
 def pushType2(end_dt, logger):
@@ -190,36 +392,74 @@ def pushType2(end_dt, logger):
         end_dt: the ending time for getting the ESDR data that is used for prediction (which is the current time) 
         logger: the python logger created by the generateLogger() function
     """
-    p = DATA_PATH
+    # Record the notification first, and check if we already sent the notification at the same date before
+    if not getLedger(logger).claim("type2", end_dt):
+        # We already sent crowd-verified push notifications to users today, do not send it again until next day
+        log("Ignore this crowd-verified event because we already sent a push notification today", logger)
+        return
 
-    # Read the crowd push notification file
-    cvnst_p = p + "crow_verified_notification_sent_times.csv"
-    if isFileHere(cvnst_p):
-        # If the file that stores the notification sending time exist,
-        # ...load the times and check if we already sent the notification at the same date before
-        df_cvnst = pd.read_csv(cvnst_p, parse_dates=["DateTime"])
-        last_date = df_cvnst["DateTime"].dt.date.iloc[-1] # the last date that we send the notification
-        current_date = end_dt.date()
-        if current_date == last_date: # check if the dates (only year, month, and day) match
-            # We already sent crowd-verified push notifications to users today, do not send it again until next day
-            log("Ignore this crowd-verified event because we already sent a push notification today", logger)
-            return
-    else:
-        # If the file did not exist, create a new pandas Dataframe to store the time when we send notifications
-        df_cvnst = pd.DataFrame(data=[], columns=["DateTime"])
-
-    # Send crowd-verified push notification to users
-    if ENABLE_RAKE_CALL:
-        # NOTE: Python by default uses the sh terminal but we want it to use bash,
-        # ...because "source" and "bundle" only works for bash on the Hal11 machine
-        # ...(on the sh terminal we will want to use "." instead of "source")
-        cmd = 'source /etc/profile ; cd /var/www/rails-apps/smellpgh/' + SERVER + '/current/ ; bundle exec rake firebase_push_notification:send_prediction_type2["/topics/SmellReports"] RAILS_ENV=' + SERVER + ' >> /var/www/smell-pittsburgh-prediction/py/prediction/data_production/crow_verified_push.log 2>&1'
-        subprocess.call(["bash", "-c", cmd])
-
-    # Create a CSV file that writes the time when the system send the push notification
-    log("A crowd-verified push notification was sent to users", logger)
-    df_cvnst = df_cvnst.append({"DateTime": end_dt}, ignore_index=True) # append a row to the pandas Dataframe
-    df_cvnst.to_csv(cvnst_p, index=False) # re-write the Dataframe to a CSV file
+    # Send crowd-verified push notification to users (in the background, see NotificationDispatcher.py)
+    getDispatcher(logger).submit("type2", end_dt)
+    log("A crowd-verified push notification was queued for sending to users", logger)
+
+
+def getDispatcher(logger):
+    """
+    Return the dispatcher that sends push notifications in the background (created once for each process)
+
+    The sender is chosen by the ENABLE_RAKE_CALL and WEBHOOK_URL flags
+    """
+    global DISPATCHER
+    if DISPATCHER is None:
+        if not ENABLE_RAKE_CALL:
+            sender = StubSender()
+        elif WEBHOOK_URL is not None:
+            sender = WebhookSender(WEBHOOK_URL)
+        else:
+            tasks = {"type1": ("send_prediction", "push.log"),
+                "type2": ("send_prediction_type2", "crow_verified_push.log")}
+            log_p = "/var/www/smell-pittsburgh-prediction/py/prediction/data_production/"
+            sender = RakeSender(SERVER, tasks, log_p=log_p)
+        DISPATCHER = NotificationDispatcher(sender, getLedger(logger), logger=logger)
+    return DISPATCHER
+
+
+def getDataSource(logger):
+    """
+    Return the replay data source (created once for each process), or None for the live servers
+
+    The data source is chosen by the REPLAY_DATASET, REPLAY_CLOCK_DT, and REPLAY_SPEED flags
+    """
+    global DATA_SOURCE
+    if DATA_SOURCE is None and REPLAY_DATASET is not None:
+        DATA_SOURCE = ReplayDataSource(REPLAY_DATASET, clock_dt=REPLAY_CLOCK_DT, speed=REPLAY_SPEED, logger=logger)
+    return DATA_SOURCE
+
+
+def currentTime(logger):
+    """Return the current time (the simulated time when replaying a dataset with a clock)"""
+    data_source = getDataSource(logger)
+    return datetime.now() if data_source is None else data_source.now()
+
+
+def exportMetrics(logger):
+    """Write the metrics of the predictor to the METRICS_PATH file (see metrics.py)"""
+    if METRICS_PATH is None: return
+    try:
+        writeMetrics(METRICS_PATH)
+    except OSError as e:
+        log("WARNING: cannot write the metrics to " + METRICS_PATH + ", " + str(e), logger, level="warning")
+
+
+def getLedger(logger):
+    """
+    Return the record of sent push notifications (see NotificationLedger.py)
+
+    The sending times in the CSV files that were used before are copied into the ledger when it is created
+    """
+    p = DATA_PATH
+    legacy_csv = {"type1": p + "notification_sent_times.csv", "type2": p + "crow_verified_notification_sent_times.csv"}
+    return NotificationLedger(p + "notification_ledger.db", legacy_csv=legacy_csv, logger=logger)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+"""
+Lightweight timing and profiling spans for finding where the pipeline and the predictor spend their time
+
+Use the span() context manager or the profiled() decorator around a piece of work:
+    with span("fit", method="ET", rows=len(X)):
+        model.fit(X, Y)
+
+    @profiled()
+    def mergeEsdrData(data):
+        ...
+
+The spans are switched by the SMELL_PROFILE environment variable, which is read when the module is imported:
+    unset, "", or "0"
+        ...off, span() returns a shared object that does nothing, and profiled() returns the function as it is
+    "1" or "timing"
+        ...each span appends one JSON line to the SMELL_PROFILE_LOG file (default "data_profile/spans.jsonl"),
+        ...with the wall time, the cpu time, the resident memory before and after, and the parent span
+    "cprofile"
+        ...also run cProfile for each outermost span of a thread and store the stats in the SMELL_PROFILE_DIR folder
+        ...(default "data_profile/"), which can be read by pstats, snakeviz, or converted for speedscope
+        ...(py-spy does not need this, since it samples a running process, e.g., "py-spy record --pid [pid]",
+        ...and the span names in the JSON lines tell which stage the samples belong to)
+"""
+
+
+import os
+import sys
+import json
+import time
+import threading
+import resource
+import functools
+import itertools
+
+MODE = os.environ.get("SMELL_PROFILE", "").strip().lower()
+ENABLED = MODE not in ("", "0", "off", "false")
+CPROFILE = MODE == "cprofile"
+LOG_PATH = os.environ.get("SMELL_PROFILE_LOG", "data_profile/spans.jsonl")
+DUMP_DIR = os.path.join(os.environ.get("SMELL_PROFILE_DIR", "data_profile/"), "")
+
+_lock = threading.Lock()
+_local = threading.local()
+_counter = itertools.count()
+
+
+class NullSpan():
+    """The span that is used when profiling is off (entering and leaving it does nothing)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span():
+    """A timed piece of work (see the span() function)"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.profiler = None
+
+    def __enter__(self):
+        stack = spanStack()
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+        if CPROFILE and not getattr(_local, "profiling", False):
+            # cProfile cannot be nested, so only the outermost span of a thread is profiled
+            import cProfile
+            self.profiler = cProfile.Profile()
+            _local.profiling = True
+            self.profiler.enable()
+        self.rss_before = currentRss()
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.start_cpu
+        rss_after = currentRss()
+        spanStack().pop()
+        record = {"span": self.name, "parent": self.parent, "depth": self.depth, "start": round(self.start_time, 6),
+            "wall_s": round(wall, 6), "cpu_s": round(cpu, 6), "rss_before_mb": round(self.rss_before / 1024**2, 1),
+            "rss_after_mb": round(rss_after / 1024**2, 1),
+            "rss_delta_mb": round((rss_after - self.rss_before) / 1024**2, 1), "pid": os.getpid(),
+            "thread": threading.current_thread().name}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if self.profiler is not None:
+            self.profiler.disable()
+            _local.profiling = False
+            record["profile"] = dumpProfile(self.profiler, self.name)
+        record.update(self.fields)
+        writeRecord(record)
+        return False
+
+    def set(self, **fields):
+        """Add fields to the record of the span (e.g., the number of rows that are known after the work)"""
+        self.fields.update(fields)
+
+
+def span(name, **fields):
+    """
+    Return a context manager that records the time and memory of the work inside it
+
+    Input:
+        name (str): the name of the span (e.g., "fit" or "getEsdrData")
+        fields: extra json serializable fields for the record (e.g., rows=len(X))
+
+    Output:
+        a Span object, or NULL_SPAN when profiling is off
+    """
+    if not ENABLED:
+        return NULL_SPAN
+    return Span(name, fields)
+
+
+def profiled(name=None):
+    """
+    Return a decorator that runs a function inside a span (named after the function by default)
+
+    When profiling is off, the decorator returns the function as it is, so there is no overhead
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(name or func.__name__, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def spanStack():
+    """Return the spans that are open in the current thread"""
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def writeRecord(record):
+    """Append a record to the JSON lines file (one line per span)"""
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        directory = os.path.dirname(LOG_PATH)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(LOG_PATH, "a") as f:
+            f.write(line)
+
+
+def dumpProfile(profiler, name):
+    """Store the cProfile stats of a span and return the path"""
+    if not os.path.isdir(DUMP_DIR):
+        os.makedirs(DUMP_DIR, exist_ok=True)
+    p = DUMP_DIR + "%s-%d-%d-%d.prof" % (name, os.getpid(), int(time.time()), next(_counter))
+    profiler.dump_stats(p)
+    return p
+
+
+def currentRss():
+    """Return the resident memory of this process in bytes (the peak of the process if /proc is not available)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
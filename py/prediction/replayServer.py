@@ -0,0 +1,132 @@
+"""
+A local HTTP stand-in for ESDR and SmellPGH that replays a bundled dataset (see ReplayDataSource.py)
+
+GET /api/v1/feeds/[feed]/channels/[channel,channel,...]/export?format=csv&from=[epoch time]&to=[epoch time]
+    ...returns the csv of the ESDR export API ("EpochTime,3.feed_[feed].[channel],...")
+    ...a feed or channel that the dataset does not have returns the header without rows (like a feed without
+    ...readings in the time range), and the code that uses the data fills the missing readings (see preprocessData.py)
+GET /api/v1/smell_reports?zipcodes=[zipcode,...]&start_time=[epoch time]&end_time=[epoch time]
+GET /api/v2/smell_reports?zipcodes=[zipcode,...]&start_time=[epoch time]&end_time=[epoch time]
+    ...returns the json of the SmellPGH API (a list of reports, see the getSmellReports() function in util.py)
+
+Use it by pointing the ESDR_ROOT_URL and SMELLPGH_ROOT_URL environment variables to the server, for example:
+    python replayServer.py ../../dataset/v2.1/ 8001
+    ESDR_ROOT_URL=http://127.0.0.1:8001/ SMELLPGH_ROOT_URL=http://127.0.0.1:8001/ python production.py predict
+
+The datasets in the repository are not equally complete:
+    dataset/v2 and dataset/v2.1
+        ...have the files of all ESDR sources in esdrSources.py, but no smell_raw.csv, so the smell APIs return an
+        ...empty list (the predictor then uses zero smell values for the crowd feature, see PredictionService.py)
+    dataset/v1
+        ...has smell_raw.csv, but older ESDR files (e.g., no feed 59665, and the PM channels of some feeds are in
+        ...separate files), so requests for the missing feeds or channels return no rows
+"""
+
+
+import sys
+import json
+import numpy as np
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from util import log
+from ReplayDataSource import ReplayDataSource
+
+
+def serveReplay(data_source, host="127.0.0.1", port=8001, logger=None):
+    """
+    Start the replay server and handle requests until the process is stopped
+
+    Input:
+        data_source (ReplayDataSource): the dataset to replay
+        host (str): the address to bind, the default only accepts connections from the local machine
+        port (int): the port to bind
+        logger: the python logger created by the generateLogger() function
+    """
+    server = createReplayServer(data_source, host=host, port=port, logger=logger)
+    log("Replay " + data_source.dataset_p + " at http://" + host + ":" + str(server.server_address[1]) + "/", logger)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def createReplayServer(data_source, host="127.0.0.1", port=8001, logger=None):
+    """Create the replay server (port=0 means a free port chosen by the operating system)"""
+    handler = type("Handler", (ReplayHandler,), {"data_source": data_source, "logger": logger})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    data_source = None
+    logger = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        try:
+            if len(parts) == 7 and parts[:3] == ["api", "v1", "feeds"] and parts[4] == "channels" and \
+                parts[6] == "export":
+                return self.sendEsdrExport(parts[3], parts[5].split(","), query)
+            if len(parts) == 3 and parts[0] == "api" and parts[1] in ("v1", "v2") and parts[2] == "smell_reports":
+                return self.sendSmellReports(int(parts[1][1:]), query)
+        except ValueError as e:
+            return self.sendBody(400, json.dumps({"error": str(e)}), "application/json")
+        self.sendBody(404, json.dumps({"error": "Not found"}), "application/json")
+
+    def sendEsdrExport(self, feed, channels, query):
+        start_time = float(query.get("from", -np.inf))
+        end_time = float(query.get("to", np.inf))
+        df = self.data_source.getChannels(feed, channels, start_time, end_time)
+        self.sendBody(200, df.to_csv(), "text/csv")
+
+    def sendSmellReports(self, api_version, query):
+        start_time = float(query.get("start_time", -np.inf))
+        end_time = float(query.get("end_time", np.inf))
+        df = self.data_source.getSmell(start_time, end_time, allegheny_county=True, api_version=2)
+        records = []
+        if df is not None:
+            if "zipcodes" in query:
+                df = df[df["zipcode"].astype(str).isin(query["zipcodes"].split(","))]
+            records = toSmellRecords(df, api_version)
+        self.sendBody(200, json.dumps(records), "application/json")
+
+    def sendBody(self, code, body, content_type):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Use the logger instead of printing every request to stderr
+        if self.logger is not None:
+            self.logger.debug(format % args)
+
+
+def toSmellRecords(df, api_version):
+    """
+    Convert raw smell reports (see the getData() function in getData.py) to the records of the SmellPGH API
+
+    The V1 API has "created_at", "latitude", and "longitude", and the V2 API has "observed_at", "latitude",
+        ..."longitude", "zip_code_id", and "additional_comments" (columns that the dataset does not have are null)
+    """
+    df = df.reset_index().rename(columns={"skewed_latitude": "latitude", "skewed_longitude": "longitude"})
+    if api_version == 1:
+        df = df.rename(columns={"EpochTime": "created_at"}).drop(columns=["additional_comments"], errors="ignore")
+        columns = ["latitude", "longitude"]
+    else:
+        df = df.rename(columns={"EpochTime": "observed_at"})
+        columns = ["latitude", "longitude", "zip_code_id", "additional_comments"]
+    for c in columns:
+        if c not in df.columns: df[c] = None
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient="records")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Use 'python replayServer.py [dataset path] [port]', e.g., 'python replayServer.py ../../dataset/v2.1/'")
+    else:
+        serveReplay(ReplayDataSource(sys.argv[1]), port=int(sys.argv[2]) if len(sys.argv) >= 3 else 8001)
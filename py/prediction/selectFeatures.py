@@ -5,6 +5,8 @@ Select features for the machine learning model
 
 import pandas as pd
 import numpy as np
+import hashlib
+from collections import OrderedDict
 from util import log
 from sklearn.feature_selection import SelectPercentile
 from sklearn.feature_selection import SelectFromModel
@@ -12,11 +14,19 @@ from sklearn.feature_selection import SelectFpr
 from sklearn.feature_selection import SelectFdr
 from sklearn.feature_selection import f_regression
 from sklearn.feature_selection import f_classif
-from sklearn.feature_selection import RFE
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.ensemble import ExtraTreesRegressor
 from sklearn.linear_model import Lasso
 from sklearn.linear_model import LogisticRegression
+from sklearn.base import clone
+
+
+# Cache of RFE results (key: hash of the training window and RFE parameters, value: output of rfeRanking)
+RFE_CACHE = OrderedDict()
+RFE_CACHE_SIZE = 256
+
+# The feature ranking of the latest RFE run for each set of candidate features (for warm starts)
+RFE_LAST_RANKING = {}
 
 
 def selectFeatures(
@@ -27,6 +37,8 @@ def selectFeatures(
     out_p=None, # the path for saving features,
     num_feat_rfe=30, # number of features to select for RFE
     step_rfe=10, # step for RFE
+    use_cache=True, # reuse the cached RFE result if the same training window was already processed
+    warm_start=False, # start RFE from the features that are ranked high in the previous RFE run
     logger=None):
     """
     Perform feature selection (or variable selection)
@@ -37,6 +49,7 @@ def selectFeatures(
     log("Select features using method: " + method, logger)
 
     # Select model
+    model = None
     if is_regr:
         if method == "percent":
             model = SelectPercentile(score_func=f_regression, percentile=10)
@@ -49,7 +62,7 @@ def selectFeatures(
             model = SelectFromModel(base)
         elif method == "RFE":
             base = Lasso(alpha=0.1, max_iter=1000)
-            model = RFE(base, step=step_rfe, verbose=1, n_features_to_select=num_feat_rfe)
+            model = base # see the rfeRanking() function
     else:
         if method == "percent":
             model = SelectPercentile(score_func=f_classif, percentile=10)
@@ -62,7 +75,7 @@ def selectFeatures(
             model = SelectFromModel(base)
         elif method == "RFE":
             base = RandomForestClassifier(n_estimators=1000, n_jobs=-1)
-            model = RFE(base, step=step_rfe, verbose=1, n_features_to_select=num_feat_rfe)
+            model = base # see the rfeRanking() function
 
     # If method is None or not supported, just return the original features
     if model is None:
@@ -79,20 +92,29 @@ def selectFeatures(
 
     # Select features
     log("Perform feature selection...", logger)
-    model.fit(df_X_cp, df_Y_cp.squeeze())
-    selected_cols = df_X.columns[model.get_support()]
+    if method == "RFE":
+        rfe = rfeRanking(df_X_cp, df_Y_cp, base, num_feat_rfe, step_rfe,
+            use_cache=use_cache, warm_start=warm_start, logger=logger)
+        selected_cols = rfe["features"]
+    else:
+        model.fit(df_X_cp, df_Y_cp.squeeze())
+        selected_cols = df_X.columns[model.get_support()]
     df_X = df_X[selected_cols]
     log("Select " + str(len(selected_cols)) + " features...", logger)
 
     # Print feature importance
+    # For RFE, the model in the final step is already fitted on the selected features
     log("Compute feature importance...", logger)
-    if is_regr:
-        m = ExtraTreesRegressor(n_estimators=200, n_jobs=-1)
+    if method == "RFE":
+        feat_ims = rfe["importances"]
     else:
-        m = RandomForestClassifier(n_estimators=1000, n_jobs=-1)
-    m.fit(df_X,df_Y.squeeze())
+        if is_regr:
+            m = ExtraTreesRegressor(n_estimators=200, n_jobs=-1)
+        else:
+            m = RandomForestClassifier(n_estimators=1000, n_jobs=-1)
+        m.fit(df_X,df_Y.squeeze())
+        feat_ims = np.array(m.feature_importances_)
     feat_names = df_X.columns.copy()
-    feat_ims = np.array(m.feature_importances_)
     sorted_ims_idx = np.argsort(feat_ims)[::-1]
     feat_names = feat_names[sorted_ims_idx]
     feat_ims = np.round(feat_ims[sorted_ims_idx], 5)
@@ -108,3 +130,106 @@ def selectFeatures(
         df_X.to_csv(out_p, index=False)
         log("Selected features created at " + out_p, logger)
     return df_X, df_Y
+
+
+def rfeRanking(df_X, df_Y, base, n_features, step, use_cache=True, warm_start=False, warm_start_ratio=2, logger=None):
+    """
+    Recursive feature elimination (RFE) with cached rankings
+
+    At each step, the base model is fitted on the remaining features,
+        ...and the "step" features with the lowest importance are eliminated
+    The result is cached with the hash of the training window and the parameters (and the previous ranking
+        ...when warm starting) as the key,
+        ...so running RFE again on the same data (e.g., the same fold for different methods) is free
+    For warm starts, RFE begins with the top (warm_start_ratio * n_features) features ranked by the previous run
+        ...that has the same candidate features (e.g., the previous fold in cross validation),
+        ...which skips the most expensive steps since adjacent folds mostly share the same training data
+
+    Input:
+        df_X (pandas.DataFrame): the features
+        df_Y (pandas.DataFrame): the labels
+        base: the scikit-learn model that provides feature_importances_ or coef_ after fitting
+        n_features (int): the number of features to select
+        step (int or float): the number (or the fraction if between 0 and 1) of features to eliminate at each step
+        use_cache (bool): use the cached result if it exists
+        warm_start (bool): start from the features ranked high in the previous run
+        warm_start_ratio (int): how many times of n_features to keep when warm starting
+        logger: the python logger created by the generateLogger() function
+
+    Output:
+        rfe (dict): the RFE result
+            ...rfe["features"] is the selected features (pandas.Index)
+            ...rfe["importances"] is the importance of the selected features from the model at the final step
+            ...rfe["ranking"] is the ranking of all features (pandas.Series, 1 means the most important)
+            ...rfe["steps"] is the list of (features, importances) for each step
+    """
+    cols = df_X.columns
+    prior = RFE_LAST_RANKING.get(tuple(cols)) if warm_start else None
+    # (a warm start depends on the ranking of the previous run, so the ranking is a part of the key)
+    key = hashTrainingWindow(df_X, df_Y, type(base).__name__, sorted(base.get_params().items()),
+        n_features, step, warm_start, warm_start_ratio, None if prior is None else prior.values.tolist())
+    if use_cache and key in RFE_CACHE:
+        log("Use cached RFE ranking...", logger)
+        RFE_CACHE.move_to_end(key)
+        return RFE_CACHE[key]
+
+    X, Y = df_X.values, np.squeeze(df_Y.values)
+    n_all = len(cols)
+    if 0 < step < 1:
+        step = int(max(1, step * n_all))
+
+    # Candidate features (indices of the columns)
+    candidates = np.arange(n_all)
+    eliminated = [] # features in the order of elimination
+    if prior is not None:
+        n_start = min(n_all, warm_start_ratio * n_features)
+        log("Warm start RFE with the top " + str(n_start) + " features of the previous run...", logger)
+        order = np.argsort(prior.values, kind="stable")
+        candidates = np.sort(order[:n_start])
+        eliminated = list(order[n_start:][::-1])
+
+    # Eliminate features step by step
+    steps = []
+    while True:
+        model = clone(base)
+        model.fit(X[:, candidates], Y)
+        ims = getFeatureImportance(model)
+        steps.append((cols[candidates], ims))
+        if len(candidates) <= n_features: break
+        n_remove = min(step, len(candidates) - n_features)
+        log("RFE: fitted " + str(len(candidates)) + " features, eliminate " + str(n_remove), logger)
+        idx = np.argsort(ims, kind="stable")
+        eliminated += list(candidates[idx[:n_remove]])
+        candidates = np.sort(candidates[idx[n_remove:]])
+
+    # Rank all features, the selected features are ranked by their importance in the final step
+    order = list(candidates[np.argsort(ims, kind="stable")[::-1]]) + eliminated[::-1]
+    ranking = pd.Series(data=np.arange(1, n_all+1), index=cols[order]).reindex(cols)
+    rfe = {"features": cols[candidates], "importances": ims, "ranking": ranking, "steps": steps}
+
+    # Update the cache
+    RFE_LAST_RANKING[tuple(cols)] = ranking
+    if use_cache:
+        RFE_CACHE[key] = rfe
+        while len(RFE_CACHE) > RFE_CACHE_SIZE:
+            RFE_CACHE.popitem(last=False)
+    return rfe
+
+
+def getFeatureImportance(model):
+    """Get the feature importance of a fitted model (feature_importances_ or the norm of coef_)"""
+    if hasattr(model, "feature_importances_"):
+        return np.array(model.feature_importances_)
+    coef = np.array(model.coef_)
+    if coef.ndim == 1:
+        return np.abs(coef)
+    return np.linalg.norm(coef, axis=0, ord=1)
+
+
+def hashTrainingWindow(df_X, df_Y, *params):
+    """Hash the training data (values and column names) together with the parameters"""
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(df_X, index=False).values.tobytes())
+    h.update(pd.util.hash_pandas_object(df_Y, index=False).values.tobytes())
+    h.update(repr((list(df_X.columns), list(df_Y.columns), params)).encode())
+    return h.hexdigest()
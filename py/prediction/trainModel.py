@@ -4,9 +4,16 @@ Train the smell event prediction model
 
 
 import numpy as np
+import pandas as pd
 import copy
-from util import log, findLeastCommon
+from util import log, findLeastCommon, evalEventDetection
 import joblib
+import os
+import tempfile
+import shutil
+import time
+from sklearn.base import clone
+from sklearn.model_selection import TimeSeriesSplit
 
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.svm import SVR
@@ -28,10 +35,12 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import ExtraTreesClassifier
 from sklearn.tree import DecisionTreeClassifier
 from HybridCrowdClassifier import HybridCrowdClassifier
+from modelArtifact import saveModelArtifact, loadModelArtifact
+from profiling import span
 from sklearn.dummy import DummyClassifier
 
 
-def trainModel(train, out_p=None, method="ET", is_regr=False, logger=None):
+def trainModel(train, out_p=None, method="ET", is_regr=False, reduce_forest=False, reduce_tol=0.01, logger=None):
     """
     Train a regression or classification model F such that Y=F(X)
     
@@ -43,6 +52,9 @@ def trainModel(train, out_p=None, method="ET", is_regr=False, logger=None):
         out_p (str): the path for saving the trained model (optional)
         method (str): the method for training the model
         is_regr (bool): regression or classification (see computeFeatures.py)
+        reduce_forest (bool): keep only the smallest number of trees that gives the same event detection f-score
+            ...(see the reduceForest() function, only for tree ensemble classifiers)
+        reduce_tol (float): the f-score that the reduced forest is allowed to lose
         logger: the python logger created by the generateLogger() function
 
     Output:
@@ -143,7 +155,8 @@ def trainModel(train, out_p=None, method="ET", is_regr=False, logger=None):
                 log("ERROR: method " + method + " is not supported", logger)
                 return None
 
-    X, Y = copy.deepcopy(train["X"]), copy.deepcopy(train["Y"])
+    # Fitting does not modify the data, so the arrays are used as they are (e.g., the views of a SharedDataset)
+    X, Y = train["X"], train["Y"]
 
     # For one-class classification task, we only want to use the minority class (because we are sure that they are labeled)
     if not is_regr and method == "IF":
@@ -152,10 +165,138 @@ def trainModel(train, out_p=None, method="ET", is_regr=False, logger=None):
         X, Y = X[select_y], Y[select_y]
 
     # Fit data to the model
-    model.fit(X, np.squeeze(Y))
+    model_unfitted = copy.deepcopy(model) if reduce_forest else None
+    with span("fit", method=method, rows=len(X), cols=X.shape[1] if X.ndim > 1 else 1):
+        model.fit(X, np.squeeze(Y))
+
+    # Remove the trees that are not needed for detecting smell events
+    if reduce_forest:
+        model_full = copy.deepcopy(model)
+        model, df_score = reduceForest(model, model_unfitted, X, Y, C=train.get("C"), tol=reduce_tol, logger=logger)
+        if df_score is not None:
+            reportModelSize({"full": model_full, "reduced": model}, X, logger=logger)
 
     # Save and return model
     if out_p is not None:
-        joblib.dump(model, out_p)
+        # Write to a temporary file first and then rename it,
+        # ...so that a running predictor never loads a partially written model
+        out_p_tmp = out_p + ".tmp"
+        joblib.dump(model, out_p_tmp)
+        os.replace(out_p_tmp, out_p)
         log("Model saved at " + out_p, logger)
     return model
+
+
+def reduceForest(model, model_unfitted, X, Y, C=None, tol=0.01, n_splits=4, sizes=None, logger=None):
+    """
+    Find the smallest sub-forest (the first n trees) that has the same event detection f-score as the full forest
+
+    The forest is trained on the earlier part and tested on the later part of the data in each time-series fold,
+        ...and the probabilities of all sub-forests are computed at once from the cumulative sum over trees
+
+    Input:
+        model: the trained tree ensemble classifier (or the HybridCrowdClassifier that uses it)
+        model_unfitted: a copy of the model before training (for training on the folds)
+        X (pandas.DataFrame): the features (see the trainModel() function)
+        Y (pandas.DataFrame): the labels (see the trainModel() function)
+        C (pandas.DataFrame): the crowd feature, used with the HybridCrowdClassifier
+        tol (float): the f-score that the sub-forest is allowed to lose, compared to the full forest
+        n_splits (int): the number of time-series folds (see sklearn.model_selection.TimeSeriesSplit)
+        sizes (list of int): the numbers of trees to evaluate, None means 10, 20, 50, 100, 200, 500, ...
+        logger: the python logger created by the generateLogger() function
+
+    Output:
+        model: the model that only keeps the first n trees
+        df_score (pandas.DataFrame): the mean f-score over folds for each number of trees (rows)
+    """
+    forest = getattr(model, "base_estimator", model)
+    if forest is None or not hasattr(forest, "estimators_") or forest.n_outputs_ > 1:
+        log("WARNING: reduceForest only works with single-output tree ensembles, keep the model", logger)
+        return model, None
+    n_trees = len(forest.estimators_)
+    if sizes is None:
+        sizes = [b * 10**e for e in range(1, 6) for b in [1, 2, 5] if b * 10**e < n_trees]
+    sizes = sorted(set([k for k in sizes if k < n_trees] + [n_trees]))
+    crowd_thr = getattr(model, "crowd_thr", None)
+    X, Y = np.asarray(X), np.squeeze(np.asarray(Y))
+
+    # Compute the event detection f-score of each sub-forest on each fold
+    score = []
+    for i, (train_idx, test_idx) in enumerate(TimeSeriesSplit(n_splits=n_splits).split(X)):
+        if len(np.unique(Y[train_idx])) < 2:
+            # A forest trained on one class has no probability of the positive class (e.g., no events in early data)
+            log("WARNING: skip fold " + str(i) + " of reduceForest, its training data only has one class", logger,
+                level="warning")
+            continue
+        fold_forest = clone(getattr(model_unfitted, "base_estimator", model_unfitted))
+        fold_forest.fit(X[train_idx], Y[train_idx])
+        X_test = X[test_idx].astype(np.float32)
+        # Cumulative probability of the positive class over trees, shape (n_trees, n_test)
+        prob = np.cumsum([t.predict_proba(X_test, check_input=False)[:, 1] for t in fold_forest.estimators_], axis=0)
+        crowd = np.zeros(len(test_idx), dtype=bool)
+        if crowd_thr is not None and C is not None:
+            crowd = np.squeeze(np.asarray(C)[test_idx] >= crowd_thr)
+        fold_score = []
+        for k in sizes:
+            y_pred = ((prob[k-1] / k > 0.5) | crowd).astype(int)
+            fold_score.append(evalEventDetection(Y[test_idx], y_pred, thr=1)["f_score"])
+        score.append(fold_score)
+        log("Fold " + str(i) + ": f-score of the full forest = " + str(fold_score[-1]), logger)
+    if len(score) == 0:
+        log("WARNING: no fold of reduceForest has both classes, keep the model", logger, level="warning")
+        return model, None
+    df_score = pd.DataFrame(data={"n_trees": sizes, "f_score": np.mean(score, axis=0)})
+
+    # Keep the first n trees (trees in the forest are independent, so the first n trees are a random subset)
+    full_score = df_score["f_score"].iloc[-1]
+    n = int(df_score["n_trees"][df_score["f_score"] >= full_score - tol].min())
+    log("Mean f-score for each number of trees:\n" + df_score.round(3).to_string(index=False), logger)
+    log("Keep " + str(n) + " of " + str(n_trees) + " trees (tolerance = " + str(tol) + ")", logger)
+    if n < n_trees:
+        forest.estimators_ = forest.estimators_[:n]
+        forest.n_estimators = n
+    return model, df_score
+
+
+def reportModelSize(models, X, n_repeats=20, logger=None):
+    """
+    Compare the artifact size, load time, and latency of predicting one row for several models
+
+    Input:
+        models (dict): the models to compare, e.g., {"full": model_full, "reduced": model_reduced}
+            ...each model needs to be supported by the saveModelArtifact() function in modelArtifact.py
+        X (pandas.DataFrame): the features, the first row is used for measuring the latency
+        n_repeats (int): the number of repeats for measuring the time (the median is reported)
+        logger: the python logger created by the generateLogger() function
+
+    Output:
+        df_report (pandas.DataFrame): one row for each model
+    """
+    X_one = X.iloc[:1] if hasattr(X, "iloc") else X[:1]
+    report = []
+    tmp_p = tempfile.mkdtemp()
+    try:
+        for name, model in models.items():
+            p = os.path.join(tmp_p, name)
+            saveModelArtifact(model, p)
+            size = sum(os.path.getsize(os.path.join(p, f)) for f in os.listdir(p))
+            row = {"model": name, "n_trees": len(getattr(getattr(model, "base_estimator", model), "estimators_", [])),
+                "size_mb": size / 1e6}
+            for engine in ["sklearn", "flat"]:
+                t_load, t_pred = [], []
+                for _ in range(n_repeats):
+                    start = time.perf_counter()
+                    m, _ = loadModelArtifact(p, engine=engine)
+                    t_load.append(time.perf_counter() - start)
+                    m = getattr(m, "base_estimator", m)
+                    start = time.perf_counter()
+                    m.predict_proba(X_one)
+                    t_pred.append(time.perf_counter() - start)
+                row["load_ms_" + engine] = 1000 * np.median(t_load)
+                row["latency_ms_" + engine] = 1000 * np.median(t_pred)
+            report.append(row)
+    finally:
+        shutil.rmtree(tmp_p, ignore_errors=True)
+    df_report = pd.DataFrame(report).round(3)
+    log("Model size, load time, and latency of predicting one row:\n" + df_report.to_string(index=False), logger)
+    return df_report
@@ -13,13 +13,8 @@ import pytz
 import pandas as pd
 import numpy as np
 from collections import Counter
-from sklearn.metrics import r2_score
-from sklearn.metrics import mean_squared_error
-from sklearn.metrics import confusion_matrix
-from sklearn.metrics import precision_recall_fscore_support
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from profiling import profiled
+from metrics import ESDR_FETCH_LATENCY, ESDR_FETCH_ERRORS, ESDR_LAST_READING
 
 
 def generateLogger(file_name, log_level=logging.INFO, name=str(uuid.uuid4()), format="%(asctime)s %(levelname)s %(message)s"):
@@ -42,6 +37,8 @@ def log(msg, logger=None, level="info"):
     if logger is not None:
         if level == "info":
             logger.info(msg)
+        elif level == "warning":
+            logger.warning(msg)
         elif level == "error":
             logger.error(msg)
     print(msg)
@@ -64,13 +61,27 @@ def getAllFileNamesInFolder(path):
 
 
 def esdrRootUrl():
-    """Return the root url for ESDR"""
-    return "https://esdr.cmucreatelab.org/"
+    """Return the root url for ESDR (the ESDR_ROOT_URL environment variable overrides it, e.g., for a replay server)"""
+    return os.environ.get("ESDR_ROOT_URL", "https://esdr.cmucreatelab.org/")
 
 
 def smellPghRootUrl():
-    """Return the root url for SmellPGH production"""
-    return "http://api.smellpittsburgh.org/"
+    """Return the root url for SmellPGH production (the SMELLPGH_ROOT_URL environment variable overrides it)"""
+    return os.environ.get("SMELLPGH_ROOT_URL", "http://api.smellpittsburgh.org/")
+
+
+def smellZipcodes(allegheny_county=False):
+    """
+    Return the zipcodes of the smell reports that we use
+
+    Input:
+        allegheny_county (bool): True for general dataset usage in the Allegheny County in Pittsburgh,
+            ...False for our smell pgh paper (only contains a certain zipcodes)
+    """
+    if allegheny_county:
+        return "15006,15007,15014,15015,15017,15018,15020,15024,15025,15028,15030,15031,15032,15034,15035,15037,15044,15045,15046,15047,15049,15051,15056,15064,15065,15071,15075,15076,15082,15084,15086,15088,15090,15091,15095,15096,15101,15102,15104,15106,15108,15110,15112,15116,15120,15122,15123,15126,15127,15129,15131,15132,15133,15134,15135,15136,15137,15139,15140,15142,15143,15144,15145,15146,15147,15148,15201,15202,15203,15204,15205,15206,15207,15208,15209,15210,15211,15212,15213,15214,15215,15216,15217,15218,15219,15220,15221,15222,15223,15224,15225,15226,15227,15228,15229,15230,15231,15232,15233,15234,15235,15236,15237,15238,15239,15240,15241,15242,15243,15244,15250,15251,15252,15253,15254,15255,15257,15258,15259,15260,15261,15262,15264,15265,15267,15268,15270,15272,15274,15275,15276,15277,15278,15279,15281,15282,15283,15286,15289,15290,15295".split(",")
+    else:
+        return "15221,15218,15222,15219,15201,15224,15213,15232,15206,15208,15217,15207,15260,15104".split(",")
 
 
 def datetimeToEpochtime(dt):
@@ -106,6 +117,7 @@ def removeNonAsciiChars(str_in):
     return str_in.encode("ascii", "ignore").decode()
 
 
+@profiled()
 def evalEventDetection(Y_true, Y_pred, thr=40, h=1, round_to_decimal=3):
     """
     Compute a custom metric for evaluating the regression function
@@ -217,6 +229,7 @@ def binary2Interval(Y):
     return intervals
 
 
+@profiled()
 def computeMetric(Y_true, Y_pred, is_regr, flatten=False, simple=False,
         round_to_decimal=3, aggr_axis=False, only_binary=True, event_thr=40):
     """
@@ -232,6 +245,9 @@ def computeMetric(Y_true, Y_pred, is_regr, flatten=False, simple=False,
     - prf: precision, recall, and f-score (for classification) in pandas dataframe format
     - cm: confusion matrix (for classification) in pandas dataframe format
     """
+    # Imported here, so that importing this file does not load scikit-learn (e.g., for the production predictor)
+    from sklearn.metrics import r2_score, mean_squared_error, confusion_matrix, precision_recall_fscore_support
+
     Y_true, Y_pred = deepcopy(Y_true), deepcopy(Y_pred)
     if len(Y_true.shape) > 2: Y_true = np.reshape(Y_true, (Y_true.shape[0], -1))
     if len(Y_pred.shape) > 2: Y_pred = np.reshape(Y_pred, (Y_pred.shape[0], -1))
@@ -343,6 +359,7 @@ def flattenDataframe(df):
     return [idx, val]
 
 
+@profiled()
 def getEsdrData(source, **options):
     """
     Get data from ESDR
@@ -367,28 +384,24 @@ def getEsdrData(source, **options):
     # Loop each source
     data = []
     for s_all in source:
-        df = None
+        dfs = []
         for s in s_all:
             # Read data
             feed_para = "feeds/" + s["feed"]
             channel_para = "/channels/" + s["channel"]
-            df_s = pd.read_csv(api_url + feed_para + channel_para + export_para)
+            try:
+                with ESDR_FETCH_LATENCY.time(feed=s["feed"]):
+                    df_s = pd.read_csv(api_url + feed_para + channel_para + export_para)
+            except Exception:
+                ESDR_FETCH_ERRORS.inc(feed=s["feed"])
+                raise
             df_s.set_index("EpochTime", inplace=True)
+            if len(df_s) > 0:
+                ESDR_LAST_READING.set(df_s.index.max(), feed=s["feed"])
             if "factor" in s:
                 df_s = df_s * s["factor"]
-            if df is None:
-                df = df_s
-            else:
-                # Merge column names
-                c = []
-                for k in zip(df.columns, df_s.columns):
-                    if k[0] != k[1]:
-                        c.append(k[0] + ".." + k[1])
-                    else:
-                        c.append(k[0])
-                df.columns = c
-                df_s.columns = c
-                df = pd.concat([df[~df.index.isin(df_s.index)], df_s])
+            dfs.append(df_s)
+        df = mergeEsdrFeeds(dfs)
         df = df.apply(pd.to_numeric, errors="coerce") # To numeric values
         data.append(df)
 
@@ -396,6 +409,30 @@ def getEsdrData(source, **options):
     return data
 
 
+def mergeEsdrFeeds(dfs):
+    """
+    Merge the data of several ESDR feeds into one data frame (indexed by EpochTime)
+
+    The i-th columns of all feeds are merged into one column named "[column 1]..[column 2]" (if the names differ)
+    A later feed has a higher priority, so its readings replace the readings of earlier feeds at the same time
+    The rows are the rows of each feed that no later feed has, in the order of the feeds
+    """
+    # Merge column names
+    columns = list(dfs[0].columns)
+    for df_s in dfs[1:]:
+        columns = [k0 if k0 == k1 else k0 + ".." + k1 for k0, k1 in zip(columns, df_s.columns)]
+    dfs = [d.iloc[:, :len(columns)].set_axis(columns, axis=1) for d in dfs]
+    if len(dfs) == 1:
+        return dfs[0]
+
+    # Keep the rows from the last feed that has each time (one indexed pass over all rows)
+    df = pd.concat(dfs)
+    source = np.concatenate([np.full(len(d), i) for i, d in enumerate(dfs)])
+    last = pd.Series(source, index=df.index).groupby(level=0).transform("max").values
+    return df[source == last]
+
+
+@profiled()
 def getSmellReports(**options):
     if "api_version" in options and options["api_version"] == 1:
         return getSmellReportsV1(**options)
@@ -410,12 +447,7 @@ def getSmellReportsV2(**options):
     # Url
     api_url = smellPghRootUrl() + "api/v2/"
     api_para = "smell_reports?"
-    if "allegheny_county" in options and options["allegheny_county"] == True:
-        # This is for general dataset usage in the Allegheny County in Pittsburgh
-        api_para += "zipcodes=15006,15007,15014,15015,15017,15018,15020,15024,15025,15028,15030,15031,15032,15034,15035,15037,15044,15045,15046,15047,15049,15051,15056,15064,15065,15071,15075,15076,15082,15084,15086,15088,15090,15091,15095,15096,15101,15102,15104,15106,15108,15110,15112,15116,15120,15122,15123,15126,15127,15129,15131,15132,15133,15134,15135,15136,15137,15139,15140,15142,15143,15144,15145,15146,15147,15148,15201,15202,15203,15204,15205,15206,15207,15208,15209,15210,15211,15212,15213,15214,15215,15216,15217,15218,15219,15220,15221,15222,15223,15224,15225,15226,15227,15228,15229,15230,15231,15232,15233,15234,15235,15236,15237,15238,15239,15240,15241,15242,15243,15244,15250,15251,15252,15253,15254,15255,15257,15258,15259,15260,15261,15262,15264,15265,15267,15268,15270,15272,15274,15275,15276,15277,15278,15279,15281,15282,15283,15286,15289,15290,15295"
-    else:
-        # This is for our smell pgh paper
-        api_para += "zipcodes=15221,15218,15222,15219,15201,15224,15213,15232,15206,15208,15217,15207,15260,15104"
+    api_para += "zipcodes=" + ",".join(smellZipcodes(options.get("allegheny_county") == True))
     if "start_time" in options:
         api_para += "&start_time=" + str(options["start_time"])
     if "end_time" in options:
@@ -450,12 +482,7 @@ def getSmellReportsV1(**options):
     # Url
     api_url = smellPghRootUrl() + "api/v1/"
     api_para = "smell_reports?"
-    if "allegheny_county" in options and options["allegheny_county"] == True:
-        # This is for general dataset usage in the Allegheny County in Pittsburgh
-        api_para += "zipcodes=15006,15007,15014,15015,15017,15018,15020,15024,15025,15028,15030,15031,15032,15034,15035,15037,15044,15045,15046,15047,15049,15051,15056,15064,15065,15071,15075,15076,15082,15084,15086,15088,15090,15091,15095,15096,15101,15102,15104,15106,15108,15110,15112,15116,15120,15122,15123,15126,15127,15129,15131,15132,15133,15134,15135,15136,15137,15139,15140,15142,15143,15144,15145,15146,15147,15148,15201,15202,15203,15204,15205,15206,15207,15208,15209,15210,15211,15212,15213,15214,15215,15216,15217,15218,15219,15220,15221,15222,15223,15224,15225,15226,15227,15228,15229,15230,15231,15232,15233,15234,15235,15236,15237,15238,15239,15240,15241,15242,15243,15244,15250,15251,15252,15253,15254,15255,15257,15258,15259,15260,15261,15262,15264,15265,15267,15268,15270,15272,15274,15275,15276,15277,15278,15279,15281,15282,15283,15286,15289,15290,15295"
-    else:
-        # This is for our smell pgh paper
-        api_para += "zipcodes=15221,15218,15222,15219,15201,15224,15213,15232,15206,15208,15217,15207,15260,15104"
+    api_para += "zipcodes=" + ",".join(smellZipcodes(options.get("allegheny_county") == True))
     if "start_time" in options:
         api_para += "&start_time=" + str(options["start_time"])
     if "end_time" in options:
@@ -485,6 +512,7 @@ def getSmellReportsV1(**options):
     return df
 
 
+@profiled()
 def plotClusterPairGrid(X, Y, out_p, w, h, title, is_Y_continuous,
     c_ls=((0.5, 0.5, 0.5), (0.2275, 0.298, 0.7529), (0.702, 0.0118, 0.149), (0, 1, 0)), # color
     c_alpha=(0.1, 0.1, 0.2, 0.1), # color opacity
@@ -493,6 +521,10 @@ def plotClusterPairGrid(X, Y, out_p, w, h, title, is_Y_continuous,
     """
     Plot a grid of scatter plot pairs in X, with point colors representing binary labels
     """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
     if not is_Y_continuous:
         c_idx = [Y<c_bin[0]]
         for k in range(0, len(c_bin)):